@@ -0,0 +1,102 @@
+## Benchmarks the EmojiMatcher against MessageParser's original character by character emoji replacement. Run it from
+## anywhere with: python code/benchmarks/emoji_benchmark.py
+import re
+import sys
+import timeit
+from pathlib import Path
+
+## Make sure that the bot's modules are importable, no matter where this is run from
+_code_path = str(Path(__file__).resolve().parent.parent)
+if (_code_path not in sys.path):
+    sys.path.insert(0, _code_path)
+
+import emoji
+
+from common.emoji_matcher import EmojiMatcher
+
+
+class LegacyEmojiReplacer:
+    '''The original emoji handling from MessageParser, kept around for comparison'''
+
+    def __init__(self):
+        self.emoji_map = {}
+        for emoji_code, emoji_name in emoji.UNICODE_EMOJI.items():
+            self.emoji_map[emoji_code.lower()] = re.sub(r"_", " ", emoji_name[1:-1])
+
+
+    def replace(self, message):
+        char_array = list(message)
+
+        for index, char in enumerate(char_array):
+            char_lower = char.lower()
+
+            if(char_lower in self.emoji_map):
+                char_array[index] = self.emoji_map[char_lower]
+
+        return ''.join(char_array)
+
+
+    def strip(self, message):
+        char_array = list(message)
+
+        for index, char in enumerate(char_array):
+            char_lower = char.lower()
+
+            if(char_lower in self.emoji_map):
+                del char_array[index]
+
+        return ''.join(char_array)
+
+
+MESSAGES = {
+    "plain text": "The quick brown fox jumps over the lazy dog, and then it does it again for good measure. " * 4,
+    "some emoji": "gg everyone 👍 that was great 😂😂 see you tomorrow 🎉 " * 4,
+    "emoji heavy": "🔥💯🙏😍👀🤔✨🎶❤🙌 " * 20,
+    "multi-codepoint": "👨‍👩‍👧‍👦 family, 👍🏽 thumbs, 🇨🇦 flag, 🏳️‍🌈 rainbow, 👩🏿‍💻 coder " * 4,
+    "long message": ("Lorem ipsum dolor sit amet 😀, consectetur adipiscing elit 🚀. " * 40)
+}
+
+
+def benchmark(function, message: str, number: int) -> float:
+    '''Returns the average number of microseconds that each call took'''
+
+    return timeit.timeit(lambda: function(message), number=number) / number * 1000000
+
+
+def main():
+    number = 2000
+
+    build_seconds = timeit.timeit(LegacyEmojiReplacer, number=1)
+    legacy = LegacyEmojiReplacer()
+    print(f"Legacy build: {build_seconds * 1000:.2f}ms")
+
+    build_seconds = timeit.timeit(lambda: EmojiMatcher(EmojiMatcher.build_emoji_names()), number=1)
+    print(f"Matcher build: {build_seconds * 1000:.2f}ms")
+
+    EmojiMatcher.load_emoji_names()    # Make sure the emoji table's been saved, so only loading it gets timed
+    load_seconds = timeit.timeit(lambda: EmojiMatcher(EmojiMatcher.load_emoji_names()), number=1)
+    matcher = EmojiMatcher.get_shared()
+    print(f"Matcher build from emoji table: {load_seconds * 1000:.2f}ms")
+    print()
+
+    print(f"{'message':<16} {'length':>6} | {'legacy replace':>14} {'replace':>9} {'speedup':>7} | {'legacy strip':>12} {'strip':>9} {'speedup':>7}")
+    for name, message in MESSAGES.items():
+        legacy_replace = benchmark(legacy.replace, message, number)
+        matcher_replace = benchmark(matcher.replace, message, number)
+        legacy_strip = benchmark(legacy.strip, message, number)
+        matcher_strip = benchmark(matcher.strip, message, number)
+
+        print(
+            f"{name:<16} {len(message):>6} | "
+            f"{legacy_replace:>12.1f}us {matcher_replace:>7.1f}us {legacy_replace / matcher_replace:>6.1f}x | "
+            f"{legacy_strip:>10.1f}us {matcher_strip:>7.1f}us {legacy_strip / matcher_strip:>6.1f}x"
+        )
+
+    print()
+    print("Multi-codepoint handling")
+    for message in ["👨‍👩‍👧‍👦", "👍🏽", "🇨🇦", "👩🏿‍💻"]:
+        print(f"  {message} -> legacy: {legacy.replace(message)!r}, matcher: {matcher.replace(message)!r}")
+
+
+if (__name__ == "__main__"):
+    main()
@@ -0,0 +1,88 @@
+## Benchmarks StringSimilarity's algorithms against each other, by scoring searches against the phrase corpus (each
+## phrase's name and description), just like the find command does. Run it from anywhere with:
+## python code/benchmarks/string_similarity_benchmark.py
+import sys
+import timeit
+from pathlib import Path
+
+## Make sure that the bot's modules (and the phrases module) are importable, no matter where this is run from
+_code_path = Path(__file__).resolve().parent.parent
+for _path in [str(_code_path), str(_code_path.parent)]:
+    if (_path not in sys.path):
+        sys.path.insert(0, _path)
+
+from common.string_similarity import StringSimilarity
+from modules.phrases.phrase_file_manager import PhraseFileManager
+from modules.phrases.phrase_search_index import PhraseSearchIndex
+
+
+ALGORITHMS = {
+    StringSimilarity.DIFFLIB: StringSimilarity._calcDifflibDistance,
+    StringSimilarity.JARO_WINKLER: StringSimilarity._calcJaroWinkleDistance,
+    StringSimilarity.DAMERAU_LEVENSHTEIN: StringSimilarity._calcDamerauLevenshteinDistance
+}
+
+MINIMUM_SIMILARITY = 0.5
+
+
+def load_corpus() -> tuple[list[str], list[str]]:
+    '''Loads the strings that get searched (phrase names and descriptions), and some searches built from the names'''
+
+    phrase_file_manager = PhraseFileManager()
+    phrases = []
+    for path in phrase_file_manager.discover_phrase_groups(phrase_file_manager.phrases_folder_path):
+        phrases.extend(phrase_file_manager.load_phrase_group(path).phrases.values())
+
+    corpus = [phrase.name for phrase in phrases] + [phrase.description for phrase in phrases if phrase.description]
+
+    ## Searches are exact names, names with a couple of typos, and some plain words
+    searches = []
+    for phrase in phrases:
+        name = PhraseSearchIndex.normalize(phrase.name)
+        searches.append(name)
+        if (len(name) > 3):
+            searches.append(name[1] + name[0] + name[2:-1])
+    searches.extend(["hello there", "the best song", "good morning everyone"])
+
+    return corpus, searches
+
+
+def benchmark(function, number: int) -> float:
+    '''Returns the average number of milliseconds that each call took'''
+
+    return timeit.timeit(function, number=number) / number * 1000
+
+
+def main():
+    number = 5
+    corpus, searches = load_corpus()
+    print(f"Scoring {len(searches)} searches against {len(corpus)} phrase names and descriptions")
+    print()
+
+    print(f"{'algorithm':<20} | {'pairwise':>10} {'batched':>10} {f'batched >= {MINIMUM_SIMILARITY}':>15}")
+    for name, function in ALGORITHMS.items():
+        StringSimilarity._similarity_function = function
+
+        pairwise = benchmark(lambda: [[function(search, string) for string in corpus] for search in searches], number)
+        batched = benchmark(lambda: [StringSimilarity.similarities(search, corpus) for search in searches], number)
+        thresholded = benchmark(
+            lambda: [StringSimilarity.similarities(search, corpus, MINIMUM_SIMILARITY) for search in searches],
+            number
+        )
+
+        print(f"{name:<20} | {pairwise:>8.1f}ms {batched:>8.1f}ms {thresholded:>13.1f}ms")
+
+    print()
+    print("Best matches")
+    for search in searches[1:8:2]:
+        matches = []
+        for name, function in ALGORITHMS.items():
+            scores = [function(search, string) for string in corpus]
+            best_index = max(range(len(corpus)), key=scores.__getitem__)
+            matches.append(f"{name}: {corpus[best_index]!r} ({scores[best_index]:.2f})")
+
+        print(f"  {search!r} -> {', '.join(matches)}")
+
+
+if (__name__ == "__main__"):
+    main()
@@ -7,7 +7,13 @@ import inspect
 import logging
 import random
 import math
-from typing import Callable
+import mmap
+import shlex
+import struct
+import threading
+from array import array
+from collections import deque
+from typing import AsyncIterator, Callable
 from concurrent import futures
 from pathlib import Path
 
@@ -21,13 +27,293 @@ from common.module.module import Cog
 import discord
 from discord.ext import commands
 from discord.ext.commands import Context
-from discord import app_commands, Interaction, Guild, Member, VoiceClient, VoiceChannel, FFmpegPCMAudio
+from discord import app_commands, Interaction, Guild, Member, VoiceClient, VoiceChannel, AudioSource, FFmpegPCMAudio
+from discord.oggparse import OggStream
+from discord.opus import Encoder as OpusEncoder
 
 ## Config & logging
 CONFIG_OPTIONS = Configuration.load_config()
 LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
 
 
+class OggOpusAudio(AudioSource):
+    '''
+    Plays an Ogg Opus file by passing its Opus packets straight through to Discord. Unlike FFmpegPCMAudio, there's no
+    FFmpeg process to spawn, and no PCM to encode into Opus for every frame.
+    '''
+
+    ## Ogg Opus header packets, which aren't actually audio
+    HEADER_PACKET_PREFIXES = (b"OpusHead", b"OpusTags")
+
+    def __init__(self, file_path: Path):
+        self._file = open(file_path, "rb")
+        self._packets = OggStream(self._file).iter_packets()
+
+
+    def read(self) -> bytes:
+        for packet in self._packets:
+            if (not packet.startswith(self.HEADER_PACKET_PREFIXES)):
+                return packet
+
+        return b""
+
+
+    def is_opus(self) -> bool:
+        return True
+
+
+    def cleanup(self):
+        self._file.close()
+
+
+class WavPCMAudio(AudioSource):
+    '''
+    Plays a PCM WAV file (like the ones that the TTS engine outputs) without spawning FFmpeg. The file is memory mapped,
+    and resampled/upmixed into the 48kHz 16-bit stereo PCM that Discord expects in batches as it's played. Sample width
+    conversion and upmixing are just slice assignments, so only resampling (linear interpolation) runs per sample in
+    Python, which is still a small fraction of a core for the low sample rate speech that the TTS engine outputs.
+    '''
+
+    SAMPLE_RATE = OpusEncoder.SAMPLING_RATE
+    CHANNELS = OpusEncoder.CHANNELS
+    SAMPLE_WIDTH = 2
+    FRAME_SIZE = OpusEncoder.FRAME_SIZE
+    FRAMES_PER_BATCH = 10   ## Number of 20ms frames to convert at once, to keep the per-call overhead down
+    WAVE_FORMAT_PCM = 1
+
+    ## Flips the sign bit of unsigned 8 bit samples, turning them into the high byte of signed 16 bit samples
+    UNSIGNED_TO_SIGNED_TABLE = bytes(value ^ 0x80 for value in range(256))
+
+    def __init__(self, file_path: Path):
+        self._file = open(file_path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._parse_header()
+        except Exception:
+            self.cleanup()
+            raise
+
+        self._buffer = bytearray()
+
+        ## Resampling interpolates across batches, so keep the last source frame around along with the position of the
+        ## next output frame relative to it. Positions are in 1/SAMPLE_RATE source frames, so they're always exact.
+        self._resample_carry = array("h")
+        self._resample_position = 0
+
+        ## Work in whole source frames, so samples never get split across batches
+        source_frame_width = self._channels * self._sample_width
+        source_bytes_per_batch = int(self._sample_rate * 0.02 * self.FRAMES_PER_BATCH) * source_frame_width
+        self._batch_size = max(source_bytes_per_batch, source_frame_width)
+
+    ## Methods
+
+    def _parse_header(self):
+        if (self._mmap[0:4] != b"RIFF" or self._mmap[8:12] != b"WAVE"):
+            raise ValueError("File isn't a RIFF/WAVE file")
+
+        fmt = None
+        position = 12
+        while (position + 8 <= len(self._mmap)):
+            chunk_id = self._mmap[position:position + 4]
+            chunk_size = struct.unpack("<I", self._mmap[position + 4:position + 8])[0]
+            chunk_start = position + 8
+
+            if (chunk_id == b"fmt "):
+                fmt = struct.unpack("<HHIIHH", self._mmap[chunk_start:chunk_start + 16])
+            elif (chunk_id == b"data"):
+                if (fmt is None):
+                    raise ValueError("Missing 'fmt ' chunk before 'data' chunk")
+
+                format_tag, self._channels, self._sample_rate, _, _, bits_per_sample = fmt
+                if (format_tag != self.WAVE_FORMAT_PCM or self._channels not in (1, 2) or bits_per_sample not in (8, 16, 24, 32)):
+                    raise ValueError(f"Unsupported WAV format: tag={format_tag}, channels={self._channels}, bits={bits_per_sample}")
+
+                self._sample_width = bits_per_sample // 8
+                self._position = chunk_start
+                ## Writers occasionally leave a bogus data size (ex. when streaming), so clamp it to the file's size, and
+                ## drop any partially written frame at the end
+                self._end = min(chunk_start + chunk_size, len(self._mmap))
+                self._end -= (self._end - self._position) % (self._channels * self._sample_width)
+                return
+
+            ## Chunks are padded to an even number of bytes
+            position = chunk_start + chunk_size + (chunk_size % 2)
+
+        raise ValueError("Missing 'data' chunk")
+
+
+    def _to_16_bit(self, data: bytes) -> array:
+        '''Converts the little endian samples into native 16 bit samples, by keeping the most significant bytes'''
+
+        sample_width = self._sample_width
+        if (sample_width == self.SAMPLE_WIDTH):
+            converted = bytearray(data)
+        else:
+            converted = bytearray(len(data) // sample_width * 2)
+            if (sample_width == 1):
+                ## 8 bit WAV samples are unsigned, everything else is signed
+                converted[1::2] = data.translate(self.UNSIGNED_TO_SIGNED_TABLE)
+            else:
+                converted[0::2] = data[sample_width - 2::sample_width]
+                converted[1::2] = data[sample_width - 1::sample_width]
+
+        samples = array("h", converted)
+        if (sys.byteorder == "big"):
+            samples.byteswap()
+
+        return samples
+
+
+    def _resample(self, samples: array, final: bool) -> array:
+        '''Linearly interpolates the (interleaved) samples from the file's sample rate to Discord's'''
+
+        channels = self._channels
+        samples = self._resample_carry + samples
+        if (final):
+            ## Hold the last frame, so that the output doesn't stop short of the end of the file
+            samples += samples[-channels:]
+        last_frame = len(samples) // channels - 1
+
+        ## Every output frame is interpolated from the source frames on either side of it, so stop before the last one
+        positions = range(self._resample_position, last_frame * self.SAMPLE_RATE, self._sample_rate)
+        indexes = [position // self.SAMPLE_RATE for position in positions]
+        fractions = [position % self.SAMPLE_RATE / self.SAMPLE_RATE for position in positions]
+
+        resampled = array("h", bytes(len(positions) * channels * self.SAMPLE_WIDTH))
+        for channel in range(channels):
+            channel_samples = samples[channel::channels]
+            resampled[channel::channels] = array("h", [
+                channel_samples[index] + int((channel_samples[index + 1] - channel_samples[index]) * fraction)
+                for index, fraction in zip(indexes, fractions)
+            ])
+
+        if (last_frame >= 0):
+            self._resample_carry = samples[last_frame * channels:]
+            self._resample_position = positions.start + len(positions) * positions.step - positions.stop
+
+        return resampled
+
+
+    def _convert(self, data: bytes, final: bool = False) -> bytes:
+        samples = self._to_16_bit(data)
+
+        ## Resample before upmixing, so there's half as much data to resample for mono files
+        if (self._sample_rate != self.SAMPLE_RATE):
+            samples = self._resample(samples, final)
+
+        if (self._channels == 1):
+            stereo_samples = array("h", bytes(len(samples) * 2 * self.SAMPLE_WIDTH))
+            stereo_samples[0::2] = samples
+            stereo_samples[1::2] = samples
+            samples = stereo_samples
+
+        if (sys.byteorder == "big"):
+            samples.byteswap()
+
+        return samples.tobytes()
+
+
+    def read(self) -> bytes:
+        while (len(self._buffer) < self.FRAME_SIZE and self._position < self._end):
+            batch_end = min(self._position + self._batch_size, self._end)
+            self._buffer += self._convert(self._mmap[self._position:batch_end], batch_end == self._end)
+            self._position = batch_end
+
+        if (not self._buffer):
+            return b""
+
+        frame = bytes(self._buffer[:self.FRAME_SIZE])
+        del self._buffer[:self.FRAME_SIZE]
+
+        ## Pad out the final frame with silence
+        return frame.ljust(self.FRAME_SIZE, b"\x00")
+
+
+    def cleanup(self):
+        if (getattr(self, "_mmap", None) is not None):
+            self._mmap.close()
+            self._mmap = None
+
+        self._file.close()
+
+
+class StreamedAudio(AudioSource):
+    '''
+    Plays a sequence of AudioSources back to back as a single AudioSource. Sources can be added while the audio is
+    already playing, and silence is played whenever the next source isn't ready yet. Playback ends once finish() has
+    been called, and every added source has been played.
+    '''
+
+    ## A single frame of Opus encoded silence
+    OPUS_SILENCE = b"\xf8\xff\xfe"
+
+    def __init__(self, source: AudioSource):
+        self._is_opus = source.is_opus()
+        self._sources: deque[AudioSource] = deque([source])
+        self._current: AudioSource = None
+        self._finished = False
+        self._closed = False
+        self._lock = threading.Lock()  # Sources are added from the event loop, but read from the voice client's thread
+
+
+    def add_source(self, source: AudioSource) -> bool:
+        '''Queues up the source for playback. Returns False (and cleans up the source) if it can't be played.'''
+
+        with self._lock:
+            ## Opus and PCM sources can't be mixed, as the voice client only checks is_opus() once
+            if (not self._closed and source.is_opus() == self._is_opus):
+                self._sources.append(source)
+                return True
+
+        if (not self._closed):
+            LOGGER.warning(f"Unable to add {type(source).__name__} to a stream of {'Opus' if self._is_opus else 'PCM'} audio")
+        source.cleanup()
+        return False
+
+
+    def finish(self):
+        '''Indicates that no more sources will be added, so playback can end once the remaining sources are played'''
+
+        self._finished = True
+
+
+    def read(self) -> bytes:
+        while (True):
+            if (self._current is None):
+                with self._lock:
+                    if (self._sources):
+                        self._current = self._sources.popleft()
+                    elif (self._finished or self._closed):
+                        return b""
+                    else:
+                        return self.OPUS_SILENCE if self._is_opus else b"\x00" * OpusEncoder.FRAME_SIZE
+
+            data = self._current.read()
+            if (data):
+                return data
+
+            self._current.cleanup()
+            self._current = None
+
+
+    def is_opus(self) -> bool:
+        return self._is_opus
+
+
+    def cleanup(self):
+        with self._lock:
+            self._closed = True
+            sources = list(self._sources)
+            self._sources.clear()
+
+        if (self._current is not None):
+            sources.append(self._current)
+            self._current = None
+
+        for source in sources:
+            source.cleanup()
+
+
 class AudioPlayRequest:
     '''
     Represents a user's request for the bot to play some audio.
@@ -39,7 +325,7 @@ class AudioPlayRequest:
         author: Member | None,
         target: Member | None,
         channel: VoiceChannel,
-        audio: FFmpegPCMAudio,
+        audio: AudioSource,
         file_path: Path,
         interaction: Interaction = None,
         callback: Callable = None
@@ -81,7 +367,7 @@ class ServerStateManager:
     ## Property(s)
 
     @property
-    def audio(self) -> discord.FFmpegPCMAudio:
+    def audio(self) -> AudioSource:
         return self.active_play_request.audio
 
 
@@ -311,6 +597,11 @@ class AudioPlayer(Cog):
     SKIP_PERCENTAGE_KEY = "skip_percentage"
     FFMPEG_PARAMETERS_KEY = "ffmpeg_parameters"
     FFMPEG_POST_PARAMETERS_KEY = "ffmpeg_post_parameters"
+    FFMPEG_KEY = "ffmpeg"
+    OPUS_PASSTHROUGH_KEY = "opus_passthrough"
+    IN_PROCESS_WAV_PLAYBACK_KEY = "in_process_wav_playback"
+    OPUS_BITRATE_KEY = "opus_bitrate"
+    OPUS_EXTENSION = "opus"
 
 
     def __init__(self, bot: commands.Bot, channel_timeout_handler = None, *args, **kwargs):
@@ -329,6 +620,11 @@ class AudioPlayer(Cog):
         self.skip_percentage = max(min(float(CONFIG_OPTIONS.get(self.SKIP_PERCENTAGE_KEY, 0.5)), 1.0), 0.0)
         self.ffmpeg_parameters = CONFIG_OPTIONS.get(self.FFMPEG_PARAMETERS_KEY, "")
         self.ffmpeg_post_parameters = CONFIG_OPTIONS.get(self.FFMPEG_POST_PARAMETERS_KEY, "")
+        self.ffmpeg = CONFIG_OPTIONS.get(self.FFMPEG_KEY, "ffmpeg")
+        self.opus_passthrough = CONFIG_OPTIONS.get(self.OPUS_PASSTHROUGH_KEY, False)
+        self.opus_bitrate = CONFIG_OPTIONS.get(self.OPUS_BITRATE_KEY, "64k")
+        self.in_process_wav_playback = CONFIG_OPTIONS.get(self.IN_PROCESS_WAV_PLAYBACK_KEY, False)
+        self._opus_transcodes: dict[Path, asyncio.Task] = {}
 
         ## Commands
         self.add_command(app_commands.Command(
@@ -392,9 +688,76 @@ class AudioPlayer(Cog):
         return server_state
 
 
-    def build_player(self, file_path: Path) -> discord.FFmpegPCMAudio:
+    async def _transcode_to_opus(self, file_path: Path, opus_file_path: Path):
+        partial_opus_file_path = opus_file_path.with_name(f"{opus_file_path.stem}.partial.{self.OPUS_EXTENSION}")
+
+        process = await asyncio.create_subprocess_exec(
+            *shlex.split(self.ffmpeg),
+            "-y",
+            *shlex.split(self.ffmpeg_parameters),
+            "-i", str(file_path),
+            *shlex.split(self.ffmpeg_post_parameters),
+            "-ar", "48000",
+            "-ac", "2",
+            "-c:a", "libopus",
+            "-b:a", str(self.opus_bitrate),
+            "-frame_duration", "20",   ## Discord expects a packet for every 20ms of audio
+            "-f", "ogg",
+            str(partial_opus_file_path),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+
+        try:
+            retval = await process.wait()
+            if (retval != 0):
+                raise RuntimeError(f"Unable to transcode {file_path} into Opus, retval={retval}")
+
+            os.replace(partial_opus_file_path, opus_file_path)
+        except BaseException:
+            if (process.returncode is None):
+                process.kill()
+            partial_opus_file_path.unlink(missing_ok=True)
+            raise
+
+
+    async def get_opus_file(self, file_path: Path) -> Path:
+        '''
+        Gets the Ogg Opus version of the file at file_path, transcoding it if it doesn't already exist. The Opus file is
+        stored alongside the original file, so cached audio only ever needs to be transcoded once.
+        '''
+
+        opus_file_path = file_path.with_suffix(f".{self.OPUS_EXTENSION}")
+        if (opus_file_path.is_file()):
+            return opus_file_path
+
+        ## Share the transcode between any concurrent requests for the same file
+        task = self._opus_transcodes.get(opus_file_path)
+        if (task is None):
+            task = asyncio.create_task(self._transcode_to_opus(file_path, opus_file_path))
+            self._opus_transcodes[opus_file_path] = task
+            task.add_done_callback(lambda _: self._opus_transcodes.pop(opus_file_path, None))
+
+        await asyncio.shield(task)
+        return opus_file_path
+
+
+    async def build_player(self, file_path: Path) -> AudioSource:
         '''Builds an audio player for playing the file located at 'file_path'.'''
 
+        if (self.opus_passthrough):
+            try:
+                return OggOpusAudio(await self.get_opus_file(file_path))
+            except Exception as e:
+                LOGGER.warning(f"Unable to play {file_path} via Opus passthrough, falling back", exc_info=e)
+
+        if (self.in_process_wav_playback and file_path.suffix.lower() == ".wav"):
+            try:
+                return WavPCMAudio(file_path)
+            except Exception as e:
+                LOGGER.warning(f"Unable to play {file_path} in process, falling back to FFmpeg", exc_info=e)
+
         return discord.FFmpegPCMAudio(
             str(file_path),
             before_options=self.ffmpeg_parameters,
@@ -402,14 +765,8 @@ class AudioPlayer(Cog):
         )
 
 
-    async def play_audio(self, file_path: Path, author: Member, target_member: Member, interaction: Interaction = None, callback: Callable = None):
-        '''Plays the given audio file aloud to your channel'''
-
-        ## Make sure file_path points to an actual file
-        if (not file_path.is_file()):
-            error_text = f"Unable to play file at: {file_path}, file doesn't exist or isn't a file."
-            LOGGER.error(error_text)
-            raise FileNotFoundError(error_text)
+    def _get_server_state_for_target(self, target_member: Member) -> tuple[ServerStateManager, VoiceChannel]:
+        '''Gets the server state and voice channel for the target member, making sure that the bot can speak there'''
 
         ## Verify that the target/requester is in a channel
         voice_channel = None
@@ -439,11 +796,73 @@ class AudioPlayer(Cog):
                 can_speak=can_speak
             )
 
+        return state, voice_channel
+
+
+    async def play_audio(self, file_path: Path, author: Member, target_member: Member, interaction: Interaction = None, callback: Callable = None):
+        '''Plays the given audio file aloud to your channel'''
+
+        ## Make sure file_path points to an actual file
+        if (not file_path.is_file()):
+            error_text = f"Unable to play file at: {file_path}, file doesn't exist or isn't a file."
+            LOGGER.error(error_text)
+            raise FileNotFoundError(error_text)
+
+        state, voice_channel = self._get_server_state_for_target(target_member)
+
         ## Build the player, and add it to the state
-        player = self.build_player(file_path)
+        player = await self.build_player(file_path)
         await state.add_play_request(AudioPlayRequest(author, target_member, voice_channel, player, file_path, interaction, callback))
 
 
+    async def play_audio_stream(
+            self,
+            file_paths: AsyncIterator[Path],
+            author: Member,
+            target_member: Member,
+            interaction: Interaction = None,
+            callback: Callable = None
+    ):
+        '''
+        Plays the audio files yielded by file_paths back to back, as a single request. Playback can start as soon as the
+        first file is ready, and the rest of the files are added to the stream as they're yielded.
+        '''
+
+        try:
+            file_path = await anext(file_paths)
+
+            ## Make sure file_path points to an actual file
+            if (not file_path.is_file()):
+                error_text = f"Unable to play file at: {file_path}, file doesn't exist or isn't a file."
+                LOGGER.error(error_text)
+                raise FileNotFoundError(error_text)
+
+            state, voice_channel = self._get_server_state_for_target(target_member)
+
+            ## Build the stream, and add it to the state
+            stream = StreamedAudio(await self.build_player(file_path))
+        except BaseException:
+            await file_paths.aclose()
+            raise
+
+        await state.add_play_request(AudioPlayRequest(author, target_member, voice_channel, stream, file_path, interaction, callback))
+
+        ## Keep feeding the rest of the files into the stream while it plays
+        asyncio.create_task(self._extend_audio_stream(stream, file_paths))
+
+
+    async def _extend_audio_stream(self, stream: StreamedAudio, file_paths: AsyncIterator[Path]):
+        try:
+            async for file_path in file_paths:
+                if (not stream.add_source(await self.build_player(file_path))):
+                    break
+        except Exception as e:
+            LOGGER.exception("Unable to build the rest of the audio stream", exc_info=e)
+        finally:
+            stream.finish()
+            await file_paths.aclose()
+
+
     async def _play_audio_via_server_state(self, server_state: ServerStateManager, file_path: Path, callback: Callable = None):
         '''Internal method for playing audio without a requester. Instead it'll play from the active voice_client.'''
 
@@ -454,7 +873,7 @@ class AudioPlayer(Cog):
             raise FileNotFoundError(error_text)
 
         ## Create a player for the audio file
-        player = self.build_player(file_path)
+        player = await self.build_player(file_path)
 
         ## On successful player creation, build a AudioPlayRequest and push it into the queue
         play_request = AudioPlayRequest(None, None, server_state.voice_client.channel, player, file_path, None, callback)
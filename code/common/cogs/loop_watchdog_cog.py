@@ -0,0 +1,228 @@
+import sys
+import time
+import bisect
+import asyncio
+import logging
+import threading
+import traceback
+from pathlib import Path
+
+from common import utilities
+from common.configuration import Configuration
+from common.database.database_manager import DatabaseManager
+from common.logging import Logging
+from common.module.module import Cog
+
+from discord.ext import commands
+from discord.ext.commands import Bot, Context
+
+## Config & logging
+CONFIG_OPTIONS = Configuration.load_config()
+LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
+
+
+class BlockingCallsite:
+    '''Tracks how often, and for how long, a specific line of code has blocked the event loop'''
+
+    def __init__(self, callsite: str):
+        self.callsite = callsite
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.stack: list[str] = []
+
+
+    def record(self, seconds: float, stack: list[str]):
+        self.count += 1
+        self.total_seconds += seconds
+        if (seconds >= self.max_seconds):
+            self.max_seconds = seconds
+            self.stack = stack
+
+
+class LoopWatchdogCog(Cog):
+    '''
+    Continuously measures the event loop's lag, and finds out what's responsible whenever the loop gets blocked. A
+    heartbeat task on the loop records how late it wakes up, while a separate thread watches the heartbeat. If the
+    heartbeat stalls for longer than the blocking threshold, then the thread captures the loop thread's stack, and the
+    stall gets attributed to the innermost line of the bot's own code in that stack.
+    '''
+
+    ## Upper bounds (in seconds) of the lag histogram's buckets
+    LAG_HISTOGRAM_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+    ## Keys
+    LOOP_WATCHDOG_ENABLE_KEY = "loop_watchdog_enable"
+    LOOP_WATCHDOG_INTERVAL_SECONDS_KEY = "loop_watchdog_interval_seconds"
+    LOOP_WATCHDOG_THRESHOLD_SECONDS_KEY = "loop_watchdog_threshold_seconds"
+    LOOP_WATCHDOG_MAX_OFFENDERS_KEY = "loop_watchdog_max_offenders"
+
+    def __init__(self, bot: Bot, *args, **kwargs):
+        super().__init__(bot, *args, **kwargs)
+
+        self.bot = bot
+        self.admin_cog = kwargs.get('dependencies', {}).get('AdminCog')
+        assert (self.admin_cog is not None)
+        self.database_manager: DatabaseManager = kwargs.get('dependencies', {}).get('DatabaseManager')
+        assert (self.database_manager is not None)
+
+        self.enabled = CONFIG_OPTIONS.get(self.LOOP_WATCHDOG_ENABLE_KEY, True)
+        self.interval_seconds = max(float(CONFIG_OPTIONS.get(self.LOOP_WATCHDOG_INTERVAL_SECONDS_KEY, 0.1)), 0.01)
+        self.threshold_seconds = max(float(CONFIG_OPTIONS.get(self.LOOP_WATCHDOG_THRESHOLD_SECONDS_KEY, 0.25)), 0.01)
+        self.max_offenders = max(int(CONFIG_OPTIONS.get(self.LOOP_WATCHDOG_MAX_OFFENDERS_KEY, 5)), 1)
+        self.root_path = str(utilities.get_root_path())
+        self._file_path = str(Path(__file__).resolve())
+
+        self.lag_histogram = [0] * (len(self.LAG_HISTOGRAM_BUCKETS) + 1)
+        self.max_lag_seconds = 0.0
+        self.callsites: dict[str, BlockingCallsite] = {}
+
+        self._heartbeat_task: asyncio.Task = None
+        self._monitor_thread: threading.Thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._loop_thread_id: int = None
+        self._last_heartbeat = time.monotonic()
+        self._pending_stall: tuple[str, list[str]] = None
+
+        ## This decorator needs to reference the injected dependency, thus we're declaring the command here.
+        @self.admin_cog.admin.command()
+        async def loop_lag(ctx: Context):
+            """Shows the event loop's lag, and the worst offenders for blocking it"""
+
+            await self.database_manager.store(ctx)
+
+            await ctx.reply(f"```\n{self.build_report()[:1950]}\n```")
+
+    ## Methods
+
+    def cog_unload(self):
+        self.stop()
+
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        ## The heartbeat needs to run in the bot's event loop, so it can't be started during initialization
+        if (self.enabled and self._heartbeat_task is None):
+            self.start()
+
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_heartbeat = time.monotonic()
+        self._stop_event.clear()
+
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        self._monitor_thread = threading.Thread(target=self._monitor, name="LoopWatchdog", daemon=True)
+        self._monitor_thread.start()
+
+        LOGGER.info(f"Watching the event loop for blocking calls longer than {self.threshold_seconds} seconds")
+
+
+    def stop(self):
+        self._stop_event.set()
+
+        if (self._heartbeat_task is not None):
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+
+        while (True):
+            expected = loop.time() + self.interval_seconds
+            await asyncio.sleep(self.interval_seconds)
+            lag_seconds = max(loop.time() - expected, 0.0)
+
+            with self._lock:
+                self._last_heartbeat = time.monotonic()
+                pending_stall = self._pending_stall
+                self._pending_stall = None
+
+            self.lag_histogram[bisect.bisect_left(self.LAG_HISTOGRAM_BUCKETS, lag_seconds)] += 1
+            self.max_lag_seconds = max(self.max_lag_seconds, lag_seconds)
+
+            ## Now that the loop's free again, we know how long the blocking call actually took
+            if (pending_stall is not None):
+                callsite, stack = pending_stall
+                LOGGER.warning(
+                    f"Event loop was blocked for {lag_seconds:.3f} seconds by {callsite}\n{''.join(stack)}"
+                )
+
+                if (callsite not in self.callsites):
+                    self.callsites[callsite] = BlockingCallsite(callsite)
+                self.callsites[callsite].record(lag_seconds, stack)
+
+
+    def _monitor(self):
+        '''Runs in its own thread, and captures the loop's stack whenever the heartbeat stalls'''
+
+        stalled = False
+        while (not self._stop_event.wait(self.interval_seconds / 2)):
+            with self._lock:
+                since_heartbeat = time.monotonic() - self._last_heartbeat
+
+            if (since_heartbeat < self.interval_seconds + self.threshold_seconds):
+                stalled = False
+                continue
+
+            ## Only capture the stack once per stall
+            if (stalled):
+                continue
+            stalled = True
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if (frame is None):
+                continue
+
+            stack = traceback.extract_stack(frame)
+            del frame
+
+            with self._lock:
+                self._pending_stall = (self._get_callsite(stack), traceback.format_list(stack))
+
+
+    def _get_callsite(self, stack: traceback.StackSummary) -> str:
+        '''Finds the innermost frame in the stack that's from the bot's own code, as that's what made the blocking call'''
+
+        for frame in reversed(stack):
+            filename = frame.filename
+            if (filename.startswith(self.root_path) and filename != self._file_path and "site-packages" not in filename):
+                return f"{Path(frame.filename).relative_to(self.root_path)}:{frame.lineno} in {frame.name}"
+
+        frame = stack[-1]
+        return f"{frame.filename}:{frame.lineno} in {frame.name}"
+
+
+    def build_report(self) -> str:
+        '''Builds a human readable summary of the event loop's lag, and the worst blocking callsites'''
+
+        if (not self.enabled):
+            return "The loop watchdog is disabled."
+
+        lines = [f"Event loop lag (max: {self.max_lag_seconds:.3f}s)"]
+
+        lower_bound = 0.0
+        for upper_bound, count in zip(self.LAG_HISTOGRAM_BUCKETS, self.lag_histogram):
+            lines.append(f"  {lower_bound:g}s to {upper_bound:g}s: {count}")
+            lower_bound = upper_bound
+        lines.append(f"  {lower_bound:g}s and up: {self.lag_histogram[-1]}")
+
+        offenders = sorted(self.callsites.values(), key=lambda callsite: callsite.total_seconds, reverse=True)
+        lines.append(f"Worst blocking callsites (over {self.threshold_seconds}s)")
+        if (not offenders):
+            lines.append("  None!")
+
+        for offender in offenders[:self.max_offenders]:
+            lines.append(
+                f"  {offender.callsite} - {offender.count} time{'s' if offender.count != 1 else ''}, "
+                f"total: {offender.total_seconds:.3f}s, max: {offender.max_seconds:.3f}s"
+            )
+
+        ## The innermost frames of the worst offender's longest stall are usually enough to see what's going on
+        if (offenders):
+            lines.append(f"Worst stack ({offenders[0].max_seconds:.3f}s)")
+            lines.append("".join(offenders[0].stack[-4:]).rstrip())
+
+        return "\n".join(lines)
@@ -10,6 +10,8 @@ from pathlib import Path
 from common import utilities
 from common.configuration import Configuration
 from common.database.database_manager import DatabaseManager
+from common.database.purge_job import PurgeJob
+from common.delete_request_journal import DeleteRequestJournal
 from common.logging import Logging
 from common.module.module import Cog
 from common.ui.component_factory import ComponentFactory
@@ -30,6 +32,8 @@ class PrivacyManagementCog(Cog):
 
         self.bot = bot
 
+        self.admin_cog = kwargs.get('dependencies', {}).get('AdminCog')
+        assert (self.admin_cog is not None)
         self.component_factory: ComponentFactory = kwargs.get('dependencies', {}).get('ComponentFactory')
         assert(self.component_factory is not None)
         self.database_manager: DatabaseManager = kwargs.get('dependencies', {}).get('DatabaseManager')
@@ -46,7 +50,7 @@ class PrivacyManagementCog(Cog):
         if (delete_request_queue_file_path):
             self.delete_request_queue_file_path = Path(delete_request_queue_file_path)
         else:
-            self.delete_request_queue_file_path = Path.joinpath(utilities.get_root_path(), 'privacy', 'delete_requests.txt')
+            self.delete_request_queue_file_path = Path.joinpath(utilities.get_root_path(), 'privacy', 'delete_requests.journal')
 
         delete_request_meta_file_path = CONFIG_OPTIONS.get('delete_request_meta_file_path')
         if (delete_request_meta_file_path):
@@ -69,7 +73,11 @@ class PrivacyManagementCog(Cog):
             raise RuntimeError(message)
 
         ## Keep a copy of all user ids that should be deleted in memory, so the actual file can't get spammed by repeats.
-        self.queued_user_ids = self.get_all_queued_delete_request_ids()
+        ## Older versions stored the queue as plain text, so make sure those requests get carried over.
+        self.delete_request_journal = DeleteRequestJournal(
+            self.delete_request_queue_file_path,
+            Path.joinpath(self.delete_request_queue_file_path.parent, 'delete_requests.txt')
+        )
 
         ## Load the delete request metadata to know when deletion operations last happened
         try:
@@ -77,6 +85,10 @@ class PrivacyManagementCog(Cog):
         except json.decoder.JSONDecodeError:
             self.metadata = {}
 
+        ## The purge that's currently running (if any), and the last one to finish, for progress reporting
+        self.purge_job: PurgeJob = None
+        self.last_purge_job: PurgeJob = None
+
         ## Perform or prepare the deletion process
         seconds_until_process_delete_request = self.get_seconds_until_process_delete_request_queue_is_due()
         if (seconds_until_process_delete_request <= 0):
@@ -92,6 +104,21 @@ class PrivacyManagementCog(Cog):
                 callback=self.privacy_policy_command
             ))
 
+        ## This decorator needs to reference the injected dependency, thus we're declaring the command here.
+        @self.admin_cog.admin.command()
+        async def purge_status(ctx: Context):
+            """Shows the progress of the delete request queue's purge"""
+
+            await self.database_manager.store(ctx)
+
+            await ctx.reply(f"```\n{self.build_purge_status_report()[:1950]}\n```")
+
+    ## Properties
+
+    @property
+    def queued_user_ids(self) -> set[int]:
+        return self.delete_request_journal.user_ids
+
     ## Methods
 
     def is_file_accessible(self, file_path: Path) -> bool:
@@ -116,41 +143,18 @@ class PrivacyManagementCog(Cog):
                 return False
 
 
-    def get_all_queued_delete_request_ids(self) -> set:
-        """Retrieves all delete request ids from the file, and returns them all in a set"""
-
-        queued_user_ids = None
-
-        with open(self.delete_request_queue_file_path, 'r+') as fd:
-            queued_user_ids = set([int(line.rstrip()) for line in fd.readlines()])
-
-        return queued_user_ids
-
-
-    def empty_queued_delete_request_file(self):
-        open(self.delete_request_queue_file_path, 'w').close()
-
-
     ## Stores's a user's id in a file, which while be used in a batched request to delete their data from the remote DB
     async def store_user_id_for_batch_delete(self, user_id):
         """
         Stores's a user's id in a file, which while be used in a batched request to delete their data from the remote DB
         """
 
-        self.queued_user_ids.add(user_id)
-
-        user_id_written = False
-        while (not user_id_written):
-            try:
-                with open(self.delete_request_queue_file_path, 'a+') as fd:
-                    fd.write(str(user_id) + '\n')
-                user_id_written = True
-            except IOError as e:
-                LOGGER.exception(f"Unable to write id {user_id} to file at {self.delete_request_queue_file_path}.", exc_info=e)
-                ## Give the file some time to close
-                await asyncio.sleep(1);
-
-        return user_id_written
+        try:
+            await self.delete_request_journal.add(user_id)
+            return True
+        except Exception as e:
+            LOGGER.exception(f"Unable to write id {user_id} to file at {self.delete_request_queue_file_path}.", exc_info=e)
+            return False
 
 
     def update_last_process_delete_request_queue_time(self, update_time):
@@ -158,26 +162,61 @@ class PrivacyManagementCog(Cog):
         utilities.save_json(self.delete_request_meta_file_path, self.metadata)
 
 
+    def save_purge_job_checkpoint(self, purge_job_json: dict):
+        """Saves the purge job's progress into the metadata file, so it can be resumed if the bot goes down mid-purge"""
+
+        self.metadata['purge_job'] = purge_job_json
+        utilities.save_json(self.delete_request_meta_file_path, self.metadata)
+
+
     async def process_delete_request_queue(self):
-        ## Perform the operations on a list, since they're slightly easier to wrangle than sets.
-        user_ids = list(self.get_all_queued_delete_request_ids())
+        if (self.purge_job is not None):
+            LOGGER.info("Skipping delete request processing, as it's already in progress.")
+            return
+
+        ## Pick up any purge that was interrupted, otherwise start purging everyone that's currently queued
+        if (purge_job_json := self.metadata.get('purge_job')):
+            purge_job = PurgeJob.from_json(purge_job_json, self.save_purge_job_checkpoint)
+            LOGGER.info(f"Resuming batch delete of {len(purge_job.user_ids)} users from the database")
+        else:
+            user_ids = list(self.queued_user_ids)
+            if (not user_ids):
+                LOGGER.info("Skipping delete request processing, as queue is empty.")
+                return
 
-        if (not user_ids):
-            LOGGER.info("Skipping delete request processing, as queue is empty.")
+            purge_job = PurgeJob(user_ids, self.save_purge_job_checkpoint)
+            LOGGER.info(f"Batch deleting {len(user_ids)} users from the database")
+
+        self.purge_job = purge_job
+        try:
+            await asyncio.to_thread(self.save_purge_job_checkpoint, purge_job.to_json())
+            await self.database_manager.batch_delete_users(purge_job.user_ids, purge_job)
+        except Exception as e:
+            LOGGER.exception("Unable to finish batch delete, it'll be resumed next time the queue is processed", exc_info=e)
             return
+        finally:
+            purge_job.finish()
+            self.purge_job = None
 
-        LOGGER.info(f"Batch deleting {len(user_ids)} users from the database")
-        await self.database_manager.batch_delete_users(user_ids)
+        LOGGER.info(
+            f"Successfully performed batch delete, deleted {purge_job.deleted_count} documents in "
+            f"{purge_job.elapsed_seconds:.1f} seconds"
+        )
+        self.last_purge_job = purge_job
 
-        LOGGER.info("Successfully performed batch delete")
-        self.queued_user_ids = set()
-        self.empty_queued_delete_request_file()
+        ## Users may have requested deletion while the purge was running, so make sure that they stay queued
+        await self.delete_request_journal.remove(purge_job.user_ids)
 
         LOGGER.info("Updating metadata file with time of completion.")
+        self.metadata.pop('purge_job', None)
         self.update_last_process_delete_request_queue_time(datetime.datetime.now(datetime.timezone.utc))
 
 
     def get_seconds_until_process_delete_request_queue_is_due(self):
+        ## An interrupted purge should be finished as soon as possible
+        if (self.metadata.get('purge_job')):
+            return 0
+
         def copy_time_data_into_datetime(source: datetime.datetime, target: datetime.datetime):
             target.replace(hour=source.hour, minute=source.minute, second=source.second, microsecond=0)
 
@@ -206,6 +245,40 @@ class PrivacyManagementCog(Cog):
         await asyncio.sleep(seconds_to_wait)
         await self.process_delete_request_queue()
 
+
+    def build_purge_status_report(self) -> str:
+        """Builds a human readable summary of the current (or last) purge's progress"""
+
+        def build_purge_job_lines(purge_job: PurgeJob) -> list[str]:
+            lines = [f"  Users: {len(purge_job.user_ids)}"]
+            if (purge_job.total_segments is not None):
+                lines.append(f"  Segments scanned: {len(purge_job.completed_segments)}/{purge_job.total_segments}")
+            if (purge_job.completed_user_ids):
+                lines.append(f"  Users purged: {len(purge_job.completed_user_ids)}/{len(set(purge_job.user_ids))}")
+            lines.append(f"  Items scanned: {purge_job.scanned_count} ({purge_job.scanned_per_second:.1f}/s)")
+            lines.append(f"  Items deleted: {purge_job.deleted_count}")
+
+            return lines
+
+        lines = [f"Queued delete requests: {len(self.queued_user_ids)}"]
+
+        if (self.purge_job is not None):
+            lines.append(f"Purge running for {self.purge_job.elapsed_seconds:.1f}s")
+            lines.extend(build_purge_job_lines(self.purge_job))
+        elif (self.metadata.get('purge_job')):
+            lines.append("Purge interrupted, waiting to resume")
+        else:
+            lines.append("No purge running")
+
+        if (self.last_purge_job is not None):
+            lines.append(f"Last purge took {self.last_purge_job.elapsed_seconds:.1f}s")
+            lines.extend(build_purge_job_lines(self.last_purge_job))
+
+        if (last_process_time := self.metadata.get('last_process_time')):
+            lines.append(f"Last completed at {last_process_time}")
+
+        return "\n".join(lines)
+
     ## Commands
 
     async def privacy_policy_command(self, interaction: Interaction):
@@ -243,7 +316,11 @@ class PrivacyManagementCog(Cog):
             await user.send(f"Hey <@{user.id}>, it looks like you've already requested that your data be deleted. That'll automagically happen next {self._delete_request_scheduled_weekday_name}, so sit tight and it'll happen before you know it!")
             return
 
-        await self.store_user_id_for_batch_delete(user.id)
+        if (not await self.store_user_id_for_batch_delete(user.id)):
+            await self.database_manager.store(ctx, valid=False)
+            await user.send(f"Sorry <@{user.id}>, I wasn't able to save your delete request. Please try again in a bit.")
+            return
+
         await self.database_manager.store(ctx)
 
         ## Keep things tidy
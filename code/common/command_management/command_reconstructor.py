@@ -52,17 +52,21 @@ class CommandReconstructor(Module):
         command_string = f"{prefix}{name}{(' ' if parameters else '') + (' '.join(parameters))}"
 
         if (replace_mentions):
-            return self.message_parser.replace_mentions(
-                command_string,
-                interaction.data,
-                hide_mention_formatting=False,
-                hide_meta_mentions=False,
-                anonymize_mentions=anonymize_mentions
-            )
+            return self._replace_interaction_mentions(command_string, interaction, anonymize_mentions)
         else:
             return command_string
 
 
+    def _replace_interaction_mentions(self, command_string: str, interaction: Interaction, anonymize_mentions = False) -> str:
+        return self.message_parser.replace_mentions(
+            command_string,
+            interaction.data,
+            hide_mention_formatting=False,
+            hide_meta_mentions=False,
+            anonymize_mentions=anonymize_mentions
+        )
+
+
     def reconstruct_command_string(self, data: Context | Interaction, add_parameter_keys = False, anonymize_mentions = False, replace_mentions = True) -> str:
         """Builds an approximation of the string entered by the user to invoke the provided command"""
 
@@ -72,3 +76,23 @@ class CommandReconstructor(Module):
             return self._reconstruct_command_from_interaction(data, add_parameter_keys, anonymize_mentions, replace_mentions)
         else:
             raise RuntimeError("Unable to reconstruct command string, data isn't of type Context or Interaction")
+
+
+    def reconstruct_command_strings(self, data: Context | Interaction, add_parameter_keys = False) -> tuple[str, str]:
+        """
+        Builds both the regular and the anonymized approximations of the string entered by the user to invoke the
+        provided command, while only reconstructing the command itself once
+        """
+
+        if (isinstance(data, Context)):
+            ## There aren't any parameters to anonymize
+            command_string = self._reconstruct_command_from_context(data)
+            return command_string, command_string
+        elif (isinstance(data, Interaction)):
+            command_string = self._reconstruct_command_from_interaction(data, add_parameter_keys, replace_mentions=False)
+            return (
+                self._replace_interaction_mentions(command_string, data),
+                self._replace_interaction_mentions(command_string, data, anonymize_mentions=True)
+            )
+        else:
+            raise RuntimeError("Unable to reconstruct command strings, data isn't of type Context or Interaction")
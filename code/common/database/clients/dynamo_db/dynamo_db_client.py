@@ -1,12 +1,20 @@
 import os
+import time
+import random
+import asyncio
 import logging
+import threading
 import boto3
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from boto3.dynamodb.conditions import Key
+from botocore.exceptions import BotoCoreError, ClientError, ParamValidationError
 
 from common.configuration import Configuration
 from common.logging import Logging
 from common.database.database_client import DatabaseClient
+from common.database.database_spool import DatabaseSpool
+from common.database.purge_job import PurgeJob
 from common.database.factories.anonymous_item_factory import AnonymousItemFactory
 from common.database.models.anonymous_item import AnonymousItem
 from common.database.models.detailed_item import DetailedItem
@@ -17,6 +25,20 @@ LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
 
 
 class DynamoDbClient(DatabaseClient):
+    ## DynamoDB's limit on the number of items in a single BatchWriteItem request
+    BATCH_WRITE_MAX_ITEMS = 25
+    ## The number of keys to hand to a single batch writer when deleting
+    BATCH_DELETE_CHUNK_SIZE = 500
+    ## Error codes that mean DynamoDB can't take the request right now, rather than that there's anything wrong with it
+    TRANSIENT_ERROR_CODES = {
+        "ProvisionedThroughputExceededException",
+        "ThrottlingException",
+        "RequestLimitExceeded",
+        "InternalServerError",
+        "ServiceUnavailable",
+        "LimitExceededException"
+    }
+
     def __init__(self):
         name = CONFIG_OPTIONS.get("name", "bot").capitalize()
         self._detailed_table_name = CONFIG_OPTIONS.get("database_detailed_table_name", name)
@@ -26,10 +48,20 @@ class DynamoDbClient(DatabaseClient):
         self.resource = CONFIG_OPTIONS.get('dynamo_db_resource', 'dynamodb')
         self.region_name = CONFIG_OPTIONS.get('dynamo_db_region_name', 'us-east-2')
         self.primary_key = CONFIG_OPTIONS.get('dynamo_db_primary_key', 'QueryId')
+        self.batch_write_max_retries = max(int(CONFIG_OPTIONS.get('dynamo_db_batch_write_max_retries', 5)), 0)
+        self.batch_write_backoff_seconds = max(float(CONFIG_OPTIONS.get('dynamo_db_batch_write_backoff_seconds', 0.1)), 0.0)
+        self.user_id_index_name = CONFIG_OPTIONS.get('dynamo_db_user_id_index_name')
+        self.delete_max_concurrency = max(int(CONFIG_OPTIONS.get('dynamo_db_delete_max_concurrency', 4)), 1)
+        self.scan_segments = max(int(CONFIG_OPTIONS.get('dynamo_db_scan_segments', 4)), 1)
 
         if (credentials_path := CONFIG_OPTIONS.get('dynamo_db_credentials_file_path')):
             os.environ['AWS_SHARED_CREDENTIALS_FILE'] = credentials_path
 
+        ## Anything that can't be written to the database is spooled to disk, and replayed once the database recovers
+        self.spool: DatabaseSpool = None
+        if (CONFIG_OPTIONS.get('database_spool_enable', True)):
+            self.spool = DatabaseSpool()
+
         self.dynamo_db = boto3.resource(self.resource, region_name=self.region_name)
         self.detailed_table = self.dynamo_db.Table(self.detailed_table_name)
         self.anonymous_table = self.dynamo_db.Table(self.anonymous_table_name)
@@ -58,32 +90,45 @@ class DynamoDbClient(DatabaseClient):
         storing it in the Anonymous table.
         """
 
-        ## TTL is DetailedItem only, so no need to worry about the AnonymousItem
-        ttl_expiry_timestamp = int(detailed_item.created_at.timestamp() + self.detailed_table_ttl_seconds)
-
-        detailed_item_json = detailed_item.to_json()
-        detailed_item_json[self.primary_key] = detailed_item.build_primary_key()
-        detailed_item_json["expires_on"] = ttl_expiry_timestamp
+        detailed_item_json = self._build_detailed_item_json(detailed_item)
         try:
             LOGGER.debug(f"Storing detailed data in {self.detailed_table_name}, {detailed_item_json}")
-            self.detailed_table.put_item(Item=detailed_item_json)
+            await asyncio.to_thread(self.detailed_table.put_item, Item=detailed_item_json)
         except Exception as e:
             LOGGER.exception(f"Exception while storing anonymous data into {self.detailed_table_name}", exc_info=e)
 
-        anonymous_item_json = anonymous_item.to_json()
-        anonymous_item_json[self.primary_key] = anonymous_item.build_primary_key()
+        anonymous_item_json = self._build_anonymous_item_json(anonymous_item)
         try:
             LOGGER.debug(f"Storing anonymous data in {self.anonymous_table_name}, {anonymous_item_json}")
-            self.anonymous_table.put_item(Item=anonymous_item_json)
+            await asyncio.to_thread(self.anonymous_table.put_item, Item=anonymous_item_json)
         except Exception as e:
             LOGGER.exception(f"Exception while storing anonymous data into {self.anonymous_table_name}", exc_info=e)
 
 
-    async def batch_delete_users(self, user_ids: list[str]):
+    async def batch_store(self, items: list[tuple[DetailedItem, AnonymousItem]]):
         """
-        Handles deleting all of the listed primary_keys from the supplied table in a batch operation. Note that this
-        only works for tables that only use a primary partition key, if you've got additional keys then this will fail
-        out.
+        Handles storing many items at once with BatchWriteItem, rather than making two put_item requests for each
+        item. Serialization and writes happen off of the event loop, any items that DynamoDB doesn't process are
+        retried, and anything that still can't be written is spooled to disk.
+        """
+
+        await asyncio.to_thread(self._store_items, items)
+
+
+    async def replay(self):
+        """Replays any spooled items into the database"""
+
+        if (self.spool is not None and self.spool.depth > 0):
+            await asyncio.to_thread(self._replay_spool)
+
+
+    async def batch_delete_users(self, user_ids: list[str], purge_job: PurgeJob = None):
+        """
+        Handles deleting all of the given users' documents from the Detailed table in a batch operation. If there's a
+        user_id index on the table, then each user's documents are found with a query, otherwise the table is scanned
+        in parallel segments. Progress is checkpointed into the purge_job as documents are deleted, so a job that was
+        interrupted can pick up where it left off. Note that this only works for tables that only use a primary
+        partition key, if you've got additional keys then this will fail out.
         """
 
         if (not user_ids):
@@ -91,60 +136,311 @@ class DynamoDbClient(DatabaseClient):
             return
 
         LOGGER.info(f"Starting to process {len(user_ids)} delete requests")
-        primary_keys_to_delete = list(map(
-            lambda item: item[self.primary_key],
-            await self.get_keys_from_users(self.detailed_table, user_ids)
-        ))
 
-        LOGGER.info(f"Starting to batch delete {len(primary_keys_to_delete)} documents.")
+        if (purge_job is None):
+            purge_job = PurgeJob(user_ids)
 
-        with self.detailed_table.batch_writer() as batch:
-            for key in primary_keys_to_delete:
-                key_value = {self.primary_key: key}
+        if (self.user_id_index_name):
+            try:
+                await self.delete_users_by_query(self.detailed_table, purge_job)
+                return
+            except Exception as e:
+                LOGGER.exception(f"Unable to query the '{self.user_id_index_name}' index, falling back to a scan", exc_info=e)
 
-                batch.delete_item(
-                    Key = key_value
-                )
+        await self.delete_users_by_scan(self.detailed_table, purge_job)
 
     ## Methods
 
-    def build_multi_user_filter_expression(self, user_ids: list[str] = None):
+    def _build_detailed_item_json(self, detailed_item: DetailedItem) -> dict:
+        ## TTL is DetailedItem only, so no need to worry about the AnonymousItem
+        ttl_expiry_timestamp = int(detailed_item.created_at.timestamp() + self.detailed_table_ttl_seconds)
+
+        detailed_item_json = detailed_item.to_json()
+        detailed_item_json[self.primary_key] = detailed_item.build_primary_key()
+        detailed_item_json["expires_on"] = ttl_expiry_timestamp
+
+        return detailed_item_json
+
+
+    def _build_anonymous_item_json(self, anonymous_item: AnonymousItem) -> dict:
+        anonymous_item_json = anonymous_item.to_json()
+        anonymous_item_json[self.primary_key] = anonymous_item.build_primary_key()
+
+        return anonymous_item_json
+
+
+    def _build_requests(self, items: list[tuple[DetailedItem, AnonymousItem]]) -> list[tuple[str, dict]]:
+        requests: list[tuple[str, dict]] = []
+        for detailed_item, anonymous_item in items:
+            requests.append((self.detailed_table_name, self._build_detailed_item_json(detailed_item)))
+            requests.append((self.anonymous_table_name, self._build_anonymous_item_json(anonymous_item)))
+
+        return requests
+
+
+    @staticmethod
+    def _is_transient_error(exception: Exception) -> bool:
         """
-        Builds a multi user filter expression for querying the database. User ids are OR'd together, so that any
-        document matching any part of the filter will be returned.
+        Whether the write might succeed if it's tried again later (ex. throttling, or the connection dropping), as
+        opposed to DynamoDB rejecting the items themselves (ex. a ValidationException, or an item that can't be
+        serialized)
         """
 
-        if (not user_ids):
-            return None
+        if (isinstance(exception, ClientError)):
+            error_code = exception.response.get("Error", {}).get("Code")
+            status_code = exception.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
 
-        filter_expression = Key('user_id').eq(user_ids[0])
-        for user_id in user_ids[1:]:
-            filter_expression |= Key('user_id').eq(user_id)
+            return (error_code in DynamoDbClient.TRANSIENT_ERROR_CODES or status_code >= 500)
 
-        return filter_expression
+        ## Everything else that botocore raises is about the connection, or the credentials, rather than the items
+        return (isinstance(exception, BotoCoreError) and not isinstance(exception, ParamValidationError))
 
 
-    async def get_keys_from_users(self, table, user_ids: list[str] = None) -> list[str]:
-        """Performs a lookup on the supplied table to determine what primary key each user_id corresponds to"""
+    @staticmethod
+    def _flatten_request_items(request_items: dict[str, list[dict]]) -> list[tuple[str, dict]]:
+        return [
+            (table_name, request["PutRequest"]["Item"])
+            for table_name, table_requests in request_items.items()
+            for request in table_requests
+        ]
 
-        if (not user_ids):
+
+    def _write_individually(self, requests: list[tuple[str, dict]]) -> list[tuple[str, dict]]:
+        """
+        Writes the (table name, item) pairs one at a time, so that any invalid items can be dropped without taking the
+        rest of them down too. Returns the pairs that couldn't be written, in order.
+        """
+
+        for index, request in enumerate(requests):
+            if (unwritten := self._batch_write([request])):
+                return unwritten + requests[index + 1:]
+
+        return []
+
+
+    def _batch_write(self, requests: list[tuple[str, dict]]) -> list[tuple[str, dict]]:
+        """
+        Writes up to BATCH_WRITE_MAX_ITEMS (table name, item) pairs with a single BatchWriteItem request, retrying any
+        unprocessed items with exponential backoff. Items that DynamoDB rejects as invalid are logged and dropped, as
+        retrying them would never work. Returns any (table name, item) pairs that couldn't be written. This blocks, so
+        it should be run off of the event loop.
+        """
+
+        request_items: dict[str, list[dict]] = {}
+        for table_name, item in requests:
+            request_items.setdefault(table_name, []).append({"PutRequest": {"Item": item}})
+
+        attempt = 0
+        while (request_items):
+            LOGGER.debug(f"Batch storing {sum(len(items) for items in request_items.values())} items")
+            try:
+                response = self.dynamo_db.meta.client.batch_write_item(RequestItems=request_items)
+                request_items = response.get("UnprocessedItems") or {}
+            except Exception as e:
+                if (not self._is_transient_error(e)):
+                    ## A single invalid item fails the whole batch, so find out which items are actually at fault
+                    rejected_requests = self._flatten_request_items(request_items)
+                    if (len(rejected_requests) > 1):
+                        LOGGER.warning(f"Batch of {len(rejected_requests)} items was rejected, storing them individually ({e})")
+                        return self._write_individually(rejected_requests)
+
+                    table_name, item = rejected_requests[0]
+                    LOGGER.error(f"Dropping item {item.get(self.primary_key)} for {table_name}, as it was rejected", exc_info=e)
+                    return []
+
+                LOGGER.exception("Exception while batch storing items", exc_info=e)
+
+            if (not request_items):
+                return []
+
+            attempt += 1
+            unprocessed_count = sum(len(items) for items in request_items.values())
+            if (attempt > self.batch_write_max_retries):
+                LOGGER.error(f"Unable to store {unprocessed_count} items after {attempt} attempts")
+                return self._flatten_request_items(request_items)
+
+            ## Unprocessed items usually mean that the table's being throttled, so back off (with jitter) before retrying
+            delay = self.batch_write_backoff_seconds * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            LOGGER.warning(f"{unprocessed_count} items weren't processed, retrying in {delay:.2f} seconds")
+            time.sleep(delay)
+
+
+    def _store_items(self, items: list[tuple[DetailedItem, AnonymousItem]]):
+        self._write_or_spool(self._build_requests(items))
+
+
+    def _write_or_spool(self, requests: list[tuple[str, dict]]):
+        """Writes the (table name, item) pairs to the database, spooling anything that can't be written"""
+
+        ## Items need to be stored in order, so if anything's already spooled, then these have to wait behind them
+        if (self.spool is not None and self.spool.depth > 0):
+            self._spool(requests)
+            self._replay_spool()
+            return
+
+        for start in range(0, len(requests), self.BATCH_WRITE_MAX_ITEMS):
+            unwritten = self._batch_write(requests[start:start + self.BATCH_WRITE_MAX_ITEMS])
+
+            ## The database is struggling, so don't bother trying to write the rest right now
+            if (unwritten):
+                self._spool(unwritten + requests[start + self.BATCH_WRITE_MAX_ITEMS:])
+                return
+
+
+    def _spool(self, requests: list[tuple[str, dict]]):
+        if (self.spool is None):
+            LOGGER.error(f"Dropping {len(requests)} items that couldn't be stored, as the spool is disabled")
+            return
+
+        try:
+            self.spool.append([{"table_name": table_name, "item": item} for table_name, item in requests])
+            LOGGER.warning(f"Spooled {len(requests)} items, spool depth is now {self.spool.depth} ({self.spool.size_bytes} bytes)")
+        except Exception as e:
+            LOGGER.exception(f"Unable to spool {len(requests)} items, dropping them", exc_info=e)
+
+
+    def _replay_spool(self):
+        """
+        Replays the spooled segments into the database, oldest first. Segments are only removed once they've been fully
+        written, and since writes are idempotent puts, a partially replayed segment can just be replayed again later.
+        """
+
+        for segment_path in self.spool.get_segments():
+            records = self.spool.read_segment(segment_path)
+            requests = [(record["table_name"], record["item"]) for record in records]
+
+            for start in range(0, len(requests), self.BATCH_WRITE_MAX_ITEMS):
+                if (self._batch_write(requests[start:start + self.BATCH_WRITE_MAX_ITEMS])):
+                    LOGGER.warning(f"Unable to replay spooled items, spool depth is {self.spool.depth}")
+                    return
+
+            self.spool.remove_segment(segment_path)
+            LOGGER.info(f"Replayed {len(requests)} spooled items, spool depth is now {self.spool.depth}")
+
+
+    def _batch_delete(self, table, primary_keys: list[str]):
+        """Deletes the documents with the given primary keys. This blocks, so it should be run off of the event loop."""
+
+        for start in range(0, len(primary_keys), self.BATCH_DELETE_CHUNK_SIZE):
+            with table.batch_writer(overwrite_by_pkeys=[self.primary_key]) as batch:
+                for key in primary_keys[start:start + self.BATCH_DELETE_CHUNK_SIZE]:
+                    batch.delete_item(Key={self.primary_key: key})
+
+
+    def _delete_user_by_query(self, table, user_id: int, purge_job: PurgeJob, stop_event: threading.Event):
+        """Queries the user_id index for all of a user's documents, and deletes them"""
+
+        if (stop_event.is_set()):
+            return
+
+        query_kwargs = {
+            'IndexName': self.user_id_index_name,
+            'KeyConditionExpression': Key('user_id').eq(user_id),
+            'ProjectionExpression': '#primary_key',
+            'ExpressionAttributeNames': {'#primary_key': self.primary_key}
+        }
+
+        keys = []
+        while (True):
+            response = table.query(**query_kwargs)
+            keys.extend(item[self.primary_key] for item in response.get('Items', []))
+
+            start_key = response.get('LastEvaluatedKey')
+            if (start_key is None):
+                break
+            query_kwargs['ExclusiveStartKey'] = start_key
+
+        self._batch_delete(table, keys)
+        purge_job.checkpoint_users([user_id], len(keys))
+
+
+    def _delete_users_in_segment(
+            self,
+            table,
+            segment: int,
+            total_segments: int,
+            purge_job: PurgeJob,
+            stop_event: threading.Event
+    ):
+        """
+        Scans one segment of the table for the purge job's users' documents, and deletes them a page at a time. The
+        users are matched here, rather than with a FilterExpression, since a filter doesn't reduce the capacity that a
+        scan consumes, and a big enough set of users would overflow DynamoDB's expression size limit anyway.
+        """
+
+        if (purge_job.is_segment_complete(segment)):
             return
 
+        user_ids = set(purge_job.user_ids)
         scan_kwargs = {
-            'FilterExpression': self.build_multi_user_filter_expression(user_ids)
+            'Segment': segment,
+            'TotalSegments': total_segments,
+            'ProjectionExpression': '#primary_key, user_id',
+            'ExpressionAttributeNames': {'#primary_key': self.primary_key}
         }
+        if (start_key := purge_job.get_segment_start_key(segment)):
+            scan_kwargs['ExclusiveStartKey'] = start_key
 
-        ## Scan through the database looking for all documents where the user that made it matches up with one of the
-        ## provided user_ids
-        done = False
-        start_key = None
-        results = []
-        while (not done):
-            if (start_key):
-                scan_kwargs['ExclusiveStartKey'] = start_key
+        while (not stop_event.is_set()):
             response = table.scan(**scan_kwargs)
-            results.extend(response.get('Items', []))
-            start_key = response.get('LastEvaluatedKey', None)
-            done = start_key is None
+            items = response.get('Items', [])
+            keys = [item[self.primary_key] for item in items if int(item.get('user_id', -1)) in user_ids]
+
+            ## Only move the checkpoint past this page once everything in it has been deleted
+            self._batch_delete(table, keys)
+            start_key = response.get('LastEvaluatedKey')
+            purge_job.checkpoint_segment(segment, start_key, len(items), len(keys))
+
+            if (start_key is None):
+                return
+            scan_kwargs['ExclusiveStartKey'] = start_key
+
+
+    async def delete_users_by_query(self, table, purge_job: PurgeJob):
+        """
+        Queries the user_id index on the supplied table for each of the purge job's users, and deletes their documents.
+        Users are processed in parallel, by a pool of delete_max_concurrency threads.
+        """
+
+        user_ids = [user_id for user_id in set(purge_job.user_ids) if not purge_job.is_user_complete(user_id)]
+        if (not user_ids):
+            return
+
+        await self._run_in_thread_pool(
+            self.delete_max_concurrency,
+            [(self._delete_user_by_query, table, user_id, purge_job) for user_id in user_ids]
+        )
+
+
+    async def delete_users_by_scan(self, table, purge_job: PurgeJob):
+        """
+        Scans the supplied table for the purge job's users' documents, and deletes them. The table's split into
+        scan_segments segments, which are scanned in parallel by a pool of threads. This reads the whole table, so
+        prefer delete_users_by_query if the table has a user_id index.
+        """
+
+        total_segments = purge_job.start_scan(self.scan_segments)
 
-        return results
+        await self._run_in_thread_pool(
+            total_segments,
+            [(self._delete_users_in_segment, table, segment, total_segments, purge_job) for segment in range(total_segments)]
+        )
+
+
+    async def _run_in_thread_pool(self, max_workers: int, calls: list[tuple]):
+        """
+        Runs each (function, *args) call in a pool of max_workers threads. Each function gets a stop event as its last
+        argument, which is set as soon as any call fails (or this is cancelled), so the rest can stop early rather than
+        carrying on in the background.
+        """
+
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="purge")
+        stop_event = threading.Event()
+
+        try:
+            await asyncio.gather(*[loop.run_in_executor(executor, *call, stop_event) for call in calls])
+        finally:
+            stop_event.set()
+            ## Don't block the event loop waiting for the threads, they'll wrap up on their own
+            executor.shutdown(wait=False)
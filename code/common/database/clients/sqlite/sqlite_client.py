@@ -0,0 +1,223 @@
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from pathlib import Path
+
+from common import utilities
+from common.configuration import Configuration
+from common.logging import Logging
+from common.database.database_client import DatabaseClient
+from common.database.models.anonymous_item import AnonymousItem
+from common.database.models.detailed_item import DetailedItem
+from common.database.purge_job import PurgeJob
+
+## Config & logging
+CONFIG_OPTIONS = Configuration.load_config(Path(__file__).parent)
+LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
+
+
+class SqliteClient(DatabaseClient):
+    '''
+    Stores data in a local SQLite database, for when there's no need (or no way) to use a remote database. The database
+    runs in WAL mode, so reads don't block writes. Queries run off of the event loop, and expired detailed items are
+    swept out periodically by a background thread (starting as soon as the client's created), as SQLite doesn't have
+    TTLs built in.
+    '''
+
+    ## SQLite's default limit on the number of parameters in a single statement
+    MAX_PARAMETERS = 999
+
+    def __init__(self):
+        name = CONFIG_OPTIONS.get("name", "bot").capitalize()
+        self._detailed_table_name = CONFIG_OPTIONS.get("database_detailed_table_name", name)
+        self._anonymous_table_name = CONFIG_OPTIONS.get("database_anonymous_table_name", f"{name}Anonymous")
+        self._detailed_table_ttl_seconds = int(CONFIG_OPTIONS.get("database_detailed_table_ttl_seconds", 31536000))   ## One year
+        self.ttl_sweep_interval_seconds = max(float(CONFIG_OPTIONS.get("sqlite_ttl_sweep_interval_seconds", 3600)), 1)
+
+        if (database_file_path := CONFIG_OPTIONS.get("sqlite_database_file_path")):
+            self.database_file_path = Path(database_file_path)
+        else:
+            self.database_file_path = Path.joinpath(utilities.get_root_path(), CONFIG_OPTIONS.get("sqlite_database_file", "analytics.sqlite3"))
+
+        detailed_table = self._quote_identifier(self.detailed_table_name)
+        anonymous_table = self._quote_identifier(self.anonymous_table_name)
+        self._insert_detailed_item_sql = f"INSERT OR REPLACE INTO {detailed_table} (query_id, user_id, created_at, data) VALUES (?, ?, ?, ?)"
+        self._insert_anonymous_item_sql = f"INSERT OR REPLACE INTO {anonymous_table} (query_id, created_at, data) VALUES (?, ?, ?)"
+        self._delete_expired_items_sql = f"DELETE FROM {detailed_table} WHERE created_at < ?"
+
+        ## The connection is shared between threads, so access to it needs to be serialized
+        self._lock = threading.Lock()
+        self.connection = self._connect()
+
+        self._stop_sweeping_event = threading.Event()
+        self._sweeper_thread = threading.Thread(target=self._sweep_periodically, name="SqliteTtlSweeper", daemon=True)
+        self._sweeper_thread.start()
+
+    ## Implemented Properties
+
+    @property
+    def detailed_table_name(self) -> str:
+        return self._detailed_table_name
+
+
+    @property
+    def anonymous_table_name(self) -> str:
+        return self._anonymous_table_name
+
+
+    @property
+    def detailed_table_ttl_seconds(self) -> int:
+        return self._detailed_table_ttl_seconds
+
+    ## Implemented Methods
+
+    async def store(self, detailed_item: DetailedItem, anonymous_item: AnonymousItem):
+        """
+        Handles storing the given detailed item data into the Detailed table, as well as anonymizing the data and
+        storing it in the Anonymous table.
+        """
+
+        await self.batch_store([(detailed_item, anonymous_item)])
+
+
+    async def batch_store(self, items: list[tuple[DetailedItem, AnonymousItem]]):
+        """Handles storing many items at once, in a single transaction. Serialization happens off of the event loop."""
+
+        try:
+            LOGGER.debug(f"Storing {len(items)} items in {self.database_file_path}")
+            await asyncio.to_thread(self._store_items, items)
+        except Exception as e:
+            LOGGER.exception(f"Exception while storing {len(items)} items in {self.database_file_path}", exc_info=e)
+
+
+    async def batch_delete_users(self, user_ids: list[str], purge_job: PurgeJob = None):
+        """Handles deleting all of the given users' data from the Detailed table"""
+
+        if (not user_ids):
+            LOGGER.warning("No user_ids provided, unable to batch delete users")
+            return
+
+        LOGGER.info(f"Starting to process {len(user_ids)} delete requests")
+        deleted = await asyncio.to_thread(self._delete_users, [int(user_id) for user_id in user_ids])
+        LOGGER.info(f"Deleted {deleted} documents.")
+
+        if (purge_job is not None):
+            purge_job.checkpoint_users([int(user_id) for user_id in user_ids], deleted)
+
+    ## Methods
+
+    @staticmethod
+    def _quote_identifier(identifier: str) -> str:
+        return '"' + identifier.replace('"', '""') + '"'
+
+
+    def _connect(self) -> sqlite3.Connection:
+        self.database_file_path.parent.mkdir(parents=True, exist_ok=True) # mkdir -p
+
+        connection = sqlite3.connect(self.database_file_path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")    # Durable enough with WAL, and far fewer fsyncs
+
+        detailed_table = self._quote_identifier(self.detailed_table_name)
+        anonymous_table = self._quote_identifier(self.anonymous_table_name)
+        with connection:
+            connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS {detailed_table} (
+                    query_id TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    created_at INTEGER NOT NULL,
+                    data TEXT NOT NULL
+                )
+            """)
+            connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS {anonymous_table} (
+                    query_id TEXT PRIMARY KEY,
+                    created_at INTEGER NOT NULL,
+                    data TEXT NOT NULL
+                )
+            """)
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {self._quote_identifier(self.detailed_table_name + '_user_id')} ON {detailed_table} (user_id)")
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {self._quote_identifier(self.detailed_table_name + '_created_at')} ON {detailed_table} (created_at)")
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {self._quote_identifier(self.anonymous_table_name + '_created_at')} ON {anonymous_table} (created_at)")
+
+        return connection
+
+
+    def _store_items(self, items: list[tuple[DetailedItem, AnonymousItem]]):
+        detailed_rows = []
+        anonymous_rows = []
+        for detailed_item, anonymous_item in items:
+            detailed_item_json = detailed_item.to_json()
+            detailed_rows.append((
+                detailed_item.build_primary_key(),
+                detailed_item_json["user_id"],
+                detailed_item_json["created_at"],
+                json.dumps(detailed_item_json)
+            ))
+
+            anonymous_item_json = anonymous_item.to_json()
+            anonymous_rows.append((
+                anonymous_item.build_primary_key(),
+                anonymous_item_json["created_at"],
+                json.dumps(anonymous_item_json)
+            ))
+
+        with self._lock:
+            with self.connection:
+                self.connection.executemany(self._insert_detailed_item_sql, detailed_rows)
+                self.connection.executemany(self._insert_anonymous_item_sql, anonymous_rows)
+
+
+    def _delete_users(self, user_ids: list[int]) -> int:
+        detailed_table = self._quote_identifier(self.detailed_table_name)
+        deleted = 0
+
+        with self._lock:
+            with self.connection:
+                for start in range(0, len(user_ids), self.MAX_PARAMETERS):
+                    chunk = user_ids[start:start + self.MAX_PARAMETERS]
+                    cursor = self.connection.execute(
+                        f"DELETE FROM {detailed_table} WHERE user_id IN ({', '.join('?' * len(chunk))})",
+                        chunk
+                    )
+                    deleted += cursor.rowcount
+
+        return deleted
+
+
+    def _sweep_expired_items(self):
+        """Removes any detailed items that have outlived the TTL"""
+
+        now = time.time()
+
+        ## Timestamps are stored in milliseconds
+        expiry_timestamp = int((now - self.detailed_table_ttl_seconds) * 1000)
+        with self._lock:
+            with self.connection:
+                cursor = self.connection.execute(self._delete_expired_items_sql, (expiry_timestamp,))
+
+        if (cursor.rowcount > 0):
+            LOGGER.info(f"Swept {cursor.rowcount} expired items out of {self.detailed_table_name}")
+
+
+    def _sweep_periodically(self):
+        """Sweeps out expired items right away, and then once every sweep interval until the client's stopped"""
+
+        while (True):
+            try:
+                self._sweep_expired_items()
+            except Exception as e:
+                LOGGER.exception(f"Exception while sweeping expired items out of {self.detailed_table_name}", exc_info=e)
+
+            if (self._stop_sweeping_event.wait(self.ttl_sweep_interval_seconds)):
+                return
+
+
+    def stop_sweeping(self):
+        """Stops sweeping out expired items, and waits for any sweep that's in progress to finish"""
+
+        self._stop_sweeping_event.set()
+        self._sweeper_thread.join()
@@ -2,6 +2,7 @@ from abc import ABC, abstractmethod
 
 from common.database.models.anonymous_item import AnonymousItem
 from common.database.models.detailed_item import DetailedItem
+from common.database.purge_job import PurgeJob
 
 
 class DatabaseClient(ABC):
@@ -31,6 +32,19 @@ class DatabaseClient(ABC):
         raise NotImplementedError(f"The abstract {DatabaseClient.store.__name__} method hasn't been implemented yet!")
 
 
+    async def batch_store(self, items: list[tuple[DetailedItem, AnonymousItem]]):
+        """Stores each of the (DetailedItem, AnonymousItem) pairs. Clients that can write in bulk should override this."""
+
+        for detailed_item, anonymous_item in items:
+            await self.store(detailed_item, anonymous_item)
+
+
+    async def replay(self):
+        """Replays anything that the client couldn't previously store. Clients that hold onto failed items should override this."""
+
+        return
+
+
     @abstractmethod
-    async def batch_delete_users(self, user_ids: list[str]):
+    async def batch_delete_users(self, user_ids: list[str], purge_job: PurgeJob = None):
         raise NotImplementedError(f"The abstract {DatabaseClient.batch_delete_users.__name__} method hasn't been implemented yet!")
@@ -1,5 +1,6 @@
 import logging
 import inspect
+import asyncio
 
 from discord import app_commands, Interaction
 from discord.ext.commands import Context
@@ -11,6 +12,7 @@ from common.database.factories.anonymous_item_factory import AnonymousItemFactor
 from common.database.models.anonymous_item import AnonymousItem
 from common.database.models.detailed_item import DetailedItem
 from common.database.database_client import DatabaseClient
+from common.database.purge_job import PurgeJob
 from common.exceptions import UnableToStoreInDatabaseException
 from common.module.module import Module
 
@@ -29,9 +31,19 @@ class DatabaseManager(Module):
         assert (self.anonymous_item_factory is not None)
 
         self.enabled = CONFIG_OPTIONS.get('database_enable', False)
+        self.buffer_max_size = max(int(CONFIG_OPTIONS.get('database_buffer_max_size', 1000)), 1)
+        self.flush_size = max(int(CONFIG_OPTIONS.get('database_flush_size', 50)), 1)
+        self.flush_interval_seconds = max(float(CONFIG_OPTIONS.get('database_flush_interval_seconds', 10)), 0.1)
 
         self._client: DatabaseClient = client
 
+        ## Items are buffered and written in the background, so storage never holds up a response to the user. Note
+        ## that the flusher gets (re)started lazily, as modules are loaded in a different event loop than the bot's.
+        self._buffer: list[tuple[DetailedItem, AnonymousItem]] = []
+        self._flush_event: asyncio.Event = None
+        self._flusher_task: asyncio.Task = None
+        self._loop: asyncio.AbstractEventLoop = None
+
     ## Methods
 
     def register_client(self, client: DatabaseClient):
@@ -39,7 +51,7 @@ class DatabaseManager(Module):
         self._client = client
 
 
-    def _build_detailed_item_from_context(self, context: Context, valid: bool = None) -> DetailedItem:
+    def _build_detailed_item_from_context(self, context: Context, query: str, valid: bool = None) -> DetailedItem:
         """Builds a DetailedItem from the given discord.Context, pulled from the message that invoked the bot"""
 
         voice_state = context.author.voice
@@ -54,14 +66,14 @@ class DatabaseManager(Module):
             context.guild,
             context.command.qualified_name,
             context.command.name,
-            self.command_reconstructor.reconstruct_command_string(context, add_parameter_keys = True),
+            query,
             isinstance(context.command, app_commands.Command),
             context.message.created_at,
             valid or not context.command_failed
         )
 
 
-    def _build_detailed_item_from_interaction(self, interaction: Interaction, valid: bool = None) -> DetailedItem:
+    def _build_detailed_item_from_interaction(self, interaction: Interaction, query: str, valid: bool = None) -> DetailedItem:
         """Builds a DetailedItem from the given discord.Interaction, pulled from the message that invoked the bot"""
 
         voice_state = interaction.user.voice
@@ -76,13 +88,59 @@ class DatabaseManager(Module):
             interaction.guild,
             interaction.command.qualified_name,
             interaction.command.name,
-            self.command_reconstructor.reconstruct_command_string(interaction, add_parameter_keys = True),
+            query,
             isinstance(interaction.command, app_commands.Command),
             interaction.created_at,
             valid or not interaction.command_failed
         )
 
 
+    def _ensure_flusher_started(self):
+        loop = asyncio.get_running_loop()
+        if (self._loop is loop):
+            return
+
+        self._loop = loop
+        self._flush_event = asyncio.Event()
+        self._flusher_task = loop.create_task(self._flusher())
+
+
+    async def _flusher(self):
+        """
+        Flushes the buffer whenever it fills up past the flush size, or after the flush interval elapses. Also gives the
+        client a chance to replay anything that it couldn't store previously.
+        """
+
+        while (True):
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+            self._flush_event.clear()
+            await self.flush()
+
+            try:
+                await self._client.replay()
+            except Exception as e:
+                LOGGER.exception("Exception while replaying previously unstored items", exc_info=e)
+
+
+    async def flush(self):
+        """Writes everything in the buffer to the registered database"""
+
+        if (not self._buffer or self._client is None):
+            return
+
+        items, self._buffer = self._buffer, []
+
+        try:
+            LOGGER.debug(f"Flushing {len(items)} buffered item{'s' if len(items) != 1 else ''} to the database")
+            await self._client.batch_store(items)
+        except Exception as e:
+            LOGGER.exception(f"Exception while storing {len(items)} buffered items", exc_info=e)
+
+
     async def _store(self, detailed_item: DetailedItem, anonymous_item: AnonymousItem):
         """Handles storage of the given DetailedItem in the registered database"""
 
@@ -92,26 +150,44 @@ class DatabaseManager(Module):
         if (self._client is None):
             raise UnableToStoreInDatabaseException("Unable to store data without a client registered!")
 
-        await self._client.store(detailed_item, anonymous_item)
+        ## Analytics aren't worth slowing the bot down (or running out of memory) for, so drop them if the database
+        ## can't keep up
+        if (len(self._buffer) >= self.buffer_max_size):
+            LOGGER.warning(f"Database buffer is full ({len(self._buffer)} items), dropping item")
+            return
+
+        self._buffer.append((detailed_item, anonymous_item))
+        self._ensure_flusher_started()
+
+        if (len(self._buffer) >= self.flush_size):
+            self._flush_event.set()
 
 
     async def store(self, data: Context | Interaction, valid: bool = None):
         """Handles storage of the given Context or Interaction (by converting it into a DetailedItem) in the registered database"""
 
+        if (not isinstance(data, (Context, Interaction))):
+            raise UnableToStoreInDatabaseException("Data is not of type Context or Interaction")
+
+        ## Don't bother building any items if they're not going to be stored
+        if (not self.enabled):
+            return
+
+        query, anonymous_query = self.command_reconstructor.reconstruct_command_strings(data, add_parameter_keys=True)
         if (isinstance(data, Context)):
-            detailed_item = self._build_detailed_item_from_context(data, valid)
-            anonymous_item = self.anonymous_item_factory.create(data, detailed_item)
-        elif (isinstance(data, Interaction)):
-            detailed_item = self._build_detailed_item_from_interaction(data, valid)
-            anonymous_item = self.anonymous_item_factory.create(data, detailed_item)
+            detailed_item = self._build_detailed_item_from_context(data, query, valid)
         else:
-            raise UnableToStoreInDatabaseException("Data is not of type Context or Interaction")
+            detailed_item = self._build_detailed_item_from_interaction(data, query, valid)
+        anonymous_item = self.anonymous_item_factory.create(data, detailed_item, anonymous_query)
 
         await self._store(detailed_item, anonymous_item)
 
 
-    async def batch_delete_users(self, user_ids: list[str]):
-        """Handles a batched delete operation to remove users from from the Detailed table"""
+    async def batch_delete_users(self, user_ids: list[str], purge_job: PurgeJob = None):
+        """
+        Handles a batched delete operation to remove users from from the Detailed table. Progress is tracked in the
+        purge_job, if one is provided.
+        """
 
         if (not self.enabled):
             return
@@ -119,4 +195,4 @@ class DatabaseManager(Module):
         if (self._client is None):
             raise UnableToStoreInDatabaseException("Unable to batch delete data without a client registered!")
 
-        await self._client.batch_delete_users(user_ids)
+        await self._client.batch_delete_users(user_ids, purge_job)
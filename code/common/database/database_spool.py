@@ -0,0 +1,176 @@
+import os
+import json
+import logging
+import threading
+from pathlib import Path
+
+from common import utilities
+from common.configuration import Configuration
+from common.logging import Logging
+
+## Config & logging
+CONFIG_OPTIONS = Configuration.load_config()
+LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
+
+
+class DatabaseSpool:
+    '''
+    Durable, append only spool of JSON records, for holding onto data while the database is unavailable. Records are
+    written to JSONL segment files, which are rotated once they grow past a maximum size. Each append is fsynced once,
+    no matter how many records it contains. Segments are read back oldest first, so records can be replayed in the same
+    order that they were spooled in. Note that this class blocks on disk I/O, so it should be used off of the event loop.
+    '''
+
+    SEGMENT_PREFIX = "segment-"
+    SEGMENT_EXTENSION = "jsonl"
+
+    ## Keys
+    DATABASE_SPOOL_DIR_KEY = "database_spool_dir"
+    DATABASE_SPOOL_DIR_PATH_KEY = "database_spool_dir_path"
+    DATABASE_SPOOL_SEGMENT_MAX_BYTES_KEY = "database_spool_segment_max_bytes"
+    DATABASE_SPOOL_MAX_BYTES_KEY = "database_spool_max_bytes"
+
+    def __init__(self):
+        if (spool_dir_path := CONFIG_OPTIONS.get(self.DATABASE_SPOOL_DIR_PATH_KEY)):
+            self.spool_dir_path = Path(spool_dir_path)
+        else:
+            self.spool_dir_path = Path.joinpath(utilities.get_root_path(), CONFIG_OPTIONS.get(self.DATABASE_SPOOL_DIR_KEY, "spool"))
+
+        self.segment_max_bytes = max(int(CONFIG_OPTIONS.get(self.DATABASE_SPOOL_SEGMENT_MAX_BYTES_KEY, 1048576)), 1)    ## One MiB
+        self.max_bytes = max(int(CONFIG_OPTIONS.get(self.DATABASE_SPOOL_MAX_BYTES_KEY, 104857600)), 1)                  ## 100 MiB
+
+        self._lock = threading.Lock()
+        self._segment_records: dict[Path, int] = {}     # Segment paths, oldest first, and the number of records in each
+        self._segment_bytes: dict[Path, int] = {}
+        self._next_segment_number = 0
+        self._active_segment_path: Path = None
+
+        self._init_spool_dir()
+
+    ## Properties
+
+    @property
+    def depth(self) -> int:
+        '''The number of records currently spooled'''
+
+        return sum(self._segment_records.values())
+
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(self._segment_bytes.values())
+
+    ## Methods
+
+    def _init_spool_dir(self):
+        '''Makes sure the spool directory exists, and picks up any segments that were spooled in previous runs'''
+
+        self.spool_dir_path.mkdir(parents=True, exist_ok=True) # mkdir -p
+
+        for segment_path in sorted(self.spool_dir_path.glob(f"{self.SEGMENT_PREFIX}*.{self.SEGMENT_EXTENSION}")):
+            try:
+                segment_number = int(segment_path.stem[len(self.SEGMENT_PREFIX):])
+            except ValueError:
+                continue
+
+            with open(segment_path, "rb") as segment:
+                self._segment_records[segment_path] = sum(1 for line in segment if line.strip())
+            self._segment_bytes[segment_path] = segment_path.stat().st_size
+            self._next_segment_number = max(self._next_segment_number, segment_number + 1)
+
+        if (self.depth > 0):
+            LOGGER.info(f"Found {self.depth} spooled record{'s' if self.depth != 1 else ''} in {self.spool_dir_path}")
+
+
+    def _build_segment_path(self) -> Path:
+        segment_path = Path.joinpath(
+            self.spool_dir_path,
+            f"{self.SEGMENT_PREFIX}{self._next_segment_number:010d}.{self.SEGMENT_EXTENSION}"
+        )
+        self._next_segment_number += 1
+
+        return segment_path
+
+
+    def _remove_segment(self, segment_path: Path):
+        self._segment_records.pop(segment_path, None)
+        self._segment_bytes.pop(segment_path, None)
+        if (self._active_segment_path == segment_path):
+            self._active_segment_path = None
+
+        try:
+            os.remove(segment_path)
+        except FileNotFoundError:
+            pass
+
+
+    def append(self, records: list[dict]):
+        '''Durably appends the records to the spool'''
+
+        if (not records):
+            return
+
+        data = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records).encode("utf-8")
+
+        with self._lock:
+            ## Rotate into a new segment once the current one is full
+            if (
+                self._active_segment_path is None or
+                self._segment_bytes.get(self._active_segment_path, 0) >= self.segment_max_bytes
+            ):
+                self._active_segment_path = self._build_segment_path()
+                self._segment_records[self._active_segment_path] = 0
+                self._segment_bytes[self._active_segment_path] = 0
+
+            with open(self._active_segment_path, "ab") as segment:
+                segment.write(data)
+                segment.flush()
+                os.fsync(segment.fileno())
+
+            self._segment_records[self._active_segment_path] += len(records)
+            self._segment_bytes[self._active_segment_path] += len(data)
+
+            ## Don't let the spool fill up the disk if the database is gone for good
+            while (self.size_bytes > self.max_bytes and len(self._segment_records) > 1):
+                oldest_segment_path = next(iter(self._segment_records))
+                LOGGER.error(
+                    f"Spool is over its maximum size, dropping {self._segment_records[oldest_segment_path]} records "
+                    f"in {oldest_segment_path}"
+                )
+                self._remove_segment(oldest_segment_path)
+
+
+    def get_segments(self) -> list[Path]:
+        '''
+        Gets the paths of all of the spooled segments, oldest first. The active segment is sealed, so any records that
+        are appended after this will go into a new segment.
+        '''
+
+        with self._lock:
+            self._active_segment_path = None
+            return list(self._segment_records.keys())
+
+
+    def read_segment(self, segment_path: Path) -> list[dict]:
+        '''Reads the records from a segment, in the order that they were appended'''
+
+        records = []
+        with open(segment_path, "rb") as segment:
+            for line in segment:
+                if (not line.strip()):
+                    continue
+
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    ## Most likely a partially written record from a crash mid-append
+                    LOGGER.warning(f"Skipping corrupt record in {segment_path}")
+
+        return records
+
+
+    def remove_segment(self, segment_path: Path):
+        '''Removes a segment, once its records have been successfully replayed'''
+
+        with self._lock:
+            self._remove_segment(segment_path)
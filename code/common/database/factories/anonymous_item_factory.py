@@ -14,15 +14,19 @@ class AnonymousItemFactory(Module):
         assert (self.command_reconstructor is not None)
 
 
-    def create(self, data: Interaction | Context, detailed_item: DetailedItem) -> AnonymousItem:
-        return AnonymousItem(
-            detailed_item.qualified_command_string,
-            detailed_item.command_name,
-            self.command_reconstructor.reconstruct_command_string(
+    def create(self, data: Interaction | Context, detailed_item: DetailedItem, query: str = None) -> AnonymousItem:
+        ## The anonymized query can be passed in, if it was already reconstructed alongside the detailed item's query
+        if (query is None):
+            query = self.command_reconstructor.reconstruct_command_string(
                 data,
                 add_parameter_keys=True,
                 anonymize_mentions=True
-            ),
+            )
+
+        return AnonymousItem(
+            detailed_item.qualified_command_string,
+            detailed_item.command_name,
+            query,
             detailed_item.is_app_command,
             detailed_item.created_at,
             detailed_item.is_valid
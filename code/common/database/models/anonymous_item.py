@@ -12,6 +12,15 @@ LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
 
 
 class AnonymousItem(CommandItem):
+    __slots__ = (
+        "qualified_command_string",
+        "command_name",
+        "query",
+        "is_app_command",
+        "created_at",
+        "is_valid"
+    )
+
     def __init__(
             self,
             qualified_command_string: str,
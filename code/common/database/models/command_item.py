@@ -3,6 +3,9 @@ from typing import Dict
 
 
 class CommandItem(metaclass=ABCMeta):
+    ## Items are created for every command, so keep them compact. Subclasses should declare their own slots too.
+    __slots__ = ()
+
     @abstractmethod
     def to_json(self) -> Dict:
         return
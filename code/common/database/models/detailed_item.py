@@ -14,6 +14,23 @@ LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
 
 
 class DetailedItem(CommandItem):
+    __slots__ = (
+        "user_id",
+        "user_name",
+        "text_channel_id",
+        "text_channel_name",
+        "voice_channel_id",
+        "voice_channel_name",
+        "server_id",
+        "server_name",
+        "qualified_command_string",
+        "command_name",
+        "query",
+        "is_app_command",
+        "created_at",
+        "is_valid"
+    )
+
     def __init__(
             self,
             author: Member,
@@ -28,7 +45,8 @@ class DetailedItem(CommandItem):
             is_valid: bool
     ):
         self.user_id = int(author.id)
-        self.author = author
+        ## Only keep the bits of the author that are needed, rather than holding onto the whole Member
+        self.user_name = f"{author.name}#{author.discriminator}"
         self.text_channel_id = text_channel.id
         self.text_channel_name = text_channel.name
         self.voice_channel_id = voice_channel.id if voice_channel else None
@@ -47,7 +65,7 @@ class DetailedItem(CommandItem):
     def to_json(self) -> dict:
         return {
             "user_id": self.user_id,
-            "user_name": f"{self.author.name}#{self.author.discriminator}",
+            "user_name": self.user_name,
             "text_channel_id": self.text_channel_id,
             "text_channel_name": self.text_channel_name,
             "voice_channel_id": self.voice_channel_id,
@@ -0,0 +1,155 @@
+import time
+import logging
+import threading
+from typing import Callable
+
+from common.configuration import Configuration
+from common.logging import Logging
+
+## Config & logging
+CONFIG_OPTIONS = Configuration.load_config()
+LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
+
+
+class PurgeJob:
+    '''
+    Tracks the progress of purging a batch of users' data from the database, so that it can be reported on while it
+    runs, and resumed from where it left off if it's interrupted. Progress is checkpointed per scan segment (or per user,
+    when users are looked up individually), and only after the data covered by the checkpoint has been deleted. Note
+    that checkpoints are made from the database client's worker threads, so on_checkpoint is called from those threads
+    (one at a time) with the job's serialized state.
+    '''
+
+    def __init__(self, user_ids: list[int], on_checkpoint: Callable[[dict], None] = None):
+        self.user_ids = [int(user_id) for user_id in user_ids]
+        self.on_checkpoint = on_checkpoint
+
+        self.total_segments: int = None
+        self.segment_start_keys: dict[int, dict] = {}
+        self.completed_segments: set[int] = set()
+        self.completed_user_ids: set[int] = set()
+        self.scanned_count = 0
+        self.deleted_count = 0
+
+        self.started_at = time.time()
+        self.finished_at: float = None
+        self._initial_scanned_count = 0
+        self._lock = threading.Lock()
+
+    ## Properties
+
+    @property
+    def elapsed_seconds(self) -> float:
+        '''The number of seconds that the job has been running for (or ran for), since it was started or resumed'''
+
+        return (self.finished_at or time.time()) - self.started_at
+
+
+    @property
+    def scanned_per_second(self) -> float:
+        '''The number of items scanned per second, since the job was started or resumed'''
+
+        return (self.scanned_count - self._initial_scanned_count) / max(self.elapsed_seconds, 0.001)
+
+    ## Methods
+
+    @classmethod
+    def from_json(cls, data: dict, on_checkpoint: Callable[[dict], None] = None) -> 'PurgeJob':
+        '''Rebuilds a job from a previous checkpoint, so that it can be resumed'''
+
+        purge_job = cls(data.get("user_ids", []), on_checkpoint)
+        purge_job.total_segments = data.get("total_segments")
+        purge_job.segment_start_keys = {int(segment): key for segment, key in data.get("segment_start_keys", {}).items()}
+        purge_job.completed_segments = set(data.get("completed_segments", []))
+        purge_job.completed_user_ids = set(data.get("completed_user_ids", []))
+        purge_job.scanned_count = data.get("scanned_count", 0)
+        purge_job.deleted_count = data.get("deleted_count", 0)
+        purge_job._initial_scanned_count = purge_job.scanned_count
+
+        return purge_job
+
+
+    def finish(self):
+        '''Marks the job as no longer running, whether it completed or failed, so its timings stop growing'''
+
+        if (self.finished_at is None):
+            self.finished_at = time.time()
+
+
+    def to_json(self) -> dict:
+        with self._lock:
+            return self._to_json()
+
+
+    def _to_json(self) -> dict:
+        return {
+            "user_ids": self.user_ids,
+            "total_segments": self.total_segments,
+            "segment_start_keys": {str(segment): key for segment, key in self.segment_start_keys.items()},
+            "completed_segments": sorted(self.completed_segments),
+            "completed_user_ids": sorted(self.completed_user_ids),
+            "scanned_count": self.scanned_count,
+            "deleted_count": self.deleted_count
+        }
+
+
+    def _checkpoint(self):
+        if (self.on_checkpoint is None):
+            return
+
+        try:
+            self.on_checkpoint(self._to_json())
+        except Exception as e:
+            LOGGER.exception("Unable to checkpoint purge job", exc_info=e)
+
+
+    def start_scan(self, total_segments: int) -> int:
+        '''
+        Gets the number of segments to scan the table with. If the job's being resumed, then it has to keep using the
+        same number of segments that it started with, otherwise the segment checkpoints won't line up.
+        '''
+
+        with self._lock:
+            if (self.total_segments is None):
+                self.total_segments = total_segments
+
+            return self.total_segments
+
+
+    def get_segment_start_key(self, segment: int) -> dict:
+        with self._lock:
+            return self.segment_start_keys.get(segment)
+
+
+    def is_segment_complete(self, segment: int) -> bool:
+        with self._lock:
+            return segment in self.completed_segments
+
+
+    def checkpoint_segment(self, segment: int, start_key: dict, scanned_count: int, deleted_count: int):
+        '''Records a scanned (and purged) page of a segment. A start_key of None means that the segment is done.'''
+
+        with self._lock:
+            if (start_key is None):
+                self.segment_start_keys.pop(segment, None)
+                self.completed_segments.add(segment)
+            else:
+                self.segment_start_keys[segment] = start_key
+
+            self.scanned_count += scanned_count
+            self.deleted_count += deleted_count
+            self._checkpoint()
+
+
+    def is_user_complete(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self.completed_user_ids
+
+
+    def checkpoint_users(self, user_ids: list[int], deleted_count: int):
+        '''Records that all of the given users' data has been purged'''
+
+        with self._lock:
+            self.completed_user_ids.update(user_ids)
+            self.deleted_count += deleted_count
+            self._checkpoint()
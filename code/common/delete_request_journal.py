@@ -0,0 +1,217 @@
+import os
+import zlib
+import struct
+import asyncio
+import logging
+from pathlib import Path
+
+from common.configuration import Configuration
+from common.logging import Logging
+
+## Config & logging
+CONFIG_OPTIONS = Configuration.load_config()
+LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
+
+
+class DeleteRequestJournal:
+    '''
+    Crash safe, append only journal of the user ids that have requested their data be deleted, backed by an in-memory
+    set for quick lookups. Each id is written as a length prefixed, checksummed record, so a record that was only
+    partially written when the bot went down is detected and dropped on load, rather than corrupting the rest of the
+    journal. Ids that are added at the same time are written with a single fsync, and removing ids atomically replaces
+    the journal with one that holds only the ids that remain. File I/O happens off of the event loop.
+    '''
+
+    MAGIC = b"HAWKDRJ1"
+    RECORD_HEADER = struct.Struct("<II")    # Payload length, payload CRC32
+    USER_ID = struct.Struct("<Q")
+
+    def __init__(self, journal_path: Path, legacy_path: Path = None):
+        self.journal_path = journal_path
+        self._user_ids: set[int] = set()
+        self._pending_user_ids: list[int] = []
+        self._lock: asyncio.Lock = None
+        self._file = None
+
+        self._load(legacy_path)
+
+    ## Properties
+
+    @property
+    def user_ids(self) -> set[int]:
+        return self._user_ids
+
+    ## Methods
+
+    def _build_record(self, user_id: int) -> bytes:
+        payload = self.USER_ID.pack(user_id)
+
+        return self.RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+    def _read_records(self, data: bytes) -> tuple[set[int], int]:
+        '''Reads the user ids out of the journal's data, and returns them along with the length of the valid data'''
+
+        user_ids = set()
+        offset = len(self.MAGIC)
+        while (offset + self.RECORD_HEADER.size <= len(data)):
+            length, crc = self.RECORD_HEADER.unpack_from(data, offset)
+            payload = data[offset + self.RECORD_HEADER.size:offset + self.RECORD_HEADER.size + length]
+            if (length != self.USER_ID.size or len(payload) != length or zlib.crc32(payload) != crc):
+                break
+
+            user_ids.add(self.USER_ID.unpack(payload)[0])
+            offset += self.RECORD_HEADER.size + length
+
+        return user_ids, offset
+
+
+    def _read_legacy_user_ids(self, path: Path) -> set[int]:
+        '''Reads user ids from the old plain text format, which had one id per line'''
+
+        with open(path, 'r') as fd:
+            return set(int(line.strip()) for line in fd if line.strip().isdigit())
+
+
+    def _load(self, legacy_path: Path = None):
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True) # mkdir -p
+
+        data = b""
+        if (self.journal_path.is_file()):
+            with open(self.journal_path, 'rb') as fd:
+                data = fd.read()
+
+        if (data and not data.startswith(self.MAGIC)):
+            ## The journal's actually in the old plain text format, so migrate it in place
+            LOGGER.info(f"Migrating plain text delete requests in {self.journal_path}")
+            self._user_ids = self._read_legacy_user_ids(self.journal_path)
+            self._write_journal(self._user_ids)
+        elif (not data and self._is_separate_legacy_file(legacy_path)):
+            LOGGER.info(f"Migrating plain text delete requests from {legacy_path} into {self.journal_path}")
+            self._user_ids = self._read_legacy_user_ids(legacy_path)
+            self._write_journal(self._user_ids)
+            os.remove(legacy_path)
+        elif (not data):
+            self._write_journal(set())
+        else:
+            self._user_ids, valid_length = self._read_records(data)
+            if (valid_length < len(data)):
+                ## Most likely a partially written record from a crash mid-append, so cut it off
+                LOGGER.warning(f"Dropping {len(data) - valid_length} bytes of corrupt records from {self.journal_path}")
+                with open(self.journal_path, 'r+b') as fd:
+                    fd.truncate(valid_length)
+                    fd.flush()
+                    os.fsync(fd.fileno())
+
+        self._open_for_append()
+        LOGGER.info(f"Loaded {len(self._user_ids)} delete requests from {self.journal_path}")
+
+
+    def _is_separate_legacy_file(self, legacy_path: Path = None) -> bool:
+        '''
+        Whether there's a plain text file to migrate from. The journal may have been configured to live at the legacy
+        path itself, in which case it's already been read (and migrated in place, if it needed to be).
+        '''
+
+        if (legacy_path is None or not legacy_path.is_file()):
+            return False
+
+        return (legacy_path.resolve() != self.journal_path.resolve())
+
+
+    def _open_for_append(self):
+        '''Opens the journal for appending records, making sure that it starts with the header first'''
+
+        self.close()
+
+        self._file = open(self.journal_path, 'ab')
+        if (self._file.tell() == 0):
+            self._file.write(self.MAGIC)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+
+    def close(self):
+        if (self._file is not None):
+            self._file.close()
+            self._file = None
+
+
+    def _write_journal(self, user_ids: set[int]):
+        '''Atomically replaces the journal with one that contains just the given user ids'''
+
+        self.close()
+
+        temp_path = Path(f"{self.journal_path}.tmp")
+        with open(temp_path, 'wb') as fd:
+            fd.write(self.MAGIC + b"".join(self._build_record(user_id) for user_id in user_ids))
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(temp_path, self.journal_path)
+
+        ## Make sure the rename itself is durable too, where the platform supports it
+        if (hasattr(os, "O_DIRECTORY")):
+            directory_fd = os.open(self.journal_path.parent, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory_fd)
+            finally:
+                os.close(directory_fd)
+
+        self._open_for_append()
+
+
+    def _append(self, user_ids: list[int]):
+        self._file.write(b"".join(self._build_record(user_id) for user_id in user_ids))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+    def _get_lock(self) -> asyncio.Lock:
+        ## The lock has to be created inside the bot's event loop, rather than when the journal is loaded
+        if (self._lock is None):
+            self._lock = asyncio.Lock()
+
+        return self._lock
+
+
+    async def add(self, user_id: int) -> bool:
+        '''
+        Durably adds the user id to the journal. Returns False if it was already there. Any other ids that are added
+        while this one is being written will get written together, once this write finishes.
+        '''
+
+        user_id = int(user_id)
+        if (user_id in self._user_ids):
+            return False
+
+        self._user_ids.add(user_id)
+        self._pending_user_ids.append(user_id)
+
+        async with self._get_lock():
+            ## Another add may have already written this id while waiting on the lock
+            if (not self._pending_user_ids):
+                if (user_id not in self._user_ids):
+                    raise IOError(f"Unable to write delete request for {user_id} to {self.journal_path}")
+                return True
+
+            pending_user_ids = self._pending_user_ids
+            self._pending_user_ids = []
+            try:
+                await asyncio.to_thread(self._append, pending_user_ids)
+            except Exception:
+                self._user_ids.difference_update(pending_user_ids)
+                raise
+
+        return True
+
+
+    async def remove(self, user_ids: list[int]):
+        '''Removes the user ids from the journal, by atomically replacing it with one that holds all of the other ids'''
+
+        user_ids = set(int(user_id) for user_id in user_ids)
+
+        async with self._get_lock():
+            await asyncio.to_thread(self._write_journal, self._user_ids - user_ids)
+
+            ## Any ids that were added during the write are still pending, so they'll be appended to the new journal
+            self._user_ids.difference_update(user_ids)
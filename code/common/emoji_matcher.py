@@ -0,0 +1,286 @@
+import os
+import re
+import logging
+import importlib.metadata
+from pathlib import Path
+
+from common import utilities
+from common.configuration import Configuration
+from common.logging import Logging
+
+## Config & logging
+CONFIG_OPTIONS = Configuration.load_config()
+LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
+
+
+class EmojiMatcher:
+    '''
+    Finds emoji in text, including multi-codepoint emoji (ZWJ sequences, skin tones, flags, keycaps, etc), in linear
+    time. Multi-codepoint emoji always contain a modifier or a ZWJ, so a regex built from the emoji's codepoints picks
+    out those sequences (skipping the search entirely when there aren't any modifiers in the text), and each one's
+    looked up by name. Sequences that aren't a known emoji as a whole (ex: emoji that are right next to each other) are
+    split up by walking a trie of the emoji's codepoints, taking the longest emoji at each position. Any remaining single
+    codepoint emoji are then handled with str.translate. Building the matcher isn't free, so use get_shared() to get the
+    instance that's shared across the process.
+
+    The emoji names are precomputed into a table on disk, so the (heavy) emoji package only needs to be imported when
+    that table's missing, or was built for a different version of the package.
+    '''
+
+    ZERO_WIDTH_JOINER = "\u200d"
+
+    ## Marks the end of an emoji in the trie, and holds its name
+    _NAME = ""
+
+    EMOJI_TABLE_MAGIC = b"HAWKEMJ1"
+    ## Bump this whenever the table's format or contents change, so any existing tables get rebuilt
+    EMOJI_TABLE_FORMAT_VERSION = 1
+    _RECORD_SEPARATOR = "\x1e"
+    _UNIT_SEPARATOR = "\x1f"
+
+    ## Keys
+    EMOJI_TABLE_DIR_KEY = "emoji_table_dir"
+    EMOJI_TABLE_DIR_PATH_KEY = "emoji_table_dir_path"
+
+    _shared: 'EmojiMatcher' = None
+
+    def __init__(self, emoji_names: dict[str, str]):
+        self.emoji_names = emoji_names
+
+        ## The trie's only needed for the rare sequences that aren't a single known emoji, so it's built on demand
+        self._trie: dict = None
+
+        self._replace_table = {ord(code): name for code, name in emoji_names.items() if len(code) == 1}
+        self._strip_table = {codepoint: None for codepoint in self._replace_table}
+        self._build_regexes(emoji_names)
+
+    ## Methods
+
+    @staticmethod
+    def build_emoji_names() -> dict[str, str]:
+        '''Builds the map of emoji codepoint sequences to their human readable names (ex: '👍' -> 'thumbs up')'''
+
+        import emoji    # Slow to import, and only needed when the emoji table has to be (re)built
+
+        emoji_names = {}
+        for emoji_code, emoji_name in emoji.UNICODE_EMOJI.items():
+            ## Multi-codepoint emoji have spaces between each codepoint in the emoji package, so remove them
+            emoji_names[emoji_code.replace(" ", "")] = re.sub(r"_", " ", emoji_name[1:-1])
+
+        return emoji_names
+
+
+    @staticmethod
+    def get_emoji_version() -> str:
+        try:
+            return importlib.metadata.version("emoji")
+        except importlib.metadata.PackageNotFoundError:
+            import emoji
+            return getattr(emoji, "__version__", "unknown")
+
+
+    @classmethod
+    def get_emoji_table_path(cls, emoji_version: str) -> Path:
+        if (emoji_table_dir_path := CONFIG_OPTIONS.get(cls.EMOJI_TABLE_DIR_PATH_KEY)):
+            emoji_table_dir_path = Path(emoji_table_dir_path)
+        else:
+            emoji_table_dir_path = Path.joinpath(utilities.get_root_path(), CONFIG_OPTIONS.get(cls.EMOJI_TABLE_DIR_KEY, "cache"))
+
+        return Path.joinpath(emoji_table_dir_path, f"emoji_table-{emoji_version}-v{cls.EMOJI_TABLE_FORMAT_VERSION}.bin")
+
+
+    @classmethod
+    def _build_emoji_table_header(cls, emoji_version: str) -> bytes:
+        return cls.EMOJI_TABLE_MAGIC + f"{emoji_version}:{cls.EMOJI_TABLE_FORMAT_VERSION}\n".encode("utf-8")
+
+
+    @classmethod
+    def _read_emoji_table(cls, path: Path, emoji_version: str) -> dict[str, str]:
+        '''Reads the emoji names out of the table, or returns None if it's missing or was built for something else'''
+
+        if (not path.is_file()):
+            return None
+
+        ## Every record ends up in the emoji names anyway, so the table's just read in one go
+        with open(path, "rb") as fd:
+            table = fd.read()
+
+        header = cls._build_emoji_table_header(emoji_version)
+        if (not table.startswith(header)):
+            return None
+
+        records = str(memoryview(table)[len(header):], "utf-8").split(cls._RECORD_SEPARATOR)
+        return dict(record.split(cls._UNIT_SEPARATOR, 1) for record in records if record)
+
+
+    @classmethod
+    def _write_emoji_table(cls, path: Path, emoji_version: str, emoji_names: dict[str, str]):
+        path.parent.mkdir(parents=True, exist_ok=True) # mkdir -p
+
+        records = cls._RECORD_SEPARATOR.join(
+            f"{emoji_code}{cls._UNIT_SEPARATOR}{emoji_name}" for emoji_code, emoji_name in emoji_names.items()
+        )
+
+        ## Write to a temporary file first, so other processes never see a partially written table
+        temp_path = Path(f"{path}.{os.getpid()}.tmp")
+        with open(temp_path, "wb") as fd:
+            fd.write(cls._build_emoji_table_header(emoji_version) + records.encode("utf-8"))
+        os.replace(temp_path, path)
+
+
+    @classmethod
+    def load_emoji_names(cls) -> dict[str, str]:
+        '''Loads the emoji names from the table on disk, building (and saving) the table first if necessary'''
+
+        emoji_version = cls.get_emoji_version()
+        path = cls.get_emoji_table_path(emoji_version)
+
+        try:
+            if ((emoji_names := cls._read_emoji_table(path, emoji_version)) is not None):
+                return emoji_names
+        except Exception as e:
+            LOGGER.warning(f"Unable to read emoji table at {path}, rebuilding it", exc_info=e)
+
+        emoji_names = cls.build_emoji_names()
+        try:
+            cls._write_emoji_table(path, emoji_version, emoji_names)
+            LOGGER.info(f"Saved emoji table for emoji {emoji_version} to {path}")
+        except Exception as e:
+            LOGGER.warning(f"Unable to save emoji table to {path}", exc_info=e)
+
+        return emoji_names
+
+
+    @classmethod
+    def get_shared(cls) -> 'EmojiMatcher':
+        '''Gets the shared matcher, building it if necessary. That blocks for a while, so do it while starting up.'''
+
+        if (cls._shared is None):
+            cls._shared = cls(cls.load_emoji_names())
+
+        return cls._shared
+
+
+    def _get_trie(self) -> dict:
+        if (self._trie is None):
+            self._trie = {}
+            for emoji_code, emoji_name in self.emoji_names.items():
+                node = self._trie
+                for char in emoji_code:
+                    node = node.setdefault(char, {})
+                node[self._NAME] = emoji_name
+
+        return self._trie
+
+
+    @staticmethod
+    def _build_character_class(chars: set[str]) -> str:
+        ## An empty character class isn't valid, so match nothing instead (ex: when no emoji have modifiers)
+        if (not chars):
+            return r"[^\s\S]"
+
+        ## Collapse runs of consecutive codepoints into ranges, since the regex engine checks them far faster than a long
+        ## list of individual characters
+        ranges = []
+        for codepoint in sorted(ord(char) for char in chars):
+            if (ranges and ranges[-1][1] == codepoint - 1):
+                ranges[-1][1] = codepoint
+            else:
+                ranges.append([codepoint, codepoint])
+
+        return "[" + "".join(
+            re.escape(chr(start)) if start == end else f"{re.escape(chr(start))}-{re.escape(chr(end))}"
+            for start, end in ranges
+        ) + "]"
+
+
+    def _build_regexes(self, emoji_names: dict[str, str]):
+        '''Builds the regexes that find codepoint modifiers, and the multi-codepoint emoji sequences that use them'''
+
+        standalone = set()  # Codepoints that are an emoji on their own (ex: 👍)
+        leading = set()     # Codepoints that start a longer emoji (ex: the 1 in 1️⃣)
+        modifiers = set()   # Codepoints that modify the codepoint before them (ex: skin tones, variation selectors)
+        for emoji_code in emoji_names:
+            if (len(emoji_code) == 1):
+                standalone.add(emoji_code)
+            else:
+                leading.add(emoji_code[0])
+
+            for previous_char, char in zip(emoji_code, emoji_code[1:]):
+                if (previous_char != self.ZERO_WIDTH_JOINER and char != self.ZERO_WIDTH_JOINER):
+                    modifiers.add(char)
+        leading -= standalone
+
+        standalone_class = self._build_character_class(standalone)
+        starting_class = self._build_character_class(standalone | leading)
+        modifier_class = self._build_character_class(modifiers)
+
+        ## Leading codepoints only count if they're actually modified (ex: a 1 on its own isn't an emoji)
+        unit = f"(?:{standalone_class}{modifier_class}*|{self._build_character_class(leading)}{modifier_class}+)"
+        joined_units = f"(?:{self.ZERO_WIDTH_JOINER}{unit})"
+
+        self._modifiers = modifiers | {self.ZERO_WIDTH_JOINER}
+        self._modifier_regex = re.compile(self._build_character_class(self._modifiers))
+        self._sequence_regex = re.compile(
+            f"{starting_class}{modifier_class}+{joined_units}*|{standalone_class}{joined_units}+"
+        )
+
+
+    def _split_sequence(self, sequence: str, replace: bool) -> str:
+        '''
+        Splits a sequence into the longest emoji that it can. Any leftover modifiers are dropped, since they're
+        meaningless on their own (ex: the variation selector in ❤️, when only ❤ is known), but other codepoints are
+        left in place.
+        '''
+
+        trie = self._get_trie()
+        output = []
+        index = 0
+        while (index < len(sequence)):
+            node = trie
+            end = index + 1
+            name = None
+            for lookahead in range(index, len(sequence)):
+                node = node.get(sequence[lookahead])
+                if (node is None):
+                    break
+
+                if (self._NAME in node):
+                    end = lookahead + 1
+                    name = node[self._NAME]
+
+            if (name is None):
+                if (sequence[index] not in self._modifiers):
+                    output.append(sequence[index])
+            elif (replace):
+                output.append(name)
+            index = end
+
+        return "".join(output)
+
+
+    def _transform_sequences(self, message: str, replace: bool) -> str:
+        if (not self._modifier_regex.search(message)):
+            return message
+
+        def transform_sequence(match: re.Match) -> str:
+            sequence = match.group(0)
+            name = self.emoji_names.get(sequence)
+            if (name is None):
+                return self._split_sequence(sequence, replace)
+
+            return name if replace else ""
+
+        return self._sequence_regex.sub(transform_sequence, message)
+
+
+    def replace(self, message: str) -> str:
+        '''Replaces all emoji with their names'''
+
+        return self._transform_sequences(message, replace=True).translate(self._replace_table)
+
+
+    def strip(self, message: str) -> str:
+        '''Removes all emoji'''
+
+        return self._transform_sequences(message, replace=False).translate(self._strip_table)
@@ -1,9 +1,9 @@
 from dataclasses import replace
 import re
-import emoji
 
 from common import utilities
 from common.configuration import Configuration
+from common.emoji_matcher import EmojiMatcher
 from common.module.module import Module
 
 ## Config
@@ -11,6 +11,10 @@ CONFIG_OPTIONS = Configuration.load_config()
 
 
 class MessageParser(Module):
+    ## Matches inline mentions (ex: <@1234567890>, <@!1234567890>, <@&1234567890>, <#1234567890>), capturing the id, or
+    ## failing that any bare ids (ex: 1234567890)
+    MENTION_REGEX = re.compile(r"<(?:@[!&]?|#)(\d+)>|(\d+)")
+
     ## Keys
     REPLACE_EMOJI_KEY = "replace_emoji"
 
@@ -19,10 +23,9 @@ class MessageParser(Module):
 
         self.replace_emoji = CONFIG_OPTIONS.get(self.REPLACE_EMOJI_KEY, True)
 
-        ## Invert emoji.UNICODE_EMOJI's emoji dict
-        self.emoji_map = {}
-        for emoji_code, emoji_name in emoji.UNICODE_EMOJI.items():
-            self.emoji_map[emoji_code.lower()] = self._strip_underscores(emoji_name[1:-1])
+        ## The emoji matcher's expensive to build, so it's shared between everything that needs it, and built while the
+        ## bot's starting up, rather than on the event loop while it's handling the first message
+        self.emoji_matcher: EmojiMatcher = EmojiMatcher.get_shared()
 
     ## Methods
 
@@ -39,35 +42,14 @@ class MessageParser(Module):
         return message
 
 
-    ## Removes all underscores from a string, and replaces them with spaces.
-    def _strip_underscores(self, string):
-        return re.sub(r"_", " ", string)
-
-
     ## Replaces emoji with their actual strings
     def _replace_emoji(self, message):
-        char_array = list(message)
-
-        for index, char in enumerate(char_array):
-            char_lower = char.lower()
-
-            if(char_lower in self.emoji_map):
-                char_array[index] = self.emoji_map[char_lower]
-
-        return ''.join(char_array)
+        return self.emoji_matcher.replace(message)
 
 
     ## Removes all emoji from a given string
     def _strip_emoji(self, message):
-        char_array = list(message)
-
-        for index, char in enumerate(char_array):
-            char_lower = char.lower()
-
-            if(char_lower in self.emoji_map):
-                del char_array[index]
-
-        return ''.join(char_array)
+        return self.emoji_matcher.strip(message)
 
 
     def replace_mentions(
@@ -80,20 +62,6 @@ class MessageParser(Module):
     ):
         """Replaces raw mentions with their human readable version (ex: <@1234567890> -> name OR <@name>)"""
 
-        ## In string, replace instances of discord_id with replacement
-        def replace_id_with_string(string, discord_id, replacement):
-            match = re.search(f"<[@|#][!|&]?({discord_id})>", string)
-            if(match):
-                if (hide_mention_formatting):
-                    start, end = match.span(0)
-                else:
-                    start, end = match.span(1)
-
-                string = string[:start] + replacement + string[end:]
-
-            return string
-
-
         id_mapping = {}
         unique_mention_counter = 0
 
@@ -110,16 +78,28 @@ class MessageParser(Module):
         for role in interaction_data.get("resolved", {}).get("roles", {}).values():
             id_mapping[role["id"]] = f"role{unique_mention_counter}" if anonymize_mentions else role["name"]
 
-        ## Perform the replacement!
-        for discord_id, replacement in id_mapping.items():
+        if (not id_mapping):
+            return message
+
+        def replace_match(match: re.Match) -> str:
             ## Replace any inline mentions (ex: <@1234567890>)
-            message = replace_id_with_string(message, discord_id, replacement)
+            if ((discord_id := match.group(1)) is not None):
+                replacement = id_mapping.get(discord_id)
+                if (replacement is None):
+                    return match.group(0)
+
+                if (hide_mention_formatting):
+                    return replacement
+                else:
+                    return match.group(0)[:match.start(1) - match.start(0)] + replacement + ">"
 
             ## Hide any option mentions (ex: 1234567890), as it's almost certainly a 'meta' command.
             ## Todo: improve this, it's kind of janky right now
-            if (hide_meta_mentions):
-                message = message.replace(discord_id, "")
-            else:
-                message = message.replace(discord_id, replacement)
+            replacement = id_mapping.get(match.group(2))
+            if (replacement is None):
+                return match.group(0)
 
-        return message
+            return "" if hide_meta_mentions else replacement
+
+        ## Perform the replacement, in a single pass over the message
+        return self.MENTION_REGEX.sub(replace_match, message)
@@ -1,38 +1,206 @@
+import math
+import logging
 from difflib import SequenceMatcher
+from typing import Callable
 
 from common.configuration import Configuration
+from common.logging import Logging
 
-## Config
+## Config & logging
 CONFIG_OPTIONS = Configuration.load_config()
+LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
 
 
 class StringSimilarity:
     ## https://stackoverflow.com/questions/17388213/find-the-similarity-metric-between-two-strings
     ## https://stackoverflow.com/questions/6690739/fuzzy-string-comparison-in-python-confused-with-which-library-to-use
 
+    ## All of the algorithms return a similarity between 0 and 1 (inclusive), where 1 means that the strings are equal.
+    ## Given a minimum_similarity, they're also free to bail out early and return 0 for any strings that can't reach it.
+
+    DIFFLIB = "difflib"
+    JARO_WINKLER = "jaro-winkler"
+    DAMERAU_LEVENSHTEIN = "damerau-levenshtein"
+
+    ## How much a common prefix boosts the Jaro-Winkler similarity, and the longest prefix that counts
+    JARO_WINKLER_PREFIX_SCALE = 0.1
+    JARO_WINKLER_MAX_PREFIX_LENGTH = 4
+
+    _similarity_function: Callable[[str, str, float], float] = None
+
+    @staticmethod
+    def _calcJaroWinkleDistance(stringA: str, stringB: str, minimum_similarity: float = 0.0) -> float:
+        if (stringA == stringB):
+            return 1.0
+
+        length_a = len(stringA)
+        length_b = len(stringB)
+        if (length_a == 0 or length_b == 0):
+            return 0.0
+
+        ## Best case, every character of the shorter string matches without any transpositions, and there's a full
+        ## length common prefix
+        if (minimum_similarity > 0):
+            best_matches = min(length_a, length_b)
+            best_jaro = (best_matches / length_a + best_matches / length_b + 1) / 3
+            best_prefix_boost = StringSimilarity.JARO_WINKLER_MAX_PREFIX_LENGTH * StringSimilarity.JARO_WINKLER_PREFIX_SCALE
+            if (best_jaro + best_prefix_boost * (1 - best_jaro) < minimum_similarity):
+                return 0.0
+
+        ## Characters only match if they're within this distance of each other
+        match_distance = max(max(length_a, length_b) // 2 - 1, 0)
+        matched_b = bytearray(length_b)
+        matches_a = []
+        for index, char in enumerate(stringA):
+            end = min(index + match_distance + 1, length_b)
+            match_index = stringB.find(char, max(index - match_distance, 0), end)
+            while (match_index != -1 and matched_b[match_index]):
+                match_index = stringB.find(char, match_index + 1, end)
+
+            if (match_index != -1):
+                matched_b[match_index] = 1
+                matches_a.append(char)
+
+        match_count = len(matches_a)
+        if (match_count == 0):
+            return 0.0
+
+        matches_b = [char for char, matched in zip(stringB, matched_b) if matched]
+        transpositions = sum(char_a != char_b for char_a, char_b in zip(matches_a, matches_b)) // 2
+        jaro = (match_count / length_a + match_count / length_b + (match_count - transpositions) / match_count) / 3
+
+        prefix_length = 0
+        for char_a, char_b in zip(stringA[:StringSimilarity.JARO_WINKLER_MAX_PREFIX_LENGTH], stringB):
+            if (char_a != char_b):
+                break
+            prefix_length += 1
+
+        return jaro + prefix_length * StringSimilarity.JARO_WINKLER_PREFIX_SCALE * (1 - jaro)
+
+    @staticmethod
+    def _calcDamerauLevenshteinDistance(stringA: str, stringB: str, minimum_similarity: float = 0.0) -> float:
+        ## This is the optimal string alignment variant, where each substring can only be edited once
+
+        if (stringA == stringB):
+            return 1.0
+
+        longest_length = max(len(stringA), len(stringB))
+        if (min(len(stringA), len(stringB)) == 0):
+            return 0.0
+
+        ## Any edits beyond this would drop the similarity below the minimum. Nudge it up a little, so that floating point
+        ## error doesn't round away an edit that lands exactly on the minimum (ex. 1 - 0.8 is slightly less than 0.2)
+        max_distance = math.floor((1 - minimum_similarity) * longest_length + 1e-9)
+        if (abs(len(stringA) - len(stringB)) > max_distance):
+            return 0.0
+
+        ## Common prefixes and suffixes don't need any edits, so don't bother comparing them
+        start = 0
+        while (start < len(stringA) and start < len(stringB) and stringA[start] == stringB[start]):
+            start += 1
+        end_a = len(stringA)
+        end_b = len(stringB)
+        while (end_a > start and end_b > start and stringA[end_a - 1] == stringB[end_b - 1]):
+            end_a -= 1
+            end_b -= 1
+        stringA = stringA[start:end_a]
+        stringB = stringB[start:end_b]
+
+        ## Only the last two rows of the distance matrix are needed, so reuse them rather than building the whole thing
+        previous_previous_row = [0] * (len(stringB) + 1)
+        previous_row = list(range(len(stringB) + 1))
+        current_row = [0] * (len(stringB) + 1)
+        for index_a, char_a in enumerate(stringA, 1):
+            current_row[0] = index_a
+            row_minimum = index_a
+            previous_char_a = stringA[index_a - 2] if index_a > 1 else None
+            for index_b, char_b in enumerate(stringB, 1):
+                if (char_a == char_b):
+                    ## Matching characters never need an edit, and nothing else can beat that
+                    distance = previous_row[index_b - 1]
+                else:
+                    distance = previous_row[index_b - 1]            # Substitution
+                    if (previous_row[index_b] < distance):
+                        distance = previous_row[index_b]            # Deletion
+                    if (current_row[index_b - 1] < distance):
+                        distance = current_row[index_b - 1]         # Insertion
+                    distance += 1
+
+                    if (char_b == previous_char_a and index_b > 1 and char_a == stringB[index_b - 2]):
+                        distance = min(distance, previous_previous_row[index_b - 2] + 1)    # Transposition
+
+                current_row[index_b] = distance
+                if (distance < row_minimum):
+                    row_minimum = distance
+
+            if (row_minimum > max_distance):
+                return 0.0
+
+            previous_previous_row, previous_row, current_row = previous_row, current_row, previous_previous_row
+
+        distance = previous_row[len(stringB)]
+        if (distance > max_distance):
+            return 0.0
+
+        return 1 - distance / longest_length
+
     @staticmethod
-    def _calcJaroWinkleDistance(stringA, stringB):
-        raise NotImplementedError(
-            "Jaro-Winkle distance calculation hasn't been implemented. Use difflib implementation"
-        )
+    def _calcDifflibDistance(stringA: str, stringB: str, minimum_similarity: float = 0.0) -> float:
+        matcher = SequenceMatcher(None, stringA, stringB)
+        if (minimum_similarity > 0 and matcher.real_quick_ratio() < minimum_similarity):
+            return 0.0
+
+        return matcher.ratio()
 
     @staticmethod
-    def _calcDamerauLevenshteinDistance(stringA, stringB):
-        raise NotImplementedError(
-            "Damerau-Levenshtein distance calculation hasn't been implemented. Use difflib implementation"
-        )
+    def _normalize_algorithm_name(name: str) -> str:
+        ## Accept en dashes too (ex: damerau–levenshtein), since that's how the names are usually written
+        return (name or StringSimilarity.DIFFLIB).strip().lower().replace("–", "-").replace(" ", "-")
 
     @staticmethod
-    def _calcDifflibDistance(stringA, stringB):
-        return SequenceMatcher(None, stringA, stringB).ratio()
+    def _get_similarity_function() -> Callable[[str, str, float], float]:
+        ## The algorithm can't change without restarting the bot, so only look it up once
+        if (StringSimilarity._similarity_function is None):
+            similarity_functions = {
+                StringSimilarity.DIFFLIB: StringSimilarity._calcDifflibDistance,
+                StringSimilarity.JARO_WINKLER: StringSimilarity._calcJaroWinkleDistance,
+                StringSimilarity.DAMERAU_LEVENSHTEIN: StringSimilarity._calcDamerauLevenshteinDistance
+            }
+
+            similarity_algorithm = StringSimilarity._normalize_algorithm_name(
+                CONFIG_OPTIONS.get("string_similarity_algorithm")
+            )
+            if (similarity_algorithm not in similarity_functions):
+                LOGGER.warning(f"Unknown string similarity algorithm '{similarity_algorithm}', using difflib instead")
+                similarity_algorithm = StringSimilarity.DIFFLIB
+
+            StringSimilarity._similarity_function = similarity_functions[similarity_algorithm]
+
+        return StringSimilarity._similarity_function
 
     @staticmethod
-    def similarity(stringA, stringB):
-        similarity_algorithm = CONFIG_OPTIONS.get("string_similarity_algorithm")
-
-        if (similarity_algorithm == "jaro-winkler"):
-            return StringSimilarity._calcJaroWinkleDistance(stringA, stringB)
-        elif (similarity_algorithm == "damerau–levenshtein"):
-            return StringSimilarity._calcDamerauLevenshteinDistance(stringA, stringB)
-        else:
-            return StringSimilarity._calcDifflibDistance(stringA, stringB)
\ No newline at end of file
+    def similarity(stringA: str, stringB: str, minimum_similarity: float = 0.0) -> float:
+        return StringSimilarity._get_similarity_function()(stringA, stringB, minimum_similarity)
+
+    @staticmethod
+    def similarities(query: str, candidates: list[str], minimum_similarity: float = 0.0) -> list[float]:
+        '''
+        Scores the query against each of the candidates, in order. Only difflib actually shares any work between the
+        candidates (its matcher caches details about the query), the other algorithms just score each pair in turn.
+        '''
+
+        similarity_function = StringSimilarity._get_similarity_function()
+        if (similarity_function is not StringSimilarity._calcDifflibDistance):
+            return [similarity_function(query, candidate, minimum_similarity) for candidate in candidates]
+
+        ## Reuse a single matcher for difflib, as it's relatively expensive to create
+        matcher = SequenceMatcher(None, query)
+        scores = []
+        for candidate in candidates:
+            matcher.set_seq2(candidate)
+            if (minimum_similarity > 0 and (matcher.real_quick_ratio() < minimum_similarity or matcher.quick_ratio() < minimum_similarity)):
+                scores.append(0.0)
+            else:
+                scores.append(matcher.ratio())
+
+        return scores
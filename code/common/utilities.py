@@ -23,8 +23,11 @@ def load_json(path: Path) -> dict:
 
 
 def save_json(path: Path, data: dict):
-    with open(path, 'w') as fd:
+    ## Write to a temporary file first, so a crash mid-write can't leave a half written file behind
+    temp_path = Path(f"{path}.tmp")
+    with open(temp_path, 'w') as fd:
         json.dump(data, fd)
+    os.replace(temp_path, path)
 
 
 def is_linux():
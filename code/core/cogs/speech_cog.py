@@ -1,9 +1,10 @@
+import asyncio
 import logging
 import random
 from pathlib import Path
-from typing import Callable
+from typing import AsyncIterator, Callable
 
-from core.exceptions import MessageTooLongException, BuildingAudioFileTimedOutExeption, UnableToBuildAudioFileException
+from core.exceptions import MessageTooLongException, BuildingAudioFileTimedOutExeption, UnableToBuildAudioFileException, SynthesisQueueFullException
 from core.tts.tts_controller import TTSController
 from common.audio_player import AudioPlayer
 from common.configuration import Configuration
@@ -40,6 +41,8 @@ class SpeechCog(Cog):
         assert(self.tts_controller is not None)
 
         self.channel_timeout_phrases = CONFIG_OPTIONS.get('channel_timeout_phrases', [])
+        self.streaming_enabled = CONFIG_OPTIONS.get('tts_streaming_enable', False)
+        self.streaming_min_chars = int(CONFIG_OPTIONS.get('tts_streaming_min_chars', 200))
         self.audio_player_cog.channel_timeout_handler = self.play_random_channel_timeout_message
 
         ## Commands
@@ -54,30 +57,88 @@ class SpeechCog(Cog):
     async def play_random_channel_timeout_message(self, server_state, callback):
         '''Channel timeout logic, picks an appropriate sign-off message and plays it'''
 
+        async def audio_player_callback():
+            self.tts_controller.delete(file_path)
+            await callback()
+
+
         try:
             if (len(self.channel_timeout_phrases) > 0):
                 message = random.choice(self.channel_timeout_phrases)
-                file_path = await self.build_audio_file(message, True)
+                file_path = await self.build_audio_file(message, True, guild_id=server_state.guild.id)
 
-                await self.audio_player_cog._play_audio_via_server_state(server_state, file_path, callback)
+                await self.audio_player_cog._play_audio_via_server_state(server_state, file_path, audio_player_callback)
         except Exception as e:
             LOGGER.exception("Exception during channel sign-off")
             await callback()
 
 
-    async def build_audio_file(self, text: str, ignore_char_limit = False, interaction: Interaction = None) -> Path:
-        '''Turns a string of text into a wav file for later playing. Returns a filepath pointing to that file.'''
+    async def build_audio_file(
+            self,
+            text: str,
+            ignore_char_limit = False,
+            interaction: Interaction = None,
+            pin = False,
+            guild_id: int = None
+    ) -> Path:
+        '''
+        Turns a string of text into a wav file for later playing. Returns a filepath pointing to that file. Pinned files
+        will stay in the audio cache until they're explicitly unpinned. Synthesis is scheduled fairly against the other
+        guilds' messages, with messages that don't have a guild_id being treated as low priority background work.
+        '''
 
         ## Make sure the message isn't too long
         if(not self.tts_controller.check_length(text) and not ignore_char_limit):
             raise MessageTooLongException(f"Message is {len(text)} characters long when it should be less than {self.tts_controller.char_limit}")
 
-        ## Parse down the message before sending it to the TTS service
-        if (interaction is not None):
-            text = self.message_parser.parse_message(text, interaction.data)
+        ## Parse down the message before sending it to the TTS service. Messages without an interaction are still parsed,
+        ## so that they'll line up with the same message's cached audio when it is invoked by a user.
+        text = self.message_parser.parse_message(text, interaction.data if interaction is not None else {})
 
         ## Build the audio file for speaking
-        return await self.tts_controller.save(text, ignore_char_limit)
+        return await self.tts_controller.save(text, ignore_char_limit, pin, guild_id)
+
+
+    async def build_audio_files(
+            self,
+            text: str,
+            ignore_char_limit = False,
+            interaction: Interaction = None,
+            guild_id: int = None
+    ) -> AsyncIterator[Path]:
+        '''
+        Turns a string of text into a series of wav files, one for each chunk of the text, and yields their filepaths in
+        order. The next chunk is synthesized while the current one is being played, so long messages can start playing
+        well before the whole message has been synthesized.
+        '''
+
+        ## Make sure the message isn't too long
+        if(not self.tts_controller.check_length(text) and not ignore_char_limit):
+            raise MessageTooLongException(f"Message is {len(text)} characters long when it should be less than {self.tts_controller.char_limit}")
+
+        text = self.message_parser.parse_message(text, interaction.data if interaction is not None else {})
+        chunks = self.tts_controller.split_message(text)
+
+        def release_file(task: asyncio.Task):
+            if (not task.cancelled() and task.exception() is None and task.result() is not None):
+                self.tts_controller.delete(task.result())
+
+
+        next_file = asyncio.create_task(self.tts_controller.save(chunks[0], True, guild_id=guild_id))
+        try:
+            for index in range(len(chunks)):
+                file_path = await next_file
+                next_file = None
+
+                if (index + 1 < len(chunks)):
+                    next_file = asyncio.create_task(self.tts_controller.save(chunks[index + 1], True, guild_id=guild_id))
+
+                yield file_path
+        finally:
+            ## Nobody's going to play the upcoming chunk, so make sure its file doesn't linger
+            if (next_file is not None):
+                next_file.add_done_callback(release_file)
+                next_file.cancel()
 
 
     async def say(
@@ -91,16 +152,49 @@ class SpeechCog(Cog):
     ) -> InvokedCommand:
         '''Internal say method, for use with presets and anything else that generates phrases on the fly'''
 
+        guild_id = (target_member or author).guild.id
+        file_paths: list[Path] = []
+        playback_finished = False
+
+        def delete_audio_files():
+            for file_path in file_paths:
+                self.tts_controller.delete(file_path)
+
+
         async def audio_player_callback():
-            self.tts_controller.delete(wav_path)
+            nonlocal playback_finished
+            playback_finished = True
+
+            delete_audio_files()
             if (callback is None):
                 return
 
             await callback()
 
 
+        async def stream_audio_files():
+            async for file_path in self.build_audio_files(text, ignore_char_limit, interaction, guild_id):
+                ## Playback was skipped (or failed) before this chunk was ready
+                if (playback_finished):
+                    self.tts_controller.delete(file_path)
+                    return
+
+                file_paths.append(file_path)
+                yield file_path
+
+
         try:
-            wav_path = await self.build_audio_file(text, ignore_char_limit, interaction)
+            if (self.streaming_enabled and len(text) >= self.streaming_min_chars):
+                await self.audio_player_cog.play_audio_stream(
+                    stream_audio_files(),
+                    author,
+                    target_member or author,
+                    interaction,
+                    audio_player_callback
+                )
+            else:
+                file_paths.append(await self.build_audio_file(text, ignore_char_limit, interaction, guild_id=guild_id))
+                await self.audio_player_cog.play_audio(file_paths[0], author, target_member or author, interaction, audio_player_callback)
 
         except BuildingAudioFileTimedOutExeption as e:
             LOGGER.exception(f"Timed out building audio for message: '{text}'")
@@ -111,15 +205,17 @@ class SpeechCog(Cog):
             ## todo: Specify how many characters need to be removed?
             return InvokedCommand(False, e, f"Wow <@{author.id}>, that's waaay too much. You've gotta keep messages shorter than {self.tts_controller.char_limit} characters.")
 
+        except SynthesisQueueFullException as e:
+            LOGGER.warning(f"Unable to queue up message for synthesis in guild: {e.guild_id}, its queue is full")
+            return InvokedCommand(False, e, f"Hold on <@{author.id}>, I've already got a lot to say in here. Try again in a bit.")
+
         except UnableToBuildAudioFileException as e:
             LOGGER.exception(f"Unable to build .wav file for message: '{text}'")
             return InvokedCommand(False, e, f"Sorry <@{author.id}>, I can't say that right now.")
 
-        try:
-            await self.audio_player_cog.play_audio(wav_path, author, target_member or author, interaction, audio_player_callback)
-
         except NoVoiceChannelAvailableException as e:
             LOGGER.error("No voice channel available", exc_info=e)
+            delete_audio_files()
             if (e.target_member.id == author.id):
                 return InvokedCommand(False, e, f"Sorry <@{author.id}>, you're not in a voice channel.")
             else:
@@ -127,6 +223,7 @@ class SpeechCog(Cog):
 
         except UnableToConnectToVoiceChannelException as e:
             ## Logging handled in AudioPlayer
+            delete_audio_files()
 
             error_values = []
             if (not e.can_connect):
@@ -138,6 +235,7 @@ class SpeechCog(Cog):
 
         except FileNotFoundError as e:
             LOGGER.error("FileNotFound when invoking `play_audio`", exc_info=e)
+            delete_audio_files()
             return InvokedCommand(False, e, f"Sorry <@{author.id}>, I can't say that right now.")
 
         return InvokedCommand(True)
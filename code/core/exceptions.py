@@ -23,3 +23,17 @@ class MessageTooLongException(UnableToBuildAudioFileException):
 
     def __init__(self, message):
         super(MessageTooLongException, self).__init__(message)
+
+
+class SynthesisQueueFullException(UnableToBuildAudioFileException):
+    '''Exception that's thrown when a guild already has too many messages waiting to be synthesized'''
+
+    def __init__(self, message, guild_id):
+        super(SynthesisQueueFullException, self).__init__(message)
+
+        self._guild_id = guild_id
+
+
+    @property
+    def guild_id(self) -> int:
+        return self._guild_id
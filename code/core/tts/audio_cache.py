@@ -0,0 +1,329 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from common.configuration import Configuration
+from common.logging import Logging
+
+## Config & logging
+CONFIG_OPTIONS = Configuration.load_config()
+LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
+
+
+class AudioCacheEntry:
+    def __init__(self, key: str, file_path: Path, size_bytes: int, last_accessed: float):
+        self.key = key
+        self.file_path = file_path
+        self.size_bytes = size_bytes
+        self.last_accessed = last_accessed
+        self.references = 0
+        self.pinned = False
+
+
+class AudioCache:
+    '''
+    Disk backed, content addressed cache of synthesized audio files. Entries are evicted in least recently used order
+    once the cache grows past its maximum size, or once they haven't been used for longer than the maximum age (which
+    is also checked periodically). Entries that are still referenced (ex. queued up to play in some server) are never
+    evicted. An entry's size includes any files derived from its audio that are stored alongside it (ex. the Opus
+    transcodes that the audio player makes).
+    '''
+
+    PARTIAL_FILE_MARKER = "partial"
+
+    ## Keys
+    AUDIO_CACHE_MAX_SIZE_BYTES_KEY = "audio_cache_max_size_bytes"
+    AUDIO_CACHE_MAX_AGE_SECONDS_KEY = "audio_cache_max_age_seconds"
+    AUDIO_CACHE_EVICTION_INTERVAL_SECONDS_KEY = "audio_cache_eviction_interval_seconds"
+
+    def __init__(self, cache_dir_path: Path, extension: str):
+        self.cache_dir_path = cache_dir_path
+        self.extension = extension
+        self.max_size_bytes = int(CONFIG_OPTIONS.get(self.AUDIO_CACHE_MAX_SIZE_BYTES_KEY, 1073741824))   ## One GiB
+        self.max_age_seconds = int(CONFIG_OPTIONS.get(self.AUDIO_CACHE_MAX_AGE_SECONDS_KEY, 604800))     ## One week
+        self.eviction_interval_seconds = max(float(CONFIG_OPTIONS.get(self.AUDIO_CACHE_EVICTION_INTERVAL_SECONDS_KEY, 3600)), 1)
+
+        self.entries: OrderedDict[str, AudioCacheEntry] = OrderedDict()   # Least recently used entries first
+        self.size_bytes = 0
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self._in_flight_waiters: dict[str, int] = {}
+        self._eviction_task: asyncio.Task = None
+        self._eviction_loop: asyncio.AbstractEventLoop = None
+
+        self._init_cache_dir()
+
+    ## Methods
+
+    @staticmethod
+    def build_key(message: str, prepend: str, append: str, args: dict) -> str:
+        '''Builds a key that uniquely identifies the audio that'll be generated for the given (parsed) message'''
+
+        data = json.dumps([message, prepend, append, args], sort_keys=True, ensure_ascii=False)
+
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+    def _init_cache_dir(self):
+        '''Makes sure the cache directory exists, and loads any entries from previous runs into the cache'''
+
+        self.cache_dir_path.mkdir(parents=True, exist_ok=True) # mkdir -p
+
+        existing_entries = []
+        for file_path in self.cache_dir_path.iterdir():
+            if (not file_path.is_file()):
+                continue
+
+            ## Clean up any files that were mid-synthesis (or mid-transcode) when the bot last stopped, along with any
+            ## derived files whose audio is already gone
+            name_parts = file_path.name.split(".")
+            if (self.PARTIAL_FILE_MARKER in name_parts[1:-1] or not self.get_file_path(name_parts[0]).is_file()):
+                self._remove_file(file_path)
+                continue
+
+            if (file_path.suffix != f".{self.extension}"):
+                continue
+
+            existing_entries.append(AudioCacheEntry(
+                file_path.stem,
+                file_path,
+                self._get_files_size(file_path.stem),
+                file_path.stat().st_mtime
+            ))
+
+        for entry in sorted(existing_entries, key=lambda entry: entry.last_accessed):
+            self.entries[entry.key] = entry
+            self.size_bytes += entry.size_bytes
+
+        self.evict(keep_most_recent=False)
+        LOGGER.info(f"Loaded {len(self.entries)} cached audio file{'s' if len(self.entries) != 1 else ''}")
+
+
+    def get_file_path(self, key: str) -> Path:
+        return Path.joinpath(self.cache_dir_path, f"{key}.{self.extension}")
+
+
+    def _get_files_size(self, key: str) -> int:
+        '''Gets the size of the key's audio file, plus any (completely written) files derived from it'''
+
+        size_bytes = 0
+        for file_path in self.cache_dir_path.glob(f"{key}.*"):
+            if (self.PARTIAL_FILE_MARKER in file_path.name.split(".")[1:-1]):
+                continue
+
+            try:
+                size_bytes += file_path.stat().st_size
+            except OSError:
+                pass
+
+        return size_bytes
+
+
+    def _update_size(self, entry: AudioCacheEntry):
+        '''Picks up any derived files that have been written alongside the entry's audio since it was last sized'''
+
+        size_bytes = self._get_files_size(entry.key)
+        self.size_bytes += size_bytes - entry.size_bytes
+        entry.size_bytes = size_bytes
+
+
+    def _remove_file(self, file_path: Path):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            LOGGER.exception(f"Error removing cached file: {file_path}")
+
+
+    def acquire(self, key: str) -> Path | None:
+        '''Gets the path to the cached audio for the key (if any), and marks it as in use until it's released'''
+
+        entry = self.entries.get(key)
+        if (entry is None):
+            return None
+
+        if (not entry.file_path.is_file()):
+            self._remove_entry(entry)
+            return None
+
+        entry.references += 1
+        entry.last_accessed = time.time()
+        self.entries.move_to_end(key)
+
+        ## Keep the modified time in sync so LRU ordering survives restarts
+        try:
+            os.utime(entry.file_path, (entry.last_accessed, entry.last_accessed))
+        except OSError:
+            pass
+
+        return entry.file_path
+
+
+    def release(self, file_path: Path) -> bool:
+        '''Releases a reference to a cached file. Returns True if the file belongs to the cache, and False otherwise.'''
+
+        file_path = Path(file_path)
+        if (file_path.parent != self.cache_dir_path):
+            return False
+
+        entry = self.entries.get(file_path.stem)
+        if (entry is None):
+            return False
+
+        entry.references = max(entry.references - 1, 0)
+
+        ## The file's been played by now, so any transcoded copy of it will have been made too
+        self._update_size(entry)
+        if (self.size_bytes > self.max_size_bytes):
+            self.evict()
+
+        return True
+
+
+    def pin(self, key: str) -> bool:
+        '''Prevents the entry from being evicted. Returns True if the entry exists, and False otherwise.'''
+
+        entry = self.entries.get(key)
+        if (entry is None):
+            return False
+
+        entry.pinned = True
+        return True
+
+
+    def unpin(self, key: str):
+        entry = self.entries.get(key)
+        if (entry is not None):
+            entry.pinned = False
+
+
+    def contains(self, key: str) -> bool:
+        return key in self.entries
+
+
+    def _add(self, key: str, file_path: Path):
+        if (existing_entry := self.entries.pop(key, None)):
+            self.size_bytes -= existing_entry.size_bytes
+
+        entry = AudioCacheEntry(key, file_path, self._get_files_size(key), time.time())
+        self.entries[key] = entry
+        self.size_bytes += entry.size_bytes
+
+
+    def _remove_entry(self, entry: AudioCacheEntry):
+        self.entries.pop(entry.key, None)
+        self.size_bytes -= entry.size_bytes
+
+        ## Also remove any files derived from the entry's audio (ex. transcoded copies) that are stored alongside it
+        for file_path in self.cache_dir_path.glob(f"{entry.key}.*"):
+            self._remove_file(file_path)
+
+
+    def evict(self, keep_most_recent: bool = True):
+        '''
+        Evicts expired entries, and then least recently used entries until the cache fits within its max size. The most
+        recently used entry is kept by default, as it was usually either just created or just requested.
+        '''
+
+        expiry_time = time.time() - self.max_age_seconds
+
+        entries = list(self.entries.values())
+        if (keep_most_recent):
+            entries = entries[:-1]
+
+        for entry in entries:
+            is_expired = entry.last_accessed < expiry_time
+            if (not is_expired and self.size_bytes <= self.max_size_bytes):
+                ## Entries are in LRU order, so nothing after this one will have expired either
+                break
+
+            if (entry.references > 0 or entry.pinned):
+                continue
+
+            LOGGER.debug(f"Evicting cached audio file: {entry.file_path}")
+            self._remove_entry(entry)
+
+
+    async def _evict_periodically(self):
+        ## Otherwise entries would only ever expire when new ones get created
+        while (True):
+            await asyncio.sleep(self.eviction_interval_seconds)
+
+            try:
+                self.evict(keep_most_recent=False)
+            except Exception as e:
+                LOGGER.exception("Unable to evict expired audio files from the cache", exc_info=e)
+
+
+    def _ensure_evicting(self):
+        loop = asyncio.get_running_loop()
+        if (self._eviction_loop is loop):
+            return
+
+        if (self._eviction_task is not None):
+            self._eviction_task.cancel()
+
+        self._eviction_loop = loop
+        self._eviction_task = loop.create_task(self._evict_periodically())
+
+
+    async def _create(self, key: str, create: Callable[[Path], Awaitable[Path]]):
+        ## Synthesize into a temporary file first, so a partially written file can never be served from the cache
+        file_path = self.get_file_path(key)
+        partial_file_path = Path.joinpath(self.cache_dir_path, f"{key}.{self.PARTIAL_FILE_MARKER}.{self.extension}")
+
+        try:
+            await create(partial_file_path)
+            os.replace(partial_file_path, file_path)
+        except BaseException:
+            self._remove_file(partial_file_path)
+            raise
+
+        self._add(key, file_path)
+        self.evict()
+
+
+    async def get_or_create(self, key: str, create: Callable[[Path], Awaitable[Path]]) -> Path:
+        '''
+        Gets the path to the cached audio for the key, invoking 'create' to write the audio into the cache if it hasn't
+        already been. Concurrent requests for the same key share the same create invocation, which is only cancelled
+        once every requester has been cancelled. The returned path must be released when it's no longer needed.
+        '''
+
+        self._ensure_evicting()
+
+        if (file_path := self.acquire(key)):
+            return file_path
+
+        task = self._in_flight.get(key)
+        if (task is None):
+            task = asyncio.create_task(self._create(key, create))
+            self._in_flight[key] = task
+            self._in_flight_waiters[key] = 0
+
+            def on_done(_):
+                self._in_flight.pop(key, None)
+                self._in_flight_waiters.pop(key, None)
+            task.add_done_callback(on_done)
+
+        self._in_flight_waiters[key] += 1
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if (key in self._in_flight_waiters):
+                self._in_flight_waiters[key] -= 1
+                if (self._in_flight_waiters[key] <= 0):
+                    task.cancel()
+            raise
+
+        if (file_path := self.acquire(key)):
+            return file_path
+
+        ## Somehow the file disappeared between creation and acquisition, so just try again
+        return await self.get_or_create(key, create)
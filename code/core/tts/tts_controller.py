@@ -1,23 +1,32 @@
 import os
+import re
 import asyncio
+import shlex
+import itertools
 import time
 import logging
 from pathlib import Path
 
 from core.exceptions import BuildingAudioFileTimedOutExeption, UnableToBuildAudioFileException
+from core.tts.audio_cache import AudioCache
+from core.tts.tts_worker_pool import TTSWorkerPool
 from common import utilities
 from common.configuration import Configuration
 from common.logging import Logging
 from common.module.module import Module
 
-import async_timeout
-
 ## Config & logging
 CONFIG_OPTIONS = Configuration.load_config()
 LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
 
 
 class TTSController(Module):
+    HEALTH_CHECK_MESSAGE = "ok"
+    SENTENCE_BOUNDARY_CHARACTERS = ".!?;\n"
+    ## DECtalk commands that change the voice's state (ex: [:np] or [:rate 200]), as opposed to one-off actions like
+    ## [:tone ...] or [:dial ...]
+    VOICE_STATE_COMMAND_REGEX = re.compile(r"\[:\s*(n[a-z]\b|name|rate|ra|volume|phoneme|dv)\b([^\]]*)\]", re.IGNORECASE)
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
@@ -28,8 +37,10 @@ class TTSController(Module):
         self.append = CONFIG_OPTIONS.get("append", "")
         self.char_limit = int(CONFIG_OPTIONS.get("char_limit", 1250))
         self.newline_replacement = CONFIG_OPTIONS.get("newline_replacement", "[_<250,10>]")
+        self.streaming_chunk_min_chars = int(CONFIG_OPTIONS.get("tts_streaming_chunk_min_chars", 80))
         self.output_extension = CONFIG_OPTIONS.get("output_extension", "wav")
         self.wine = CONFIG_OPTIONS.get("wine", "wine")
+        self.wineserver = CONFIG_OPTIONS.get("wineserver", "wineserver")
         self.xvfb_prepend = CONFIG_OPTIONS.get("xvfb_prepend", "DISPLAY=:0.0")
         self.is_headless = CONFIG_OPTIONS.get("headless", False)
 
@@ -39,10 +50,24 @@ class TTSController(Module):
             self.output_dir_path = Path.joinpath(utilities.get_root_path(), CONFIG_OPTIONS.get("tts_output_dir", "temp"))
 
         self.paths_to_delete = []
+        self._file_name_counter = itertools.count()
 
         ## Prep the output directory
         self._init_output_dir()
 
+        ## Prep the audio cache, so repeated messages don't need to be synthesized again
+        self.audio_cache: AudioCache = None
+        if (CONFIG_OPTIONS.get("audio_cache_enable", True)):
+            if (audio_cache_dir_path := CONFIG_OPTIONS.get("audio_cache_dir_path")):
+                audio_cache_dir_path = Path(audio_cache_dir_path)
+            else:
+                audio_cache_dir_path = Path.joinpath(utilities.get_root_path(), CONFIG_OPTIONS.get("audio_cache_dir", "audio_cache"))
+
+            self.audio_cache = AudioCache(audio_cache_dir_path, self.output_extension)
+
+        ## Prep the workers that'll actually handle synthesis
+        self.worker_pool = TTSWorkerPool(self._synthesize, self._health_check, self._warm_up)
+
 
     def __del__(self):
         self._init_output_dir()
@@ -71,12 +96,13 @@ class TTSController(Module):
 
 
     def _generate_unique_file_name(self, extension):
+        ## Synthesis runs concurrently now, so multiple files can be requested in the same millisecond. The counter
+        ## keeps those names distinct before any of them have actually been written to disk.
         time_ms = int(time.time() * 1000)
-        file_name = f"{time_ms}.{extension}"
+        file_name = f"{time_ms}-{next(self._file_name_counter)}.{extension}"
 
-        while(os.path.isfile(file_name)):
-            time_ms -= 1
-            file_name = f"{time_ms}.{extension}"
+        while(Path.joinpath(self.output_dir_path, file_name).is_file()):
+            file_name = f"{time_ms}-{next(self._file_name_counter)}.{extension}"
 
         return file_name
 
@@ -85,6 +111,70 @@ class TTSController(Module):
         return (len(message) <= self.char_limit)
 
 
+    def split_message(self, message: str) -> list[str]:
+        '''
+        Splits the message into chunks that can be synthesized separately, so playback can start before the whole
+        message has been synthesized. Chunks are split at sentence boundaries, are at least streaming_chunk_min_chars
+        long where possible, and are never split inside of a bracketed DECtalk command. The latest voice state commands
+        (ex. [:np]) from earlier chunks are prepended onto later ones, so the voice stays consistent across chunks.
+        '''
+
+        ## Find the sentences, ignoring any boundaries inside of brackets or in the middle of words (ex. 3.14)
+        sentences = []
+        start = 0
+        depth = 0
+        for index, char in enumerate(message):
+            if (char == "["):
+                depth += 1
+            elif (char == "]"):
+                depth = max(depth - 1, 0)
+            elif (depth == 0 and char in self.SENTENCE_BOUNDARY_CHARACTERS):
+                next_index = index + 1
+                if (next_index == len(message) or message[next_index].isspace()):
+                    sentences.append(message[start:next_index])
+                    start = next_index
+
+        if (message[start:].strip() or not sentences):
+            sentences.append(message[start:])
+        else:
+            sentences[-1] += message[start:]
+
+        ## Group the sentences into reasonably sized chunks
+        chunks = [""]
+        for sentence in sentences:
+            if (len(chunks[-1]) >= self.streaming_chunk_min_chars):
+                chunks.append("")
+            chunks[-1] += sentence
+
+        ## Carry the voice state forward
+        voice_state: dict[str, str] = {}
+        for index, chunk in enumerate(chunks):
+            chunks[index] = "".join(voice_state.values()) + chunk
+            self._update_voice_state(voice_state, chunk)
+
+        return chunks
+
+
+    def _update_voice_state(self, voice_state: dict[str, str], text: str):
+        '''Keeps the latest voice state command in the text for each setting, in the order that they were last set'''
+
+        for match in self.VOICE_STATE_COMMAND_REGEX.finditer(text):
+            command = match.group(1).lower()
+            if (command.startswith("n")):
+                ## Both [:name paul] and its shorthand [:np] select the speaking voice
+                setting = "voice"
+            elif (command == "ra"):
+                setting = "rate"
+            elif (command == "dv"):
+                ## Each design voice command only changes the parameters that it names (ex. [:dv ap 120 hs 110])
+                setting = "dv " + " ".join(word.lower() for word in match.group(2).split() if word.isalpha())
+            else:
+                setting = command
+
+            voice_state.pop(setting, None)
+            voice_state[setting] = match.group(0)
+
+
     def _parse_message(self, message):
         if(self.newline_replacement):
             message = message.replace("\n", self.newline_replacement)
@@ -100,12 +190,18 @@ class TTSController(Module):
 
 
     def delete(self, file_path):
+        ## Cached files are shared, so just let the cache know that this user of the file is done with it
+        if(self.audio_cache is not None and self.audio_cache.release(file_path)):
+            return True
+
         ## Basically, windows spits out a 'file in use' error when speeches are deleted after
         ## being skipped, probably because of the file being loaded into the ffmpeg player. So
         ## if the deletion fails, just pop it into a list of paths to delete on the next go around.
 
-        if(os.path.isfile(file_path)):
-            self.paths_to_delete.append(file_path)
+        ## Also clean up any files derived from this one (ex. transcoded copies), as they're stored alongside it
+        file_path = Path(file_path)
+        for path in file_path.parent.glob(f"{file_path.stem}.*"):
+            self.paths_to_delete.append(path)
 
         to_delete = []
         for path in self.paths_to_delete:
@@ -123,44 +219,135 @@ class TTSController(Module):
         return True
 
 
-    async def save(self, message, ignore_char_limit=False):
-        ## Check message size
-        if(not self.check_length(message) and not ignore_char_limit):
-            return None
+    def _prepend_environment(self, command: list[str]) -> list[str]:
+        ## Prepend the fake display created with Xvfb if running headless. The 'env' utility handles the variable
+        ## assignment, just like the shell would've done for us.
+        if(self.is_headless):
+            command = ["env", *shlex.split(self.xvfb_prepend), *command]
 
-        ## Generate and validate filename, build the output path save option, and parse the message
-        output_file_path = Path.joinpath(self.output_dir_path, self._generate_unique_file_name(self.output_extension))
-        save_option = f"-w \"{str(output_file_path)}\""
-        message = self._parse_message(message)
+        return command
 
-        ## Build args for execution
-        args = f"\"{str(self.exe_path)}\" {save_option} \"{message}\""
 
-        ## Address issue with spaces in the path on Windows (see: https://github.com/naschorr/hawking/issues/1 and 178)
-        if (utilities.is_windows()):
-            args = f'\"{args}\"'
+    def _build_command(self, message: str, output_file_path: Path) -> list[str]:
+        '''Builds the argument list needed to synthesize the (already parsed) message into output_file_path'''
+
+        ## Arguments are passed directly to the executable rather than through a shell, so there's no need to quote
+        ## anything (see: https://github.com/naschorr/hawking/issues/1 and 178)
+        command = [str(self.exe_path), "-w", str(output_file_path), message]
 
         ## Prepend the windows emulator if using linux (I'm aware of what WINE means)
         if(utilities.is_linux()):
-            args = f"{self.wine} {args}"
+            command = [*shlex.split(self.wine), *command]
 
-        ## Prepend the fake display created with Xvfb if running headless
-        if(self.is_headless):
-            args = f"{self.xvfb_prepend} {args}"
+        return self._prepend_environment(command)
+
+
+    async def _run_command(self, command: list[str], message: str) -> int:
+        '''Runs the synthesis command without blocking the event loop, killing it if it runs past the timeout'''
+
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
 
-        has_timed_out = False
         try:
             ## See https://github.com/naschorr/hawking/issues/50
-            async with async_timeout.timeout(self.audio_generate_timeout_seconds):
-                retval = os.system(args)
+            return await asyncio.wait_for(process.wait(), timeout=self.audio_generate_timeout_seconds)
         except asyncio.TimeoutError:
-            has_timed_out = True
+            await self._kill_process(process)
             raise BuildingAudioFileTimedOutExeption(f"Building wav timed out for '{message}'")
-        except asyncio.CancelledError as e:
-            if (not has_timed_out):
-                LOGGER.exception("CancelledError during wav generation, but not from a timeout!", exc_info=e)
+        except asyncio.CancelledError:
+            ## Don't leave orphaned synthesis processes around if the caller gave up on the audio
+            await self._kill_process(process)
+            raise
 
-        if(retval == 0):
-            return output_file_path
-        else:
+
+    async def _kill_process(self, process: asyncio.subprocess.Process):
+        if (process.returncode is not None):
+            return
+
+        try:
+            process.kill()
+        except ProcessLookupError:
+            return
+
+        await process.wait()
+
+
+    async def _synthesize(self, message: str, output_file_path: Path):
+        '''Synthesizes the (already parsed) message into output_file_path. Invoked by the worker pool.'''
+
+        retval = await self._run_command(self._build_command(message, output_file_path), message)
+
+        if(retval != 0):
+            self.delete(output_file_path)
             raise UnableToBuildAudioFileException(f"Couldn't build the wav file for '{message}', retval={retval}")
+
+
+    async def _health_check(self) -> bool:
+        '''Makes sure that a short message can be synthesized, which also helps to warm up the TTS executable'''
+
+        output_file_path = Path.joinpath(self.output_dir_path, self._generate_unique_file_name(self.output_extension))
+
+        try:
+            await self._synthesize(self._parse_message(self.HEALTH_CHECK_MESSAGE), output_file_path)
+            return output_file_path.is_file() and output_file_path.stat().st_size > 0
+        except Exception as e:
+            LOGGER.warning("Exception during TTS health check", exc_info=e)
+            return False
+        finally:
+            self.delete(output_file_path)
+
+
+    async def _warm_up(self):
+        '''
+        Keeps the wineserver alive between synthesis runs, so each invocation of the TTS executable doesn't have to wait
+        for wine to start up from scratch.
+        '''
+
+        if(not utilities.is_linux()):
+            return
+
+        try:
+            await self._run_command(self._prepend_environment([*shlex.split(self.wineserver), "--persistent"]), "")
+        except Exception as e:
+            LOGGER.warning("Unable to start a persistent wineserver, synthesis will still work but may be slower", exc_info=e)
+
+
+    def build_cache_key(self, parsed_message: str) -> str:
+        return AudioCache.build_key(parsed_message, self.prepend, self.append, self.args)
+
+
+    def unpin(self, file_path: Path):
+        '''Allows a previously pinned audio file to be evicted from the cache again'''
+
+        if (self.audio_cache is not None):
+            self.audio_cache.unpin(Path(file_path).stem)
+
+
+    async def save(self, message, ignore_char_limit=False, pin=False, guild_id=None):
+        ## Check message size
+        if(not self.check_length(message) and not ignore_char_limit):
+            return None
+
+        message = self._parse_message(message)
+
+        ## Serve the audio from the cache if possible, otherwise the workers will synthesize it into the cache
+        if (self.audio_cache is not None):
+            key = self.build_cache_key(message)
+            file_path = await self.audio_cache.get_or_create(
+                key,
+                lambda output_file_path: self.worker_pool.submit(message, output_file_path, guild_id)
+            )
+
+            ## Pinned files are never evicted, which is handy for audio that's known to be played often
+            if (pin):
+                self.audio_cache.pin(key)
+
+            return file_path
+
+        ## Generate a unique file to synthesize into, hand the message off to the workers, and wait for it to be written
+        output_file_path = Path.joinpath(self.output_dir_path, self._generate_unique_file_name(self.output_extension))
+        return await self.worker_pool.submit(message, output_file_path, guild_id)
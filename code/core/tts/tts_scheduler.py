@@ -0,0 +1,136 @@
+import asyncio
+import logging
+from collections import deque, OrderedDict
+
+from core.exceptions import SynthesisQueueFullException
+from common.configuration import Configuration
+from common.logging import Logging
+
+## Config & logging
+CONFIG_OPTIONS = Configuration.load_config()
+LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
+
+
+class TTSScheduler:
+    '''
+    Fairly shares the TTS workers between guilds, so one busy guild can't monopolize synthesis. Each guild gets its own
+    queue, and queues are served with deficit round robin, where a job's cost is the length of its message. Guilds are
+    also limited in how many jobs they can have queued up, and how many jobs they can have synthesizing at once.
+
+    Jobs without a guild (ex. prerendering) share a single background queue, which is weighted lower than the guilds'
+    queues, and isn't subject to the queue depth limit.
+    '''
+
+    BACKGROUND_QUEUE_KEY = None
+
+    ## Keys
+    TTS_SCHEDULER_QUANTUM_CHARS_KEY = "tts_scheduler_quantum_chars"
+    TTS_GUILD_MAX_CONCURRENT_JOBS_KEY = "tts_guild_max_concurrent_jobs"
+    TTS_GUILD_MAX_QUEUED_JOBS_KEY = "tts_guild_max_queued_jobs"
+    TTS_BACKGROUND_WEIGHT_KEY = "tts_background_weight"
+
+    def __init__(self):
+        self.quantum = max(int(CONFIG_OPTIONS.get(self.TTS_SCHEDULER_QUANTUM_CHARS_KEY, 250)), 1)
+        self.max_concurrent_jobs = max(int(CONFIG_OPTIONS.get(self.TTS_GUILD_MAX_CONCURRENT_JOBS_KEY, 1)), 1)
+        self.max_queued_jobs = max(int(CONFIG_OPTIONS.get(self.TTS_GUILD_MAX_QUEUED_JOBS_KEY, 10)), 1)
+        self.background_weight = min(max(float(CONFIG_OPTIONS.get(self.TTS_BACKGROUND_WEIGHT_KEY, 0.25)), 0.01), 1.0)
+
+        self.queues: OrderedDict[int | None, deque] = OrderedDict()   # Only guilds with queued jobs, in round robin order
+        self.deficits: dict[int | None, float] = {}
+        self.in_flight: dict[int | None, int] = {}
+        self._changed = asyncio.Event()
+
+    ## Methods
+
+    def _get_quantum(self, key: int | None) -> float:
+        if (key == self.BACKGROUND_QUEUE_KEY):
+            return self.quantum * self.background_weight
+
+        return self.quantum
+
+
+    def _prune(self, key: int | None):
+        '''Drops any jobs at the front of the queue that the requester has already given up on'''
+
+        queue = self.queues[key]
+        while (queue and queue[0].future.done()):
+            queue.popleft()
+
+        ## Idle queues don't get to bank their deficit, as per deficit round robin
+        if (not queue):
+            del self.queues[key]
+            self.deficits.pop(key, None)
+
+
+    def put(self, job):
+        '''Queues up the job, raising a SynthesisQueueFullException if its guild already has too many jobs queued'''
+
+        key = job.guild_id
+        if (key in self.queues):
+            self._prune(key)
+
+        queue = self.queues.get(key)
+        if (queue is None):
+            queue = deque()
+            self.queues[key] = queue
+            self.deficits[key] = 0
+
+        if (key != self.BACKGROUND_QUEUE_KEY and len(queue) >= self.max_queued_jobs):
+            raise SynthesisQueueFullException(f"Guild {key} already has {len(queue)} messages waiting to be synthesized", key)
+
+        queue.append(job)
+        self._changed.set()
+
+
+    def _next_job(self):
+        for key in list(self.queues.keys()):
+            self._prune(key)
+
+        eligible = [key for key in self.queues if self.in_flight.get(key, 0) < self.max_concurrent_jobs]
+        if (not eligible):
+            return None
+
+        while (True):
+            key = next(iter(self.queues))
+            if (key not in eligible):
+                self.queues.move_to_end(key)
+                continue
+
+            queue = self.queues[key]
+            job = queue[0]
+            if (self.deficits[key] < job.cost):
+                ## Not enough credit to run this job yet, so top up the deficit and move on to the next guild
+                self.deficits[key] += self._get_quantum(key)
+                self.queues.move_to_end(key)
+                continue
+
+            queue.popleft()
+            self.deficits[key] -= job.cost
+            self.in_flight[key] = self.in_flight.get(key, 0) + 1
+            self._prune(key)
+
+            return job
+
+
+    async def get(self):
+        '''Waits for, and returns the next job that should be synthesized'''
+
+        while (True):
+            job = self._next_job()
+            if (job is not None):
+                return job
+
+            self._changed.clear()
+            await self._changed.wait()
+
+
+    def task_done(self, job):
+        '''Indicates that a job retrieved with get() has finished, freeing up its guild to run another job'''
+
+        key = job.guild_id
+        self.in_flight[key] = self.in_flight.get(key, 1) - 1
+        if (self.in_flight[key] <= 0):
+            del self.in_flight[key]
+
+        self._changed.set()
+
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from core.exceptions import BuildingAudioFileTimedOutExeption, UnableToBuildAudioFileException
+from core.tts.tts_scheduler import TTSScheduler
+from common.configuration import Configuration
+from common.logging import Logging
+
+## Config & logging
+CONFIG_OPTIONS = Configuration.load_config()
+LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
+
+
+class TTSJob:
+    '''
+    Represents a single request to synthesize a (parsed) message into the file at output_file_path, on behalf of the
+    guild with the id guild_id (or None for background work).
+    '''
+
+    def __init__(self, message: str, output_file_path: Path, guild_id: int = None):
+        self.message = message
+        self.output_file_path = output_file_path
+        self.guild_id = guild_id
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    ## Properties
+
+    @property
+    def cost(self) -> int:
+        return max(len(self.message), 1)
+
+
+class TTSWorker:
+    '''
+    A long-lived synthesis worker. Workers pull jobs from their pool's scheduler, and are health checked before they take
+    on their first job, after any failed job, and after every 'max_jobs' jobs. Unhealthy workers won't take jobs until
+    they pass a health check again.
+    '''
+
+    def __init__(self, worker_id: int, pool):
+        self.worker_id = worker_id
+        self.pool: TTSWorkerPool = pool
+        self.jobs_completed = 0
+        self.healthy = False
+        ## Unlike healthy, this is only set once the worker has actually failed a health check (and not while it's waiting
+        ## on its first one, or being recycled)
+        self.failed_health_check = False
+        self._task: asyncio.Task = None
+
+    ## Methods
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+
+    def stop(self):
+        if (self._task is not None):
+            self._task.cancel()
+            self._task = None
+
+
+    async def _run(self):
+        while (True):
+            try:
+                if (not self.healthy):
+                    await self._recycle()
+                    continue
+
+                job: TTSJob = await self.pool.scheduler.get()
+                try:
+                    await self._process(job)
+                finally:
+                    self.pool.scheduler.task_done(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.exception(f"Unhandled exception in TTS worker {self.worker_id}", exc_info=e)
+                self.healthy = False
+
+
+    async def _recycle(self):
+        '''Resets the worker's job count, and makes sure that it's able to synthesize audio before taking more jobs'''
+
+        self.jobs_completed = 0
+        self.healthy = await self.pool.health_check()
+        self.failed_health_check = not self.healthy
+
+        if (self.healthy):
+            LOGGER.debug(f"TTS worker {self.worker_id} passed its health check")
+        else:
+            LOGGER.warning(
+                f"TTS worker {self.worker_id} failed its health check, retrying in {self.pool.health_check_retry_seconds} seconds"
+            )
+            await asyncio.sleep(self.pool.health_check_retry_seconds)
+
+
+    async def _process(self, job: TTSJob):
+        ## The requester has already given up on this job, so there's no point in synthesizing it
+        if (job.future.done()):
+            return
+
+        synthesis = asyncio.create_task(self.pool.synthesize(job.message, job.output_file_path))
+
+        ## Kill the synthesis if the requester stops waiting on it
+        def on_job_done(future: asyncio.Future):
+            if (future.cancelled()):
+                synthesis.cancel()
+        job.future.add_done_callback(on_job_done)
+
+        ## Waiting (rather than awaiting the task directly) keeps the worker's own cancellation distinct from the job's
+        try:
+            await asyncio.wait({synthesis})
+        except asyncio.CancelledError:
+            synthesis.cancel()
+            raise
+
+        if (synthesis.cancelled()):
+            return
+
+        if (exception := synthesis.exception()):
+            ## Failed (or hung) synthesis runs can leave wine in a bad state, so double check before continuing
+            if (not job.future.done()):
+                job.future.set_exception(exception)
+            self.healthy = False
+            return
+
+        if (not job.future.done()):
+            job.future.set_result(job.output_file_path)
+
+        self.jobs_completed += 1
+        if (self.jobs_completed >= self.pool.max_jobs_per_worker):
+            LOGGER.debug(f"TTS worker {self.worker_id} completed {self.jobs_completed} jobs, recycling")
+            self.healthy = False
+
+
+class TTSWorkerPool:
+    '''
+    Pool of TTSWorkers that synthesize audio concurrently. Note that the pool gets (re)started lazily on first use, as
+    modules are loaded in a different event loop than the one that the bot runs in.
+    '''
+
+    ## Keys
+    TTS_WORKER_COUNT_KEY = "tts_worker_count"
+    TTS_WORKER_MAX_JOBS_KEY = "tts_worker_max_jobs"
+    TTS_WORKER_HEALTH_CHECK_RETRY_SECONDS_KEY = "tts_worker_health_check_retry_seconds"
+    TTS_QUEUE_TIMEOUT_SECONDS_KEY = "tts_queue_timeout_seconds"
+    AUDIO_GENERATE_TIMEOUT_SECONDS_KEY = "audio_generate_timeout_seconds"
+
+    def __init__(
+            self,
+            synthesize: Callable[[str, Path], Awaitable[None]],
+            health_check: Callable[[], Awaitable[bool]],
+            warm_up: Callable[[], Awaitable[None]] = None
+    ):
+        self.synthesize = synthesize
+        self.health_check = health_check
+        self.warm_up = warm_up
+
+        self.size = max(int(CONFIG_OPTIONS.get(self.TTS_WORKER_COUNT_KEY, 2)), 1)
+        self.max_jobs_per_worker = max(int(CONFIG_OPTIONS.get(self.TTS_WORKER_MAX_JOBS_KEY, 100)), 1)
+        self.health_check_retry_seconds = float(CONFIG_OPTIONS.get(self.TTS_WORKER_HEALTH_CHECK_RETRY_SECONDS_KEY, 5))
+        ## Jobs get this long to make it through the queue, plus however long the synthesis itself is allowed to take
+        self.submit_timeout_seconds = (
+            max(float(CONFIG_OPTIONS.get(self.TTS_QUEUE_TIMEOUT_SECONDS_KEY, 30)), 0) +
+            float(CONFIG_OPTIONS.get(self.AUDIO_GENERATE_TIMEOUT_SECONDS_KEY, 3))
+        )
+
+        self.scheduler: TTSScheduler = None
+        self.workers: list[TTSWorker] = []
+        self._loop: asyncio.AbstractEventLoop = None
+
+    ## Properties
+
+    @property
+    def has_healthy_workers(self) -> bool:
+        '''Whether any of the workers are able to synthesize audio, or might be (as they haven't been checked yet)'''
+
+        return any(not worker.failed_health_check for worker in self.workers)
+
+    ## Methods
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if (self._loop is loop):
+            return
+
+        self.stop()
+
+        self._loop = loop
+        self.scheduler = TTSScheduler()
+        self.workers = [TTSWorker(worker_id, self) for worker_id in range(self.size)]
+
+        if (self.warm_up is not None):
+            loop.create_task(self.warm_up())
+
+        for worker in self.workers:
+            worker.start()
+
+        LOGGER.info(f"Started {self.size} TTS worker{'s' if self.size != 1 else ''}")
+
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+        self.workers = []
+
+
+    async def submit(self, message: str, output_file_path: Path, guild_id: int = None) -> Path:
+        '''
+        Queues up the message for synthesis on behalf of the guild, and waits for a worker to write it to
+        output_file_path. Raises a SynthesisQueueFullException if the guild already has too many messages queued, an
+        UnableToBuildAudioFileException if none of the workers are healthy, and a BuildingAudioFileTimedOutExeption if
+        the message isn't queued and synthesized within the pool's deadline.
+        '''
+
+        self._ensure_started()
+
+        ## Don't leave the requester waiting on workers that are stuck retrying their health checks
+        if (not self.has_healthy_workers):
+            raise UnableToBuildAudioFileException(f"No TTS workers are healthy, unable to synthesize '{message}'")
+
+        job = TTSJob(message, output_file_path, guild_id)
+        self.scheduler.put(job)
+
+        try:
+            ## Timing out cancels the job's future, which drops it from the queue (or kills its synthesis)
+            return await asyncio.wait_for(job.future, timeout=self.submit_timeout_seconds)
+        except asyncio.TimeoutError:
+            raise BuildingAudioFileTimedOutExeption(
+                f"Synthesizing '{message}' didn't finish within {self.submit_timeout_seconds} seconds"
+            )
@@ -17,13 +17,15 @@ from discord.ext import commands
 from core.cogs import admin_cog, help_cog, speech_cog, speech_config_help_cog
 from core.tts import tts_controller
 from common import audio_player, message_parser
-from common.cogs import privacy_management_cog, invite_cog
+from common.cogs import privacy_management_cog, invite_cog, loop_watchdog_cog
 from common.configuration import Configuration
 from common.logging import Logging
 from common.command_management import invoked_command_handler, command_reconstructor
 from common.database import database_manager
+from common.database.database_client import DatabaseClient
 from common.database.factories import anonymous_item_factory
 from common.database.clients.dynamo_db import dynamo_db_client
+from common.database.clients.sqlite import sqlite_client
 from common.module.module_manager import ModuleManager
 from common.ui import component_factory
 from modules.phrases import phrases
@@ -67,7 +69,7 @@ class Hawking:
         )
         self.module_manager.register_module(
             database_manager.DatabaseManager,
-            dynamo_db_client.DynamoDbClient(),
+            self.build_database_client(),
             dependencies=[command_reconstructor.CommandReconstructor, anonymous_item_factory.AnonymousItemFactory]
         )
         self.module_manager.register_module(
@@ -81,10 +83,15 @@ class Hawking:
             self.bot,
             dependencies=[database_manager.DatabaseManager]
         )
+        self.module_manager.register_module(
+            loop_watchdog_cog.LoopWatchdogCog,
+            self.bot,
+            dependencies=[admin_cog.AdminCog, database_manager.DatabaseManager]
+        )
         self.module_manager.register_module(
             privacy_management_cog.PrivacyManagementCog,
             self.bot,
-            dependencies=[component_factory.ComponentFactory, database_manager.DatabaseManager]
+            dependencies=[admin_cog.AdminCog, component_factory.ComponentFactory, database_manager.DatabaseManager]
         )
         self.module_manager.register_module(
             speech_config_help_cog.SpeechConfigHelpCog,
@@ -162,12 +169,33 @@ class Hawking:
     def module_manager(self) -> ModuleManager:
         return self._module_manager
 
+    ## Pick the client that analytics are stored with
+    def build_database_client(self) -> DatabaseClient:
+        '''Builds the database client that's selected in the config'''
+
+        client_name = CONFIG_OPTIONS.get("database_client", "dynamo_db")
+        if (client_name == "sqlite"):
+            return sqlite_client.SqliteClient()
+        elif (client_name == "dynamo_db"):
+            return dynamo_db_client.DynamoDbClient()
+        else:
+            raise RuntimeError(f"Unknown database client: '{client_name}', expected 'dynamo_db' or 'sqlite'")
+
+
     ## Run the bot
     def run(self):
         '''Starts the bot up'''
 
         LOGGER.info(f"Starting up {self.name}")
-        self.bot.run(self.token)
+        try:
+            self.bot.run(self.token)
+        finally:
+            ## Make sure that anything still buffered makes it into the database before shutting down
+            asyncio.run(self.database_manager.flush())
+
+            ## Cogs aren't unloaded on a normal shutdown, so save the phrase usage that hasn't been saved yet here too
+            if (phrases_cog := self.module_manager.get_module(phrases.Phrases.__name__)):
+                phrases_cog.phrase_usage_tracker.save()
 
 
 if(__name__ == "__main__"):
@@ -0,0 +1,152 @@
+## Tests for the content addressed cache of synthesized audio. Run them from anywhere with:
+## python -m unittest discover code/tests
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+## Make sure that the bot's modules are importable, no matter where this is run from
+_code_path = Path(__file__).resolve().parent.parent
+if (str(_code_path) not in sys.path):
+    sys.path.insert(0, str(_code_path))
+
+from core.tts import audio_cache
+from core.tts.audio_cache import AudioCache
+
+
+class TestAudioCacheKey(unittest.TestCase):
+    def test_same_message_and_voice_give_same_key(self):
+        key = AudioCache.build_key("hello", "[:np]", "", {"a": 1, "b": 2})
+
+        self.assertEqual(key, AudioCache.build_key("hello", "[:np]", "", {"a": 1, "b": 2}))
+        self.assertEqual(key, AudioCache.build_key("hello", "[:np]", "", {"b": 2, "a": 1}))
+
+
+    def test_different_message_voice_or_parameters_give_different_keys(self):
+        key = AudioCache.build_key("hello", "[:np]", "", {"a": 1})
+
+        self.assertNotEqual(key, AudioCache.build_key("hello there", "[:np]", "", {"a": 1}))
+        self.assertNotEqual(key, AudioCache.build_key("hello", "[:nh]", "", {"a": 1}))
+        self.assertNotEqual(key, AudioCache.build_key("hello", "[:np]", "[:rate 200]", {"a": 1}))
+        self.assertNotEqual(key, AudioCache.build_key("hello", "[:np]", "", {"a": 2}))
+
+
+class TestAudioCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.cache_dir_path = Path(self.directory.name)
+
+
+    def build_cache(self, max_size_bytes: int = 1000, max_age_seconds: int = 3600) -> AudioCache:
+        with mock.patch.dict(audio_cache.CONFIG_OPTIONS, {
+            "audio_cache_max_size_bytes": max_size_bytes,
+            "audio_cache_max_age_seconds": max_age_seconds
+        }):
+            cache = AudioCache(self.cache_dir_path, "wav")
+
+        def stop_evicting():
+            if (cache._eviction_task is not None):
+                cache._eviction_task.cancel()
+        self.addCleanup(stop_evicting)
+
+        return cache
+
+
+    async def add(self, cache: AudioCache, key: str, size_bytes: int) -> Path:
+        async def create(file_path: Path):
+            file_path.write_bytes(b"x" * size_bytes)
+
+        return await cache.get_or_create(key, create)
+
+
+    def write_opus(self, file_path: Path, size_bytes: int):
+        ## Stands in for the audio player's Opus transcode, which is stored alongside the cached file
+        file_path.with_suffix(".opus").write_bytes(b"x" * size_bytes)
+
+
+    async def test_same_key_reuses_file(self):
+        cache = self.build_cache()
+        create_count = 0
+
+        async def create(file_path: Path):
+            nonlocal create_count
+            create_count += 1
+            file_path.write_bytes(b"x")
+
+        key = AudioCache.build_key("hello", "[:np]", "", {})
+        file_paths = await asyncio.gather(cache.get_or_create(key, create), cache.get_or_create(key, create))
+        file_paths.append(await cache.get_or_create(key, create))
+
+        self.assertEqual(create_count, 1)
+        self.assertEqual(set(file_paths), {cache.get_file_path(key)})
+
+
+    async def test_size_includes_opus_files(self):
+        cache = self.build_cache()
+        file_path = await self.add(cache, "a", 100)
+        self.assertEqual(cache.size_bytes, 100)
+
+        self.write_opus(file_path, 50)
+        cache.release(file_path)
+        self.assertEqual(cache.size_bytes, 150)
+
+        ## Existing Opus files are counted when the cache is loaded too
+        self.assertEqual(self.build_cache().size_bytes, 150)
+
+
+    async def test_evicts_least_recently_used_past_max_size(self):
+        cache = self.build_cache(max_size_bytes=250)
+        file_path = await self.add(cache, "a", 100)
+        self.write_opus(file_path, 100)
+        cache.release(file_path)
+
+        ## Only the Opus file pushes the cache over its max size
+        cache.release(await self.add(cache, "b", 100))
+
+        self.assertEqual(list(cache.entries), ["b"])
+        self.assertEqual(cache.size_bytes, 100)
+        self.assertEqual(sorted(path.name for path in self.cache_dir_path.iterdir()), ["b.wav"])
+
+
+    async def test_referenced_and_pinned_entries_arent_evicted(self):
+        cache = self.build_cache(max_size_bytes=150)
+        await self.add(cache, "a", 100)
+        cache.release(await self.add(cache, "b", 100))
+        cache.pin("b")
+        cache.release(await self.add(cache, "c", 100))
+
+        self.assertEqual(list(cache.entries), ["a", "b", "c"])
+
+
+    async def test_expires_unused_entries_on_load(self):
+        cache = self.build_cache(max_age_seconds=60)
+        cache.release(await self.add(cache, "old", 100))
+        cache.release(await self.add(cache, "new", 100))
+
+        old_time = time.time() - 120
+        os.utime(cache.get_file_path("old"), (old_time, old_time))
+
+        self.assertEqual(list(self.build_cache(max_age_seconds=60).entries), ["new"])
+
+
+    async def test_expires_unused_entries_periodically(self):
+        cache = self.build_cache(max_age_seconds=60)
+        cache.eviction_interval_seconds = 0.05      # Faster than the config allows, so the test doesn't have to wait
+        cache.release(await self.add(cache, "a", 100))
+
+        ## Even the most recently used entry expires, once nothing's used it for long enough
+        cache.entries["a"].last_accessed = time.time() - 120
+        await asyncio.sleep(0.2)
+
+        self.assertEqual(list(cache.entries), [])
+        self.assertEqual(cache.size_bytes, 0)
+        self.assertFalse(cache.get_file_path("a").exists())
+
+
+if (__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,127 @@
+## Tests for the crash safe journal of delete requests. Run them from anywhere with:
+## python -m unittest discover code/tests
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+## Make sure that the bot's modules are importable, no matter where this is run from
+_code_path = Path(__file__).resolve().parent.parent
+if (str(_code_path) not in sys.path):
+    sys.path.insert(0, str(_code_path))
+
+from common.delete_request_journal import DeleteRequestJournal
+
+
+class TestDeleteRequestJournal(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        self.directory_path = Path(self.directory.name)
+        self.journal_path = Path.joinpath(self.directory_path, "delete_requests.journal")
+        self.legacy_path = Path.joinpath(self.directory_path, "delete_requests.txt")
+
+
+    def load(self, journal_path: Path = None, legacy_path: Path = None) -> DeleteRequestJournal:
+        journal = DeleteRequestJournal(journal_path or self.journal_path, legacy_path)
+        self.addCleanup(journal.close)
+
+        return journal
+
+
+    def reload(self, journal: DeleteRequestJournal, legacy_path: Path = None) -> DeleteRequestJournal:
+        journal.close()
+
+        return self.load(journal.journal_path, legacy_path)
+
+
+    async def test_creates_empty_journal(self):
+        journal = self.load()
+
+        self.assertEqual(journal.user_ids, set())
+        self.assertEqual(self.journal_path.read_bytes(), DeleteRequestJournal.MAGIC)
+
+
+    async def test_appended_ids_survive_reload(self):
+        journal = self.load()
+        self.assertTrue(await journal.add(1))
+        self.assertTrue(await journal.add(2))
+        self.assertFalse(await journal.add(1))
+
+        self.assertEqual(self.reload(journal).user_ids, {1, 2})
+
+
+    async def test_removed_ids_stay_removed(self):
+        journal = self.load()
+        for user_id in (1, 2, 3):
+            await journal.add(user_id)
+
+        await journal.remove([1, 3])
+        await journal.add(4)
+
+        self.assertEqual(journal.user_ids, {2, 4})
+        self.assertEqual(self.reload(journal).user_ids, {2, 4})
+
+
+    async def test_drops_partially_written_record(self):
+        journal = self.load()
+        await journal.add(1)
+        await journal.add(2)
+        journal.close()
+
+        ## Simulate a crash partway through appending the last record
+        valid_data = self.journal_path.read_bytes()
+        self.journal_path.write_bytes(valid_data[:-3])
+
+        journal = self.load()
+        self.assertEqual(journal.user_ids, {1})
+        self.assertEqual(len(self.journal_path.read_bytes()), len(valid_data) - DeleteRequestJournal.RECORD_HEADER.size - DeleteRequestJournal.USER_ID.size)
+
+        ## Appends after the truncation are readable too
+        await journal.add(3)
+        self.assertEqual(self.reload(journal).user_ids, {1, 3})
+
+
+    async def test_migrates_plain_text_journal_in_place(self):
+        self.journal_path.write_text("1\n2\n\n3\n")
+
+        journal = self.load()
+
+        self.assertEqual(journal.user_ids, {1, 2, 3})
+        self.assertTrue(self.journal_path.read_bytes().startswith(DeleteRequestJournal.MAGIC))
+        self.assertEqual(self.reload(journal).user_ids, {1, 2, 3})
+
+
+    async def test_migrates_legacy_file(self):
+        self.legacy_path.write_text("1\n2\n")
+
+        journal = self.load(legacy_path=self.legacy_path)
+
+        self.assertEqual(journal.user_ids, {1, 2})
+        self.assertFalse(self.legacy_path.exists())
+        self.assertEqual(self.reload(journal).user_ids, {1, 2})
+
+
+    async def test_journal_at_empty_legacy_path(self):
+        ## The queue file gets created (empty) before the journal loads, when it's configured at the old path
+        self.legacy_path.touch()
+
+        journal = self.load(self.legacy_path, self.legacy_path)
+        await journal.add(1)
+
+        self.assertTrue(self.legacy_path.read_bytes().startswith(DeleteRequestJournal.MAGIC))
+        self.assertEqual(self.reload(journal, self.legacy_path).user_ids, {1})
+
+
+    async def test_journal_at_populated_legacy_path(self):
+        self.legacy_path.write_text("1\n2\n")
+
+        journal = self.load(self.legacy_path, self.legacy_path)
+        await journal.add(3)
+
+        self.assertEqual(self.reload(journal, self.legacy_path).user_ids, {1, 2, 3})
+
+
+if (__name__ == "__main__"):
+    unittest.main()
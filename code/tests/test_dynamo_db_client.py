@@ -0,0 +1,162 @@
+## Tests for how the DynamoDB client spools and replays items that it can't write. Run them from anywhere with:
+## python -m unittest discover code/tests
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+## Make sure that the bot's modules are importable, no matter where this is run from
+_code_path = Path(__file__).resolve().parent.parent
+if (str(_code_path) not in sys.path):
+    sys.path.insert(0, str(_code_path))
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from common.database import database_spool
+from common.database.clients.dynamo_db import dynamo_db_client
+from common.database.clients.dynamo_db.dynamo_db_client import DynamoDbClient
+from common.database.database_spool import DatabaseSpool
+
+
+def build_client_error(code: str, status_code: int) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status_code}}, "BatchWriteItem")
+
+
+class FakeDynamoDb:
+    '''Stands in for DynamoDB's batch_write_item, rejecting any batch that contains an item marked as invalid'''
+
+    def __init__(self):
+        self.written: list[str] = []
+        self.error: Exception = None
+
+    def batch_write_item(self, RequestItems: dict) -> dict:
+        if (self.error is not None):
+            raise self.error
+
+        items = [request["PutRequest"]["Item"] for requests in RequestItems.values() for request in requests]
+        if (any(item.get("invalid") for item in items)):
+            raise build_client_error("ValidationException", 400)
+
+        self.written.extend(item["QueryId"] for item in items)
+        return {"UnprocessedItems": {}}
+
+
+class TestDynamoDbClientSpool(unittest.TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.spool_dir.cleanup)
+
+        config_patch = mock.patch.dict(database_spool.CONFIG_OPTIONS, {"database_spool_dir_path": self.spool_dir.name})
+        config_patch.start()
+        self.addCleanup(config_patch.stop)
+
+        client_config_patch = mock.patch.dict(dynamo_db_client.CONFIG_OPTIONS, {
+            "dynamo_db_batch_write_max_retries": 1,
+            "dynamo_db_batch_write_backoff_seconds": 0,
+            "dynamo_db_primary_key": "QueryId"
+        })
+        client_config_patch.start()
+        self.addCleanup(client_config_patch.stop)
+
+        self.client = DynamoDbClient()
+        self.fake_dynamo_db = FakeDynamoDb()
+        self.client.dynamo_db = mock.Mock()
+        self.client.dynamo_db.meta.client.batch_write_item = self.fake_dynamo_db.batch_write_item
+
+
+    def build_requests(self, *query_ids: str, invalid: set[str] = frozenset()) -> list[tuple[str, dict]]:
+        return [("Table", {"QueryId": query_id, "invalid": query_id in invalid}) for query_id in query_ids]
+
+
+    def get_spooled_ids(self) -> list[str]:
+        return [
+            record["item"]["QueryId"]
+            for segment_path in self.client.spool.get_segments()
+            for record in self.client.spool.read_segment(segment_path)
+        ]
+
+
+    def test_spools_items_while_throttled(self):
+        self.fake_dynamo_db.error = build_client_error("ProvisionedThroughputExceededException", 400)
+        self.client._write_or_spool(self.build_requests("a", "b"))
+
+        self.assertEqual(self.fake_dynamo_db.written, [])
+        self.assertEqual(self.get_spooled_ids(), ["a", "b"])
+
+
+    def test_spools_items_while_disconnected(self):
+        self.fake_dynamo_db.error = EndpointConnectionError(endpoint_url="https://dynamodb")
+        self.client._write_or_spool(self.build_requests("a"))
+
+        self.assertEqual(self.get_spooled_ids(), ["a"])
+
+
+    def test_replays_spool_in_order(self):
+        self.fake_dynamo_db.error = build_client_error("ThrottlingException", 400)
+        self.client._write_or_spool(self.build_requests("a", "b"))
+        self.client._write_or_spool(self.build_requests("c"))
+
+        ## New items have to wait behind the spooled ones, even once the database recovers
+        self.fake_dynamo_db.error = None
+        self.client._write_or_spool(self.build_requests("d"))
+
+        self.assertEqual(self.fake_dynamo_db.written, ["a", "b", "c", "d"])
+        self.assertEqual(self.client.spool.depth, 0)
+
+
+    def test_drops_invalid_items_without_spooling(self):
+        self.client._write_or_spool(self.build_requests("a", "b", "c", invalid={"b"}))
+
+        self.assertEqual(self.fake_dynamo_db.written, ["a", "c"])
+        self.assertEqual(self.client.spool.depth, 0)
+
+
+    def test_invalid_spooled_item_doesnt_block_replay(self):
+        self.fake_dynamo_db.error = build_client_error("InternalServerError", 500)
+        self.client._write_or_spool(self.build_requests("a", "b", "c", invalid={"a"}))
+
+        self.fake_dynamo_db.error = None
+        self.client._replay_spool()
+
+        self.assertEqual(self.fake_dynamo_db.written, ["b", "c"])
+        self.assertEqual(self.client.spool.depth, 0)
+
+
+class TestDatabaseSpool(unittest.TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.spool_dir.cleanup)
+
+
+    def build_spool(self, segment_max_bytes: int, max_bytes: int) -> DatabaseSpool:
+        with mock.patch.dict(database_spool.CONFIG_OPTIONS, {
+            "database_spool_dir_path": self.spool_dir.name,
+            "database_spool_segment_max_bytes": segment_max_bytes,
+            "database_spool_max_bytes": max_bytes
+        }):
+            return DatabaseSpool()
+
+
+    def test_drops_oldest_segments_past_cap(self):
+        spool = self.build_spool(segment_max_bytes=1, max_bytes=40)
+        for index in range(5):
+            spool.append([{"index": index}])
+
+        records = [record["index"] for segment_path in spool.get_segments() for record in spool.read_segment(segment_path)]
+        self.assertLessEqual(spool.size_bytes, 40)
+        self.assertEqual(records, list(range(5 - len(records), 5)))
+        self.assertLess(len(records), 5)
+
+
+    def test_spooled_records_survive_restart(self):
+        spool = self.build_spool(segment_max_bytes=1048576, max_bytes=104857600)
+        spool.append([{"index": 0}, {"index": 1}])
+
+        spool = self.build_spool(segment_max_bytes=1048576, max_bytes=104857600)
+        self.assertEqual(spool.depth, 2)
+        self.assertEqual([record for segment_path in spool.get_segments() for record in spool.read_segment(segment_path)], [{"index": 0}, {"index": 1}])
+
+
+if (__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,130 @@
+## Tests for finding emoji in messages, and for the on disk table of emoji names. Run them from anywhere with:
+## python -m unittest discover code/tests
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+## Make sure that the bot's modules are importable, no matter where this is run from
+_code_path = Path(__file__).resolve().parent.parent
+if (str(_code_path) not in sys.path):
+    sys.path.insert(0, str(_code_path))
+
+from common import emoji_matcher
+from common.emoji_matcher import EmojiMatcher
+
+
+THUMBS_UP = "\U0001f44d"
+MEDIUM_SKIN_TONE = "\U0001f3fd"
+MAN = "\U0001f468"
+WOMAN = "\U0001f469"
+GIRL = "\U0001f467"
+ZWJ = EmojiMatcher.ZERO_WIDTH_JOINER
+RED_HEART = "\u2764"
+KEYCAP = "\u20e3"
+VARIATION_SELECTOR = "\ufe0f"
+
+EMOJI_NAMES = {
+    THUMBS_UP: "thumbs up",
+    THUMBS_UP + MEDIUM_SKIN_TONE: "thumbs up medium skin tone",
+    MAN: "man",
+    WOMAN: "woman",
+    GIRL: "girl",
+    MAN + ZWJ + WOMAN + ZWJ + GIRL: "family man woman girl",
+    "1" + VARIATION_SELECTOR + KEYCAP: "keycap 1",
+    RED_HEART: "red heart"
+}
+
+
+class TestEmojiMatcher(unittest.TestCase):
+    def setUp(self):
+        self.matcher = EmojiMatcher(EMOJI_NAMES)
+
+
+    def test_replaces_single_codepoint_emoji(self):
+        self.assertEqual(self.matcher.replace(f"nice{THUMBS_UP}!"), "nicethumbs up!")
+        self.assertEqual(self.matcher.strip(f"nice{THUMBS_UP}!"), "nice!")
+
+
+    def test_replaces_multi_codepoint_emoji(self):
+        message = f"{THUMBS_UP}{MEDIUM_SKIN_TONE} {MAN}{ZWJ}{WOMAN}{ZWJ}{GIRL} 1{VARIATION_SELECTOR}{KEYCAP}"
+
+        self.assertEqual(self.matcher.replace(message), "thumbs up medium skin tone family man woman girl keycap 1")
+        self.assertEqual(self.matcher.strip(message), "  ")
+
+
+    def test_splits_unknown_sequences(self):
+        ## Not a known family, so it's split into its people, and the (now meaningless) joiners are dropped
+        self.assertEqual(self.matcher.replace(f"{MAN}{ZWJ}{GIRL}"), "mangirl")
+
+        ## Only the plain heart is known, so the variation selector's dropped
+        self.assertEqual(self.matcher.replace(f"{RED_HEART}{VARIATION_SELECTOR}"), "red heart")
+
+
+    def test_leaves_plain_text_alone(self):
+        self.assertEqual(self.matcher.replace("1 + 1 = 2"), "1 + 1 = 2")
+
+
+    def test_handles_only_single_codepoint_emoji(self):
+        matcher = EmojiMatcher({THUMBS_UP: "thumbs up"})
+
+        self.assertEqual(matcher.replace(f"{THUMBS_UP}{MEDIUM_SKIN_TONE}"), f"thumbs up{MEDIUM_SKIN_TONE}")
+        self.assertEqual(EmojiMatcher({}).replace(f"hi {THUMBS_UP}"), f"hi {THUMBS_UP}")
+
+
+class TestEmojiTable(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        config_patch = mock.patch.dict(emoji_matcher.CONFIG_OPTIONS, {
+            EmojiMatcher.EMOJI_TABLE_DIR_PATH_KEY: self.directory.name
+        })
+        config_patch.start()
+        self.addCleanup(config_patch.stop)
+
+        self.emoji_version = "1.0.0"
+        version_patch = mock.patch.object(EmojiMatcher, "get_emoji_version", side_effect=lambda: self.emoji_version)
+        version_patch.start()
+        self.addCleanup(version_patch.stop)
+
+
+    def load(self) -> tuple[dict[str, str], bool]:
+        '''Loads the emoji names, and returns them along with whether or not they had to be built from scratch'''
+
+        with mock.patch.object(EmojiMatcher, "build_emoji_names", return_value=dict(EMOJI_NAMES)) as build_emoji_names:
+            emoji_names = EmojiMatcher.load_emoji_names()
+
+        return emoji_names, build_emoji_names.called
+
+
+    def test_table_round_trips(self):
+        self.assertEqual(self.load(), (EMOJI_NAMES, True))
+        self.assertEqual(self.load(), (EMOJI_NAMES, False))
+
+
+    def test_rebuilds_table_for_new_emoji_version(self):
+        self.load()
+        self.emoji_version = "2.0.0"
+
+        self.assertEqual(self.load(), (EMOJI_NAMES, True))
+        self.assertEqual(self.load(), (EMOJI_NAMES, False))
+
+
+    def test_rebuilds_invalid_table(self):
+        self.load()
+        table_path = EmojiMatcher.get_emoji_table_path(self.emoji_version)
+
+        for contents in [b"", b"not an emoji table", EmojiMatcher.EMOJI_TABLE_MAGIC + b"0.0.0:1\n"]:
+            with self.subTest(contents=contents):
+                table_path.write_bytes(contents)
+                self.assertEqual(self.load(), (EMOJI_NAMES, True))
+
+        table_path.write_bytes(EmojiMatcher._build_emoji_table_header(self.emoji_version) + b"\xff\xfe")
+        with self.assertLogs(emoji_matcher.LOGGER, "WARNING"):
+            self.assertEqual(self.load(), (EMOJI_NAMES, True))
+
+
+if (__name__ == "__main__"):
+    unittest.main()
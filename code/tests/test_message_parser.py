@@ -0,0 +1,120 @@
+## Tests for how MessageParser replaces Discord mentions. Run them from anywhere with:
+## python -m unittest discover code/tests
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+## Make sure that the bot's modules are importable, no matter where this is run from
+_code_path = Path(__file__).resolve().parent.parent
+if (str(_code_path) not in sys.path):
+    sys.path.insert(0, str(_code_path))
+
+from common.emoji_matcher import EmojiMatcher
+from common.message_parser import MessageParser
+
+
+USER_ID = "111111111111111111"
+MEMBER_ID = "222222222222222222"
+ROLE_ID = "333333333333333333"
+CHANNEL_ID = "444444444444444444"
+UNKNOWN_ID = "999999999999999999"
+
+INTERACTION_DATA = {
+    "resolved": {
+        "users": {
+            USER_ID: {"id": USER_ID, "username": "hawking"},
+            MEMBER_ID: {"id": MEMBER_ID, "username": "stephen"}
+        },
+        "members": {
+            MEMBER_ID: {"user": {"id": MEMBER_ID, "username": "stephen"}, "nick": "steve"}
+        },
+        "roles": {
+            ROLE_ID: {"id": ROLE_ID, "name": "physicists"}
+        },
+        "channels": {
+            CHANNEL_ID: {"id": CHANNEL_ID, "name": "general"}
+        }
+    }
+}
+
+
+class TestReplaceMentions(unittest.TestCase):
+    def setUp(self):
+        ## Keep the real emoji table out of these tests
+        emoji_matcher = EmojiMatcher({"\U0001f44d": "thumbs up", "\U0001f44d\U0001f3fd": "thumbs up medium skin tone"})
+        with mock.patch.object(EmojiMatcher, "get_shared", return_value=emoji_matcher):
+            self.message_parser = MessageParser()
+
+
+    def replace(self, message: str, **kwargs) -> str:
+        return self.message_parser.replace_mentions(message, INTERACTION_DATA, **kwargs)
+
+
+    def test_replaces_user_mentions(self):
+        self.assertEqual(self.replace(f"hi <@{USER_ID}>"), "hi hawking")
+
+
+    def test_replaces_nick_mentions_with_nick(self):
+        self.assertEqual(self.replace(f"hi <@!{MEMBER_ID}> and <@{MEMBER_ID}>"), "hi steve and steve")
+
+
+    def test_replaces_role_mentions(self):
+        self.assertEqual(self.replace(f"hi <@&{ROLE_ID}>"), "hi physicists")
+
+
+    def test_replaces_channel_mentions(self):
+        self.assertEqual(self.replace(f"see <#{CHANNEL_ID}>"), "see general")
+
+
+    def test_keeps_mention_formatting(self):
+        self.assertEqual(
+            self.replace(f"<@!{MEMBER_ID}> <@&{ROLE_ID}> <#{CHANNEL_ID}>", hide_mention_formatting=False),
+            "<@!steve> <@&physicists> <#general>"
+        )
+
+
+    def test_replaces_repeated_mentions(self):
+        self.assertEqual(self.replace(f"<@{USER_ID}> <@{USER_ID}>"), "hawking hawking")
+
+
+    def test_leaves_unknown_mentions_alone(self):
+        message = f"hi <@{UNKNOWN_ID}>, <@&{UNKNOWN_ID}> and <#{UNKNOWN_ID}>"
+
+        self.assertEqual(self.replace(message), message)
+
+
+    def test_hides_bare_ids(self):
+        ## Bare ids are almost certainly from a command's options (ex. /say user:111...)
+        self.assertEqual(self.replace(f"{USER_ID} hello"), " hello")
+        self.assertEqual(self.replace(f"{USER_ID} hello", hide_meta_mentions=False), "hawking hello")
+
+
+    def test_leaves_plain_numbers_alone(self):
+        message = f"call 5551234, it's {UNKNOWN_ID} or 1{USER_ID}9"
+
+        self.assertEqual(self.replace(message), message)
+
+
+    def test_leaves_message_alone_without_resolved_data(self):
+        message = f"hi <@{USER_ID}> {USER_ID}"
+
+        self.assertEqual(self.message_parser.replace_mentions(message, {}), message)
+
+
+    def test_emoji_matcher_is_built_up_front(self):
+        ## Building it takes a while, so it shouldn't happen on the event loop when the first message is parsed
+        with mock.patch.object(EmojiMatcher, "get_shared") as get_shared:
+            message_parser = MessageParser()
+            get_shared.assert_called_once()
+
+            message_parser.parse_message("\U0001f44d", {})
+            get_shared.assert_called_once()
+
+
+    def test_parses_mentions_and_emoji(self):
+        self.assertEqual(self.message_parser.parse_message(f"<@{USER_ID}> \U0001f44d", INTERACTION_DATA), "hawking thumbs up")
+
+
+if (__name__ == "__main__"):
+    unittest.main()
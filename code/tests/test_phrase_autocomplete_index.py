@@ -0,0 +1,142 @@
+## Tests for the sorted index that phrase names are autocompleted from. Run them from anywhere with:
+## python -m unittest discover code/tests
+import sys
+import unittest
+from pathlib import Path
+
+## Make sure that the bot's modules (and the phrases module) are importable, no matter where this is run from
+_code_path = Path(__file__).resolve().parent.parent
+for _path in [str(_code_path), str(_code_path.parent)]:
+    if (_path not in sys.path):
+        sys.path.insert(0, _path)
+
+from modules.phrases.models.phrase import Phrase
+from modules.phrases.phrase_autocomplete_index import PhraseAutocompleteIndex
+
+
+def build_phrases(*phrases: tuple[str, str]) -> dict[str, Phrase]:
+    return {name: Phrase(name, "", None, help=help) for name, help in phrases}
+
+
+PHRASES = build_phrases(
+    ("allstar", "It's all ogre now."),
+    ("ateam", "I love it when a plan comes together!"),
+    ("batman", "Starring: Adam West!"),
+    ("birthday", "A very special day."),
+    ("careless", "Careless whisper"),
+    ("Chocolate", "Chocolate rain"),
+    ("daisy", "Daisy Bell"),
+    ("darude", "Sandstorm"),
+    ("imperial", "The Imperial March"),
+    ("jeopardy", "Think music"),
+    ("mario", "Super Mario Bros."),
+    ("nyan", "Nyan cat"),
+    ("rickroll", "Never gonna give you up"),
+    ("skyrim", "Dragonborn"),
+    ("tetris", "Korobeiniki"),
+    ("trololo", None),
+    ("zelda", "Zelda's Lullaby"),
+    ("zeldaintro", "The Legend of Zelda")
+)
+
+INPUTS = ["a", "at", "ma", "MAR", "zelda", "lda", "the", "dragon", "roll", "r", "  Chocolate  ", "Never gonna"]
+
+
+def linear_search(phrases: dict[str, Phrase], current: str, popularity: dict[str, float] = {}) -> list[str]:
+    '''Checks every phrase, ranking names that start with the input, then contain it, then have help text that does'''
+
+    key = " ".join(current.casefold().split())
+    tiers = {}
+    for name, phrase in phrases.items():
+        indexed_name = name.casefold()
+        help_words = " ".join((phrase.help or "").casefold().split()).split(" ")
+        if (indexed_name.startswith(key)):
+            tiers[name] = PhraseAutocompleteIndex.PREFIX_MATCH
+        elif (key in indexed_name):
+            tiers[name] = PhraseAutocompleteIndex.INFIX_MATCH
+        elif (any(" ".join(help_words[index:]).startswith(key) for index in range(len(help_words)))):
+            tiers[name] = PhraseAutocompleteIndex.HELP_MATCH
+
+    names = sorted(tiers, key=lambda name: (tiers[name], -popularity.get(name, 0), name))
+    return names[:PhraseAutocompleteIndex.MAX_CHOICES]
+
+
+class TestPhraseAutocompleteIndex(unittest.TestCase):
+    def build_index(self, phrases: dict[str, Phrase] = PHRASES) -> PhraseAutocompleteIndex:
+        index = PhraseAutocompleteIndex()
+        index.update(phrases)
+
+        return index
+
+
+    def search(self, index: PhraseAutocompleteIndex, current: str, **kwargs) -> list[str]:
+        return [phrase.name for phrase in index.search(current, **kwargs)]
+
+
+    def assert_matches_linear_search(self, index: PhraseAutocompleteIndex, phrases: dict[str, Phrase], popularity: dict[str, float] = {}):
+        for current in INPUTS:
+            with self.subTest(current=current):
+                expected_names = linear_search(phrases, current, popularity)
+                names = self.search(index, current, popularity=lambda name: popularity.get(name, 0))
+
+                ## Anything past the exact matches is fuzzy matched
+                self.assertEqual(names[:len(expected_names)], expected_names)
+
+
+    def test_matches_linear_search(self):
+        self.assert_matches_linear_search(self.build_index(), PHRASES)
+
+
+    def test_popular_phrases_rank_first_within_their_tier(self):
+        popularity = {"mario": 3, "imperial": 1, "rickroll": 2}
+
+        self.assert_matches_linear_search(self.build_index(), PHRASES, popularity)
+
+        ## Popularity only breaks ties within a tier, so the only name that starts with the input still comes first
+        names = self.search(self.build_index(), "r", popularity=lambda name: popularity.get(name, 0))
+        self.assertEqual(names[:3], ["rickroll", "mario", "imperial"])
+
+
+    def test_fuzzy_matches_misspellings(self):
+        index = self.build_index()
+
+        self.assertEqual(self.search(index, "btman")[0], "batman")
+        self.assertEqual(self.search(index, "qqqqq"), [])
+
+
+    def test_empty_input_suggests_most_popular(self):
+        index = self.build_index()
+
+        ## Removed phrases are skipped over, and random ones top up the rest
+        names = self.search(index, "", most_popular=lambda count: ["removed", "nyan", "zelda"][:count])
+        self.assertEqual(names[:2], ["nyan", "zelda"])
+        self.assertEqual(len(set(names)), PhraseAutocompleteIndex.EMPTY_INPUT_CHOICES)
+        self.assertTrue(set(names) <= PHRASES.keys())
+
+
+    def test_incremental_update_only_reindexes_changes(self):
+        index = self.build_index()
+
+        phrases = dict(PHRASES)
+        del phrases["ateam"]
+        phrases["mario"] = Phrase("mario", "", None, help="It's a me!")
+        phrases["marathon"] = Phrase("marathon", "", None, help="Sandstorm, but longer")
+
+        ## Only the changed and added phrases get reindexed
+        self.assertEqual(index.update(phrases), 2)
+        self.assert_matches_linear_search(index, phrases)
+        self.assertIs(index.search("mario")[0], phrases["mario"])
+
+        self.assertEqual(index.update(phrases), 0)
+
+
+    def test_large_update_rebuilds(self):
+        index = self.build_index()
+        phrases = build_phrases(*((name, "Replaced") for name in list(PHRASES)[:10]))
+
+        self.assertEqual(index.update(phrases), len(phrases))
+        self.assert_matches_linear_search(index, phrases)
+
+
+if (__name__ == "__main__"):
+    unittest.main()
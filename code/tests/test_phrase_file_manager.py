@@ -0,0 +1,123 @@
+## Tests for how phrase files are incrementally reloaded. Run them from anywhere with:
+## python -m unittest discover code/tests
+import os
+import sys
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+## Make sure that the bot's modules (and the phrases module) are importable, no matter where this is run from
+_code_path = Path(__file__).resolve().parent.parent
+for _path in [str(_code_path), str(_code_path.parent)]:
+    if (_path not in sys.path):
+        sys.path.insert(0, _path)
+
+from modules.phrases import phrase_file_manager
+from modules.phrases.models.phrase_group import PhraseGroup
+from modules.phrases.phrase_file_manager import PhraseFileManager
+
+
+class TestLoadPhraseGroups(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.directory_path = Path(self.directory.name)
+
+        self.phrase_file_manager = PhraseFileManager()
+        self.first_path = self.write_phrase_group("first", ["batman", "nyan"])
+        self.second_path = self.write_phrase_group("second", ["zelda"])
+
+
+    def write_phrase_group(self, key: str, names: list[str], message: str = "hello") -> Path:
+        path = Path.joinpath(self.directory_path, f"{key}.json")
+        path.write_text(json.dumps({
+            "name": key.title(),
+            "key": key,
+            "description": f"The {key} phrases",
+            "phrases": [{"name": name, "message": f"{name} {message}"} for name in names]
+        }))
+
+        return path
+
+
+    def load(self, paths: list[Path] = None) -> dict[str, PhraseGroup]:
+        ## Track which files actually got parsed, rather than reused
+        with mock.patch.object(
+            self.phrase_file_manager,
+            "_build_phrase_group",
+            wraps=self.phrase_file_manager._build_phrase_group
+        ) as build_phrase_group:
+            phrase_groups = self.phrase_file_manager.load_phrase_groups(paths or [self.first_path, self.second_path])
+
+        self.parsed_paths = [call.args[0] for call in build_phrase_group.call_args_list]
+        return {phrase_group.key: phrase_group for phrase_group in phrase_groups}
+
+
+    def test_loads_all_files_at_first(self):
+        phrase_groups = self.load()
+
+        self.assertEqual(sorted(self.parsed_paths), sorted([self.first_path, self.second_path]))
+        self.assertEqual(list(phrase_groups["first"].phrases), ["batman", "nyan"])
+        self.assertEqual(list(phrase_groups["second"].phrases), ["zelda"])
+
+
+    def test_reloads_changed_files_and_reuses_unchanged_ones(self):
+        phrase_groups = self.load()
+
+        self.write_phrase_group("first", ["batman", "nyan", "rickroll"])
+        reloaded_phrase_groups = self.load()
+
+        self.assertEqual(self.parsed_paths, [self.first_path])
+        self.assertEqual(list(reloaded_phrase_groups["first"].phrases), ["batman", "nyan", "rickroll"])
+        self.assertIs(reloaded_phrase_groups["second"], phrase_groups["second"])
+
+
+    def test_reuses_touched_files_with_the_same_contents(self):
+        phrase_groups = self.load()
+
+        stat = self.first_path.stat()
+        os.utime(self.first_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        reloaded_phrase_groups = self.load()
+
+        ## The file's hashed to check for changes, but it doesn't need to be parsed again
+        self.assertEqual(self.parsed_paths, [])
+        self.assertIs(reloaded_phrase_groups["first"], phrase_groups["first"])
+
+
+    def test_picks_up_changes_with_the_same_size(self):
+        self.load()
+
+        ## Same length message, so only the modification time gives it away
+        self.write_phrase_group("second", ["zelda"], message="howdy")
+        stat = self.second_path.stat()
+        os.utime(self.second_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        reloaded_phrase_groups = self.load()
+
+        self.assertEqual(self.parsed_paths, [self.second_path])
+        self.assertEqual(reloaded_phrase_groups["second"].phrases["zelda"].message, "zelda howdy")
+
+
+    def test_forgets_removed_files(self):
+        self.load()
+
+        self.first_path.unlink()
+        phrase_groups = self.load([self.second_path])
+
+        self.assertEqual(list(phrase_groups), ["second"])
+        self.assertEqual(list(self.phrase_file_manager._phrase_group_cache), [self.second_path])
+
+
+    def test_skips_invalid_files(self):
+        self.load()
+
+        self.second_path.write_text("{")
+        with self.assertLogs(phrase_file_manager.LOGGER, "WARNING"):
+            phrase_groups = self.load()
+
+        self.assertEqual(list(phrase_groups), ["first"])
+
+
+if (__name__ == "__main__"):
+    unittest.main()
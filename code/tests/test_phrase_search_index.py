@@ -0,0 +1,122 @@
+## Tests for the prebuilt index that the find command searches phrases with. Run them from anywhere with:
+## python -m unittest discover code/tests
+import sys
+import unittest
+from pathlib import Path
+
+## Make sure that the bot's modules (and the phrases module) are importable, no matter where this is run from
+_code_path = Path(__file__).resolve().parent.parent
+for _path in [str(_code_path), str(_code_path.parent)]:
+    if (_path not in sys.path):
+        sys.path.insert(0, _path)
+
+from common.string_similarity import StringSimilarity
+from modules.phrases.models.phrase import Phrase
+from modules.phrases.phrase_search_index import PhraseSearchIndex
+
+
+PHRASES = [
+    Phrase(name, "", None, description=description) for name, description in [
+        ("allstar", "somebody once told me the world was gonna roll me"),
+        ("ateam", "a team theme song"),
+        ("batman", "batman bat man theme song"),
+        ("birthday", "happy birthday to you happy birthday to you"),
+        ("careless", "careless whisper saxophone"),
+        ("chocolate", "chocolate rain some stay dry and others feel the pain"),
+        ("daisy", "daisy daisy give me your answer do"),
+        ("darude", "darude sandstorm"),
+        ("imperial", "the imperial march darth vader theme"),
+        ("jeopardy", "jeopardy think music theme song"),
+        ("mario", "super mario brothers theme song"),
+        ("nyan", "nyan cat"),
+        ("rickroll", "never gonna give you up never gonna let you down"),
+        ("skyrim", "dragonborn dragonborn by his honor is sworn"),
+        ("tetris", "tetris theme korobeiniki"),
+        ("trololo", "trololo lololo"),
+        ("zelda", "zelda lullaby"),
+        ("zeldaintro", "the legend of zelda overworld theme"),
+        ("nodescription", None)
+    ]
+]
+
+SEARCHES = [
+    "theme song",
+    "batman",
+    "bat man",
+    "happy birthday",
+    "never gonna give you up",
+    "zelda",
+    "legend of zelda",
+    "darth vader",
+    "sandstorm",
+    "sandstrom",
+    "dragonbron",
+    "rick roll",
+    "nyan cat!",
+    "Chocolate Rain",
+    "nodescription",
+    "the"
+]
+
+
+def linear_search(search: str) -> tuple[Phrase, float]:
+    '''The find command's original search, which scores every phrase'''
+
+    def calc_substring_score(message: str, description: str) -> float:
+        message_split = message.split(' ')
+        word_frequency = sum(word in description.split(' ') for word in message_split)
+
+        return word_frequency / len(message_split)
+
+    search = "".join(char for char in search.lower() if (char.isalnum() or char.isspace()))
+
+    most_similar_phrase = (None, 0)
+    for phrase in PHRASES:
+        scores = [calc_substring_score(search, phrase.name) + StringSimilarity.similarity(search, phrase.name) / 2]
+        if (phrase.description is not None):
+            scores.append(
+                calc_substring_score(search, phrase.description) +
+                StringSimilarity.similarity(search, phrase.description) / 2
+            )
+
+        distance = sum(scores) / len(scores)
+        if (distance > most_similar_phrase[1]):
+            most_similar_phrase = (phrase, distance)
+
+    return most_similar_phrase
+
+
+class TestPhraseSearchIndex(unittest.TestCase):
+    def test_matches_linear_search(self):
+        ## The shortlist is smaller than the phrase set, so not every phrase gets scored precisely
+        index = PhraseSearchIndex(PHRASES, shortlist_size=4)
+
+        for search in SEARCHES:
+            with self.subTest(search=search):
+                phrase, score = index.search(search)
+                expected_phrase, expected_score = linear_search(search)
+
+                self.assertIs(phrase, expected_phrase)
+                self.assertAlmostEqual(score, expected_score)
+
+
+    def test_empty_search_finds_nothing(self):
+        index = PhraseSearchIndex(PHRASES)
+
+        self.assertEqual(index.search(""), (None, 0))
+        self.assertEqual(index.search("?!"), (None, 0))
+        self.assertEqual(PhraseSearchIndex([]).search("batman"), (None, 0))
+
+
+    def test_ties_go_to_most_popular(self):
+        ## The names share nothing with the search, so the phrases all score the same
+        phrases = [Phrase(name, "", None, description="theme song") for name in ("aaa", "bbb", "ccc")]
+        index = PhraseSearchIndex(phrases)
+        popularity = {"aaa": 1, "bbb": 5, "ccc": 2}
+
+        self.assertEqual(len({index._score("theme song", ["theme", "song"], entry) for entry in index._entries}), 1)
+        self.assertIs(index.search("theme song", popularity.get)[0], phrases[1])
+
+
+if (__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,129 @@
+## Tests for how phrase usage is counted, decayed, and saved. Run them from anywhere with:
+## python -m unittest discover code/tests
+import sys
+import time
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+## Make sure that the bot's modules (and the phrases module) are importable, no matter where this is run from
+_code_path = Path(__file__).resolve().parent.parent
+for _path in [str(_code_path), str(_code_path.parent)]:
+    if (_path not in sys.path):
+        sys.path.insert(0, _path)
+
+from modules.phrases import phrase_usage_tracker
+from modules.phrases.phrase_usage_tracker import PhraseUsageTracker
+
+
+HOUR_SECONDS = 3600
+
+
+class TestPhraseUsageTracker(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.usage_file_path = Path.joinpath(Path(self.directory.name), "phrase_usage.json")
+
+        config_patch = mock.patch.dict(phrase_usage_tracker.CONFIG_OPTIONS, {
+            "phrases_usage_half_life_hours": 1,
+            "phrases_usage_file_path": str(self.usage_file_path)
+        })
+        config_patch.start()
+        self.addCleanup(config_patch.stop)
+
+        ## Time only moves when a test moves it
+        self.now = time.time()
+        time_patch = mock.patch.object(phrase_usage_tracker.time, "time", lambda: self.now)
+        time_patch.start()
+        self.addCleanup(time_patch.stop)
+
+
+    def test_counts_decay_by_half_life(self):
+        tracker = PhraseUsageTracker()
+        tracker.record("batman", 1)
+        tracker.record("batman", 1)
+        self.assertAlmostEqual(tracker.get_popularity("batman"), 2)
+
+        self.now += HOUR_SECONDS
+        self.assertAlmostEqual(tracker.get_popularity("batman"), 1)
+
+        ## New uses add onto the decayed count
+        tracker.record("batman")
+        self.now += HOUR_SECONDS
+        self.assertAlmostEqual(tracker.get_popularity("batman"), 1)
+
+
+    def test_recent_usage_outranks_old_usage(self):
+        tracker = PhraseUsageTracker()
+        for _ in range(3):
+            tracker.record("batman")
+
+        self.now += HOUR_SECONDS * 2
+        tracker.record("nyan")
+        tracker.record("nyan")
+
+        self.assertEqual(tracker.get_most_popular(2), ["nyan", "batman"])
+
+
+    def test_guild_popularity_includes_some_global_usage(self):
+        tracker = PhraseUsageTracker()
+        tracker.record("batman", 1)
+        tracker.record("nyan", 2)
+        tracker.record("nyan", 2)
+
+        self.assertAlmostEqual(tracker.get_popularity("batman", 1), 1 + PhraseUsageTracker.GLOBAL_POPULARITY_WEIGHT)
+        self.assertAlmostEqual(tracker.get_popularity("nyan", 1), 2 * PhraseUsageTracker.GLOBAL_POPULARITY_WEIGHT)
+        self.assertEqual(tracker.get_most_popular(5, 1), ["batman"])
+        self.assertEqual(tracker.get_most_popular(5), ["nyan", "batman"])
+
+
+    def test_counts_survive_save_and_load(self):
+        tracker = PhraseUsageTracker()
+        tracker.record("batman", 1)
+        tracker.record("batman", 1)
+        tracker.record("nyan", 2)
+
+        self.now += HOUR_SECONDS
+        tracker.save()
+
+        self.now += HOUR_SECONDS
+        loaded_tracker = PhraseUsageTracker()
+        for name, guild_id in [("batman", None), ("batman", 1), ("nyan", None), ("nyan", 2), ("nyan", 1)]:
+            with self.subTest(name=name, guild_id=guild_id):
+                self.assertAlmostEqual(loaded_tracker.get_popularity(name, guild_id), tracker.get_popularity(name, guild_id))
+
+        self.assertAlmostEqual(loaded_tracker.get_popularity("batman", 1), 0.5 + 0.5 * PhraseUsageTracker.GLOBAL_POPULARITY_WEIGHT)
+
+
+    def test_decayed_counts_arent_saved(self):
+        tracker = PhraseUsageTracker()
+        tracker.record("batman")
+        self.now += HOUR_SECONDS * 10
+        tracker.record("nyan")
+        tracker.save()
+
+        self.assertEqual(PhraseUsageTracker().get_most_popular(5), ["nyan"])
+
+
+    def test_only_saves_changes(self):
+        tracker = PhraseUsageTracker()
+        tracker.save()
+        self.assertFalse(self.usage_file_path.exists())
+
+        tracker.record("batman")
+        tracker.save()
+        self.assertTrue(self.usage_file_path.exists())
+
+
+    def test_corrupt_file_starts_over(self):
+        self.usage_file_path.write_text("{")
+
+        with self.assertLogs(phrase_usage_tracker.LOGGER, "WARNING"):
+            tracker = PhraseUsageTracker()
+        self.assertEqual(tracker.get_most_popular(5), [])
+
+
+if (__name__ == "__main__"):
+    unittest.main()
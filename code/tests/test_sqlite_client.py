@@ -0,0 +1,87 @@
+## Tests for how the SQLite client sweeps out expired items. Run them from anywhere with:
+## python -m unittest discover code/tests
+import sys
+import time
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+## Make sure that the bot's modules are importable, no matter where this is run from
+_code_path = Path(__file__).resolve().parent.parent
+if (str(_code_path) not in sys.path):
+    sys.path.insert(0, str(_code_path))
+
+from common.database.clients.sqlite import sqlite_client
+from common.database.clients.sqlite.sqlite_client import SqliteClient
+
+
+class TestSqliteClientSweep(unittest.TestCase):
+    TTL_SECONDS = 60
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.database_file_path = Path.joinpath(Path(self.directory.name), "analytics.sqlite3")
+
+
+    def build_client(self, sweep_interval_seconds: float) -> SqliteClient:
+        with mock.patch.dict(sqlite_client.CONFIG_OPTIONS, {
+            "sqlite_database_file_path": str(self.database_file_path),
+            "database_detailed_table_ttl_seconds": self.TTL_SECONDS,
+            "sqlite_ttl_sweep_interval_seconds": sweep_interval_seconds
+        }):
+            client = SqliteClient()
+
+        self.addCleanup(client.connection.close)
+        self.addCleanup(client.stop_sweeping)
+        return client
+
+
+    def insert_item(self, client: SqliteClient, query_id: str, age_seconds: float):
+        table = client._quote_identifier(client.detailed_table_name)
+        with client._lock:
+            with client.connection:
+                client.connection.execute(
+                    f"INSERT INTO {table} (query_id, user_id, created_at, data) VALUES (?, 1, ?, '{{}}')",
+                    (query_id, int((time.time() - age_seconds) * 1000))
+                )
+
+
+    def get_query_ids(self, client: SqliteClient) -> set[str]:
+        table = client._quote_identifier(client.detailed_table_name)
+        with client._lock:
+            return set(row[0] for row in client.connection.execute(f"SELECT query_id FROM {table}"))
+
+
+    def wait_for(self, condition, timeout_seconds: float = 5):
+        deadline = time.time() + timeout_seconds
+        while (not condition() and time.time() < deadline):
+            time.sleep(0.01)
+
+
+    def test_sweeps_on_start_up_without_any_stores(self):
+        client = self.build_client(3600)
+        client.stop_sweeping()
+        self.insert_item(client, "expired", self.TTL_SECONDS * 2)
+        self.insert_item(client, "fresh", 0)
+        client.connection.close()
+
+        ## A restarted bot sweeps right away, even though nothing's been stored yet
+        client = self.build_client(3600)
+        client.stop_sweeping()
+
+        self.assertEqual(self.get_query_ids(client), {"fresh"})
+
+
+    def test_sweeps_periodically(self):
+        client = self.build_client(0.05)
+        self.insert_item(client, "expired", self.TTL_SECONDS * 2)
+        self.insert_item(client, "fresh", 0)
+
+        self.wait_for(lambda: "expired" not in self.get_query_ids(client))
+        self.assertEqual(self.get_query_ids(client), {"fresh"})
+
+
+if (__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,87 @@
+## Tests for StringSimilarity's algorithms. Run them from anywhere with:
+## python -m unittest discover code/tests
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+## Make sure that the bot's modules are importable, no matter where this is run from
+_code_path = Path(__file__).resolve().parent.parent
+if (str(_code_path) not in sys.path):
+    sys.path.insert(0, str(_code_path))
+
+from common.string_similarity import StringSimilarity
+
+
+class TestDamerauLevenshtein(unittest.TestCase):
+    def similarity(self, stringA: str, stringB: str, minimum_similarity: float = 0.0) -> float:
+        return StringSimilarity._calcDamerauLevenshteinDistance(stringA, stringB, minimum_similarity)
+
+
+    def test_scores_edits(self):
+        self.assertEqual(self.similarity("hawking", "hawking"), 1.0)
+        self.assertAlmostEqual(self.similarity("abac", "aabac"), 0.8)
+        self.assertAlmostEqual(self.similarity("ab", "ba"), 0.5)
+        self.assertEqual(self.similarity("", "abc"), 0.0)
+
+
+    def test_keeps_similarity_exactly_on_minimum(self):
+        ## One edit out of five characters is exactly 0.8, even though (1 - 0.8) * 5 works out to slightly less than 1
+        self.assertAlmostEqual(self.similarity("abac", "aabac", 0.8), 0.8)
+        self.assertAlmostEqual(self.similarity("hawking", "hakwing", 1 - 1 / 7), 1 - 1 / 7)
+
+
+    def test_drops_similarity_below_minimum(self):
+        self.assertEqual(self.similarity("abac", "aabac", 0.81), 0.0)
+        self.assertEqual(self.similarity("abc", "xyz", 0.1), 0.0)
+
+
+
+class TestJaroWinkler(unittest.TestCase):
+    def similarity(self, stringA: str, stringB: str, minimum_similarity: float = 0.0) -> float:
+        return StringSimilarity._calcJaroWinkleDistance(stringA, stringB, minimum_similarity)
+
+
+    def test_scores_known_pairs(self):
+        self.assertEqual(self.similarity("MARTHA", "MARTHA"), 1.0)
+        self.assertAlmostEqual(self.similarity("MARTHA", "MARHTA"), 0.961, places=3)
+        self.assertAlmostEqual(self.similarity("DWAYNE", "DUANE"), 0.840, places=3)
+        self.assertAlmostEqual(self.similarity("DIXON", "DICKSONX"), 0.813, places=3)
+        self.assertEqual(self.similarity("abc", "xyz"), 0.0)
+        self.assertEqual(self.similarity("", "abc"), 0.0)
+
+
+    def test_common_prefix_boosts_similarity(self):
+        ## Both pairs have the same Jaro similarity (14/15), but only the first one shares a prefix. It's nine characters
+        ## long, but only the first four count, so the boost is 4 * 0.1 * (1 - 14/15).
+        self.assertAlmostEqual(self.similarity("abcdefghij", "abcdefghix"), 0.96)
+        self.assertAlmostEqual(self.similarity("abcdefghij", "xbcdefghij"), 14 / 15)
+
+        self.assertGreater(self.similarity("abcxyz", "abcxzy"), self.similarity("xyzabc", "yxzabc"))
+
+
+    def test_bails_out_below_minimum(self):
+        self.assertAlmostEqual(self.similarity("MARTHA", "MARHTA", 0.961), self.similarity("MARTHA", "MARHTA"))
+
+        ## Strings whose lengths are too different to ever reach the minimum bail out early
+        self.assertEqual(self.similarity("a", "abcdefghijklmnop", 0.9), 0.0)
+
+
+
+class TestSimilarities(unittest.TestCase):
+    def test_matches_pairwise_scores(self):
+        candidates = ["martha", "marhta", "dwayne", "duane", ""]
+        for name, similarity_function in (
+            (StringSimilarity.DIFFLIB, StringSimilarity._calcDifflibDistance),
+            (StringSimilarity.JARO_WINKLER, StringSimilarity._calcJaroWinkleDistance),
+            (StringSimilarity.DAMERAU_LEVENSHTEIN, StringSimilarity._calcDamerauLevenshteinDistance)
+        ):
+            with self.subTest(name), mock.patch.object(StringSimilarity, "_similarity_function", similarity_function):
+                self.assertEqual(
+                    StringSimilarity.similarities("martha", candidates),
+                    [similarity_function("martha", candidate) for candidate in candidates]
+                )
+
+
+if (__name__ == "__main__"):
+    unittest.main()
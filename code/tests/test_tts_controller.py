@@ -0,0 +1,60 @@
+## Tests for how TTSController splits messages into chunks for streaming. Run them from anywhere with:
+## python -m unittest discover code/tests
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+## Make sure that the bot's modules are importable, no matter where this is run from
+_code_path = Path(__file__).resolve().parent.parent
+if (str(_code_path) not in sys.path):
+    sys.path.insert(0, str(_code_path))
+
+from core.tts.tts_controller import TTSController
+
+
+class TestSplitMessage(unittest.TestCase):
+    def setUp(self):
+        ## Skip the constructor, as it prepares the TTS executable and output directories that splitting doesn't need
+        self.tts_controller = TTSController.__new__(TTSController)
+        self.tts_controller.streaming_chunk_min_chars = 1
+
+        ## The controller clears out its output directory when it's deleted, so give it somewhere harmless to clear
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.tts_controller.output_dir_path = Path(self.output_dir.name)
+        self.addCleanup(self.output_dir.cleanup)
+
+
+    def test_splits_at_sentence_boundaries(self):
+        chunks = self.tts_controller.split_message("First. Second! Pi is 3.14 [:dial 555.1234] ok")
+
+        self.assertEqual(chunks, ["First.", " Second!", " Pi is 3.14 [:dial 555.1234] ok"])
+
+
+    def test_carries_voice_state_forward(self):
+        chunks = self.tts_controller.split_message("[:np][:rate 200] First. Second.")
+
+        self.assertEqual(chunks, ["[:np][:rate 200] First.", "[:np][:rate 200] Second."])
+
+
+    def test_carries_only_latest_value_of_each_setting(self):
+        chunks = self.tts_controller.split_message("[:np][:rate 200] First. [:nh][:ra 150] Second. Third.")
+
+        self.assertEqual(chunks[2], "[:nh][:ra 150] Third.")
+
+
+    def test_keeps_design_voice_parameters_separate(self):
+        chunks = self.tts_controller.split_message("[:dv ap 120][:dv hs 110] First. [:dv ap 90] Second. Third.")
+
+        self.assertEqual(chunks[2], "[:dv hs 110][:dv ap 90] Third.")
+
+
+    def test_does_not_carry_action_commands_forward(self):
+        chunks = self.tts_controller.split_message("[:np][:dial 5551234] First. [:tone 440 500][:t 300 200] Second. Third.")
+
+        self.assertEqual(chunks[1], "[:np] [:tone 440 500][:t 300 200] Second.")
+        self.assertEqual(chunks[2], "[:np] Third.")
+
+
+if (__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,184 @@
+## Tests for how synthesis is shared between guilds by the TTS scheduler and worker pool. Run them from anywhere with:
+## python -m unittest discover code/tests
+import sys
+import asyncio
+import unittest
+from pathlib import Path
+from unittest import mock
+
+## Make sure that the bot's modules are importable, no matter where this is run from
+_code_path = Path(__file__).resolve().parent.parent
+if (str(_code_path) not in sys.path):
+    sys.path.insert(0, str(_code_path))
+
+from core.exceptions import SynthesisQueueFullException
+from core.tts import tts_scheduler, tts_worker_pool
+from core.tts.tts_scheduler import TTSScheduler
+from core.tts.tts_worker_pool import TTSJob, TTSWorkerPool
+
+
+SCHEDULER_CONFIG = {
+    "tts_scheduler_quantum_chars": 100,
+    "tts_guild_max_concurrent_jobs": 1,
+    "tts_guild_max_queued_jobs": 3,
+    "tts_background_weight": 0.25
+}
+
+
+class TestTTSScheduler(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        config_patch = mock.patch.dict(tts_scheduler.CONFIG_OPTIONS, SCHEDULER_CONFIG)
+        config_patch.start()
+        self.addCleanup(config_patch.stop)
+
+
+    def build_job(self, guild_id: int | None, length: int = 100) -> TTSJob:
+        return TTSJob("a" * length, Path("output.wav"), guild_id)
+
+
+    async def run_jobs(self, scheduler: TTSScheduler, count: int) -> list[int | None]:
+        '''Runs the next count jobs one at a time (like a single worker would), and returns their guilds in order'''
+
+        guild_ids = []
+        for _ in range(count):
+            job = await asyncio.wait_for(scheduler.get(), timeout=1)
+            guild_ids.append(job.guild_id)
+            scheduler.task_done(job)
+
+        return guild_ids
+
+
+    async def test_busy_guild_cant_starve_another(self):
+        scheduler = TTSScheduler()
+        for _ in range(3):
+            scheduler.put(self.build_job(1))
+
+        ## The second guild shows up after the first one has already filled its queue
+        scheduler.put(self.build_job(2))
+        scheduler.put(self.build_job(2))
+
+        self.assertEqual(await self.run_jobs(scheduler, 5), [1, 2, 1, 2, 1])
+
+
+    async def test_long_messages_cost_more(self):
+        scheduler = TTSScheduler()
+        for _ in range(3):
+            scheduler.put(self.build_job(1, length=300))
+            scheduler.put(self.build_job(2, length=100))
+
+        ## A 300 character message needs three rounds worth of credit, so the short messages get through more often
+        self.assertEqual(await self.run_jobs(scheduler, 6), [2, 2, 1, 2, 1, 1])
+
+
+    async def test_background_jobs_yield_to_guilds(self):
+        scheduler = TTSScheduler()
+        scheduler.put(self.build_job(None))
+        for _ in range(3):
+            scheduler.put(self.build_job(1))
+
+        self.assertEqual(await self.run_jobs(scheduler, 4), [1, 1, 1, None])
+
+
+    async def test_full_queue_raises(self):
+        scheduler = TTSScheduler()
+        for _ in range(3):
+            scheduler.put(self.build_job(1))
+
+        with self.assertRaises(SynthesisQueueFullException) as context:
+            scheduler.put(self.build_job(1))
+        self.assertEqual(context.exception.guild_id, 1)
+
+        ## Other guilds, and background work, aren't affected
+        scheduler.put(self.build_job(2))
+        for _ in range(5):
+            scheduler.put(self.build_job(None))
+
+
+    async def test_cancelled_jobs_free_up_queue(self):
+        scheduler = TTSScheduler()
+        jobs = [self.build_job(1) for _ in range(3)]
+        for job in jobs:
+            scheduler.put(job)
+
+        jobs[0].future.cancel()
+        scheduler.put(self.build_job(1))
+
+        self.assertEqual(len(scheduler.queues[1]), 3)
+
+
+    async def test_guild_concurrency_is_capped(self):
+        scheduler = TTSScheduler()
+        scheduler.put(self.build_job(1))
+        scheduler.put(self.build_job(1))
+
+        job = await scheduler.get()
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(scheduler.get(), timeout=0.05)
+
+        scheduler.task_done(job)
+        self.assertEqual((await asyncio.wait_for(scheduler.get(), timeout=1)).guild_id, 1)
+
+
+class TestTTSWorkerPool(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        for config_patch in (
+            mock.patch.dict(tts_scheduler.CONFIG_OPTIONS, SCHEDULER_CONFIG),
+            mock.patch.dict(tts_worker_pool.CONFIG_OPTIONS, {
+                "tts_worker_count": 1,
+                "tts_worker_max_jobs": 100,
+                "tts_queue_timeout_seconds": 5,
+                "audio_generate_timeout_seconds": 5
+            })
+        ):
+            config_patch.start()
+            self.addCleanup(config_patch.stop)
+
+        self.synthesized: list[str] = []
+        self.synthesis_allowed = asyncio.Event()
+
+        async def synthesize(message: str, output_file_path: Path):
+            await self.synthesis_allowed.wait()
+            self.synthesized.append(message.strip())
+
+        async def health_check() -> bool:
+            return True
+
+        self.pool = TTSWorkerPool(synthesize, health_check)
+        self.addCleanup(self.pool.stop)
+
+
+    def submit(self, guild_id: int, index: int) -> asyncio.Task:
+        ## Messages are as long as the scheduler's quantum, so that each one uses up a full round of credit
+        return asyncio.create_task(self.pool.submit(f"{guild_id}-{index}".ljust(100), Path("output.wav"), guild_id))
+
+
+    async def test_full_queue_raises_rather_than_blocks(self):
+        submissions = [self.submit(1, 0)]
+        await asyncio.sleep(0.05)
+        submissions.extend(self.submit(1, index) for index in range(1, 4))
+        await asyncio.sleep(0.05)
+
+        ## One job is synthesizing, and three are queued, so there's no room for another
+        with self.assertRaises(SynthesisQueueFullException):
+            await asyncio.wait_for(self.pool.submit("one too many", Path("output.wav"), 1), timeout=1)
+
+        self.synthesis_allowed.set()
+        await asyncio.wait_for(asyncio.gather(*submissions), timeout=1)
+        self.assertEqual(len(self.synthesized), 4)
+
+
+    async def test_guilds_take_turns(self):
+        submissions = [self.submit(1, index) for index in range(3)]
+        await asyncio.sleep(0.05)
+        submissions.extend(self.submit(2, index) for index in range(2))
+        await asyncio.sleep(0.05)
+
+        self.synthesis_allowed.set()
+        await asyncio.wait_for(asyncio.gather(*submissions), timeout=1)
+
+        ## The first job was already synthesizing by the time the second guild showed up, but they alternate after that
+        self.assertEqual(self.synthesized, ["1-0", "1-1", "2-0", "1-2", "2-1"])
+
+
+if (__name__ == "__main__"):
+    unittest.main()
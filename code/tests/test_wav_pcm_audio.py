@@ -0,0 +1,126 @@
+## Tests for how WAV files are converted into Discord's PCM format in process. Run them from anywhere with:
+## python -m unittest discover code/tests
+import sys
+import wave
+import struct
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+## Make sure that the bot's modules are importable, no matter where this is run from
+_code_path = Path(__file__).resolve().parent.parent
+if (str(_code_path) not in sys.path):
+    sys.path.insert(0, str(_code_path))
+
+from common.audio_player import WavPCMAudio
+
+
+class TestWavPCMAudio(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.file_path = Path.joinpath(Path(self.directory.name), "speech.wav")
+
+
+    def write_wav(self, data: bytes, sample_rate: int = 48000, channels: int = 2, sample_width: int = 2):
+        with wave.open(str(self.file_path), "wb") as wav_file:
+            wav_file.setnchannels(channels)
+            wav_file.setsampwidth(sample_width)
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframes(data)
+
+
+    def write_samples(self, samples: list[int], **kwargs):
+        self.write_wav(struct.pack(f"<{len(samples)}h", *samples), **kwargs)
+
+
+    def read_samples(self) -> list[int]:
+        '''Reads every frame from the file, and returns them as (interleaved stereo) samples'''
+
+        source = WavPCMAudio(self.file_path)
+        self.addCleanup(source.cleanup)
+
+        data = bytearray()
+        while (frame := source.read()):
+            self.assertEqual(len(frame), WavPCMAudio.FRAME_SIZE)
+            data += frame
+
+        return list(struct.unpack(f"<{len(data) // 2}h", data))
+
+
+    def assert_padded_equal(self, samples: list[int], expected_samples: list[int]):
+        ## The final frame gets padded out with silence
+        self.assertEqual(samples[:len(expected_samples)], expected_samples)
+        self.assertEqual(set(samples[len(expected_samples):]), {0})
+
+
+    def test_discord_format_passes_through(self):
+        samples = [(index * 37) % 65536 - 32768 for index in range(10000)]
+        self.write_samples(samples)
+
+        self.assert_padded_equal(self.read_samples(), samples)
+
+
+    def test_converts_sample_widths(self):
+        for sample_width, data, expected_samples in [
+            (1, bytes([0x00, 0x80, 0xff]), [-32768, 0, 32512]),
+            (3, bytes.fromhex("563412 000080"), [0x1234, -32768]),
+            (4, bytes.fromhex("78563412 ffffff7f"), [0x1234, 32767])
+        ]:
+            with self.subTest(sample_width=sample_width):
+                self.write_wav(data, channels=1, sample_width=sample_width)
+
+                self.assert_padded_equal(self.read_samples(), [sample for sample in expected_samples for _ in range(2)])
+
+
+    def test_upmixes_mono(self):
+        self.write_samples([1, -2, 3], channels=1)
+
+        self.assert_padded_equal(self.read_samples(), [1, 1, -2, -2, 3, 3])
+
+
+    def test_resamples_by_interpolating(self):
+        ## Half of Discord's sample rate, so every other sample is halfway between two of the source's samples
+        samples = [index * 10 for index in range(2000)]
+        self.write_samples(samples, sample_rate=24000, channels=1)
+
+        resampled = self.read_samples()[0::2]
+        self.assert_padded_equal(resampled, [index * 5 for index in range(len(samples) * 2 - 1)] + [samples[-1]])
+
+
+    def test_resampling_is_continuous_across_batches(self):
+        ## A second of stereo audio
+        samples = [(index * 7919) % 20000 - 10000 for index in range(11025 * 2)]
+        self.write_samples(samples, sample_rate=11025)
+        expected_samples = self.read_samples()
+
+        ## Convert a single source frame at a time, so that every frame lands on a batch boundary
+        with mock.patch.object(WavPCMAudio, "FRAMES_PER_BATCH", 0):
+            self.assertEqual(self.read_samples(), expected_samples)
+
+        self.assertAlmostEqual(len(expected_samples), 48000 * 2, delta=WavPCMAudio.FRAME_SIZE // 2)
+
+
+    def test_drops_partial_final_frame(self):
+        ## Like a streaming writer would leave behind, with a bogus data size and a partially written last frame
+        self.write_samples([1, 2, 3, 4])
+        data = bytearray(self.file_path.read_bytes())
+        data[40:44] = struct.pack("<I", 0xffffffff)
+        self.file_path.write_bytes(data + b"\x05")
+
+        self.assert_padded_equal(self.read_samples(), [1, 2, 3, 4])
+
+
+    def test_rejects_unsupported_files(self):
+        self.file_path.write_bytes(b"RIFF\x00\x00\x00\x00AVI LIST")
+        with self.assertRaises(ValueError):
+            WavPCMAudio(self.file_path)
+
+        self.write_wav(b"", channels=3)
+        with self.assertRaises(ValueError):
+            WavPCMAudio(self.file_path)
+
+
+if (__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,236 @@
+import heapq
+import bisect
+import random
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import Callable
+
+from common.configuration import Configuration
+from common.logging import Logging
+from common.string_similarity import StringSimilarity
+from modules.phrases.models.phrase import Phrase
+
+## Config & logging
+CONFIG_OPTIONS = Configuration.load_config(Path(__file__).parent)
+LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
+
+
+class PhraseAutocompleteIndex:
+    '''
+    Sorted index of phrase names and help text, for autocompleting phrase names as they're typed. Every suffix of each
+    name is kept in a sorted list, so names that start with (or contain) the input can be found with a binary search,
+    and the same goes for the words in each phrase's help text. When that doesn't turn up enough phrases, names that
+    share character trigrams with the input are fuzzy matched. Matches are ranked by how they matched (prefix, infix, help
+    text, then fuzzy), and then by their popularity. The index is updated incrementally, so reloading the phrases only
+    reindexes the ones that changed.
+    '''
+
+    ## Discord won't accept any more autocomplete choices than this
+    MAX_CHOICES = 25
+    EMPTY_INPUT_CHOICES = 5
+
+    ## Match tiers, in the order that they're ranked
+    PREFIX_MATCH = 0
+    INFIX_MATCH = 1
+    HELP_MATCH = 2
+
+    ## Past this fraction of phrases changing, it's faster to just rebuild the index from scratch
+    REBUILD_THRESHOLD = 0.25
+
+    def __init__(self, popularity: Callable[[str], float] = None):
+        self.popularity: Callable[[str], float] = popularity or (lambda name: 0)
+        self.fuzzy_minimum_similarity = float(CONFIG_OPTIONS.get('phrases_autocomplete_fuzzy_similarity', 0.6))
+
+        self._phrases: dict[str, Phrase] = {}
+        self._names: list[str] = []
+        self._indexed_text: dict[str, tuple[str, str]] = {}
+        self._name_suffixes: list[tuple[str, str]] = []
+        self._help_suffixes: list[tuple[str, str]] = []
+        self._trigram_index: dict[str, set[str]] = {}
+
+    ## Properties
+
+    @property
+    def size(self) -> int:
+        return len(self._phrases)
+
+    ## Methods
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.casefold().split())
+
+
+    @staticmethod
+    def _build_trigrams(text: str) -> set[str]:
+        padded_text = f" {text} "
+        return set(padded_text[index:index + 3] for index in range(len(padded_text) - 2))
+
+
+    def _build_indexed_text(self, phrase: Phrase) -> tuple[str, str]:
+        return (self.normalize(phrase.name), self.normalize(phrase.help or phrase.brief or ""))
+
+
+    def _build_entries(self, name: str) -> tuple[list[tuple[str, str]], list[tuple[str, str]]]:
+        '''Builds the name suffix entries, and help text entries (a suffix for each word) for the phrase'''
+
+        name_key, help_key = self._indexed_text[name]
+        name_suffixes = [(name_key[index:], name) for index in range(len(name_key))]
+
+        help_suffixes = []
+        if (help_key):
+            help_suffixes.append((help_key, name))
+            help_suffixes.extend((help_key[index + 1:], name) for index, char in enumerate(help_key) if char == " ")
+
+        return name_suffixes, help_suffixes
+
+
+    def _index_phrase(self, name: str, rebuilding: bool):
+        name_suffixes, help_suffixes = self._build_entries(name)
+        if (rebuilding):
+            ## The lists get sorted once everything's been added
+            self._name_suffixes.extend(name_suffixes)
+            self._help_suffixes.extend(help_suffixes)
+        else:
+            for entry in name_suffixes:
+                bisect.insort(self._name_suffixes, entry)
+            for entry in help_suffixes:
+                bisect.insort(self._help_suffixes, entry)
+
+        for trigram in self._build_trigrams(self._indexed_text[name][0]):
+            self._trigram_index.setdefault(trigram, set()).add(name)
+
+
+    def _unindex_phrase(self, name: str):
+        name_suffixes, help_suffixes = self._build_entries(name)
+        for entries, removed_entries in ((self._name_suffixes, name_suffixes), (self._help_suffixes, help_suffixes)):
+            for entry in removed_entries:
+                index = bisect.bisect_left(entries, entry)
+                if (index < len(entries) and entries[index] == entry):
+                    del entries[index]
+
+        for trigram in self._build_trigrams(self._indexed_text[name][0]):
+            names = self._trigram_index.get(trigram)
+            if (names is not None):
+                names.discard(name)
+                if (not names):
+                    del self._trigram_index[trigram]
+
+        del self._indexed_text[name]
+
+
+    def update(self, phrases: dict[str, Phrase]) -> int:
+        '''Updates the index to match the given phrases, and returns how many of them needed to be (re)indexed'''
+
+        indexed_text = {name: self._build_indexed_text(phrase) for name, phrase in phrases.items()}
+        removed_names = [name for name, text in self._indexed_text.items() if indexed_text.get(name) != text]
+        added_names = [name for name, text in indexed_text.items() if self._indexed_text.get(name) != text]
+
+        rebuilding = (len(removed_names) + len(added_names) > len(indexed_text) * self.REBUILD_THRESHOLD)
+        if (rebuilding):
+            self._indexed_text = {}
+            self._name_suffixes = []
+            self._help_suffixes = []
+            self._trigram_index = {}
+            added_names = list(indexed_text)
+        else:
+            for name in removed_names:
+                self._unindex_phrase(name)
+
+        for name in added_names:
+            self._indexed_text[name] = indexed_text[name]
+            self._index_phrase(name, rebuilding)
+
+        if (rebuilding):
+            self._name_suffixes.sort()
+            self._help_suffixes.sort()
+
+        ## Unchanged phrases still need to point to the latest Phrase objects
+        self._phrases = dict(phrases)
+        self._names = list(phrases)
+
+        LOGGER.debug(f"{'Rebuilt' if rebuilding else 'Updated'} autocomplete index, reindexed {len(added_names)} phrases")
+        return len(added_names)
+
+
+    @staticmethod
+    def _find_prefixed(entries: list[tuple[str, str]], prefix: str):
+        '''Yields the entries whose key starts with the prefix'''
+
+        index = bisect.bisect_left(entries, (prefix,))
+        while (index < len(entries) and entries[index][0].startswith(prefix)):
+            yield entries[index]
+            index += 1
+
+
+    def _find_fuzzy_matches(self, key: str, exclude: dict[str, int], popularity: Callable[[str], float]) -> list[str]:
+        '''Finds the names that are similar to the key, most similar first'''
+
+        trigram_hits = Counter()
+        for trigram in self._build_trigrams(key):
+            trigram_hits.update(self._trigram_index.get(trigram, ()))
+
+        candidates = [name for name, _ in trigram_hits.most_common(self.MAX_CHOICES * 4) if name not in exclude]
+        scores = StringSimilarity.similarities(
+            key,
+            [self._indexed_text[name][0] for name in candidates],
+            self.fuzzy_minimum_similarity
+        )
+
+        matches = [(score, name) for score, name in zip(scores, candidates) if score >= self.fuzzy_minimum_similarity]
+        matches.sort(key=lambda match: (-match[0], -popularity(match[1]), match[1]))
+
+        return [name for _, name in matches]
+
+
+    def _get_empty_input_choices(self, most_popular: Callable[[int], list[str]] = None) -> list[str]:
+        '''Gets the most popular phrases' names, topped up with random ones if there aren't enough popular phrases'''
+
+        choice_count = min(self.EMPTY_INPUT_CHOICES, len(self._names))
+
+        ## Popular phrases might've been removed since they were used, so skip over those
+        names = []
+        if (most_popular is not None):
+            names = [name for name in most_popular(choice_count) if name in self._phrases][:choice_count]
+
+        if (len(names) < choice_count):
+            popular_names = set(names)
+            names.extend(random.sample(
+                [name for name in self._names if name not in popular_names],
+                choice_count - len(names)
+            ))
+
+        return names
+
+
+    def search(
+            self,
+            current: str,
+            popularity: Callable[[str], float] = None,
+            most_popular: Callable[[int], list[str]] = None
+    ) -> list[Phrase]:
+        '''
+        Finds the (at most MAX_CHOICES) phrases that best match the current input. If it's empty, then the most_popular
+        function's phrases are suggested (most popular first), falling back to random ones when there aren't enough of
+        them. The popularity function overrides the index's own, for this search only.
+        '''
+
+        popularity = popularity or self.popularity
+
+        key = self.normalize(current)
+        if (not key):
+            return [self._phrases[name] for name in self._get_empty_input_choices(most_popular)]
+
+        tiers: dict[str, int] = {}
+        for suffix, name in self._find_prefixed(self._name_suffixes, key):
+            tier = self.PREFIX_MATCH if (suffix == self._indexed_text[name][0]) else self.INFIX_MATCH
+            tiers[name] = min(tier, tiers.get(name, tier))
+        for _, name in self._find_prefixed(self._help_suffixes, key):
+            tiers.setdefault(name, self.HELP_MATCH)
+
+        names = heapq.nsmallest(self.MAX_CHOICES, tiers, key=lambda name: (tiers[name], -popularity(name), name))
+        if (len(names) < self.MAX_CHOICES):
+            names.extend(self._find_fuzzy_matches(key, tiers, popularity)[:self.MAX_CHOICES - len(names)])
+
+        return [self._phrases[name] for name in names]
@@ -1,7 +1,9 @@
 import json
+import hashlib
 import logging
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List
 
@@ -21,6 +23,10 @@ class PhraseFileManager:
     def __init__(self):
         self.phrases_file_extension = CONFIG_OPTIONS.get('phrases_file_extension', '.json')
         self.non_letter_regex = re.compile('\W+')   # Compile a regex for filtering non-letter characters
+        self.load_max_workers = max(int(CONFIG_OPTIONS.get('phrases_load_max_workers', 4)), 1)
+
+        ## Previously loaded (and decoded) phrase groups, along with the stat signature and hash of the file they came from
+        self._phrase_group_cache: dict[Path, tuple[tuple[int, int], str, PhraseGroup]] = {}
 
         phrases_folder_path = CONFIG_OPTIONS.get('phrases_folder_path')
         if (phrases_folder_path):
@@ -119,41 +125,107 @@ class PhraseFileManager:
         with open(path) as fd:
             data = json.load(fd)
 
-            try:
-                phrase_group_name = None
-                phrase_group_key = None
-                phrase_group_description = None
-                kwargs = {}
+        return self._build_phrase_group(path, data, decode)
+
+
+    def _build_phrase_group(self, path: Path, data: dict, decode = True) -> PhraseGroup:
+        '''Builds a PhraseGroup from the raw JSON loaded from the given path'''
+
+        try:
+            phrase_group_name = None
+            phrase_group_key = None
+            phrase_group_description = None
+            kwargs = {}
+
+            ## Loop over the key-values in the json file. Handle each expected pair appropriately, and store
+            ## unexpected pairs in the kwargs variable. Unexpected data is fine, but it needs to be preserved so
+            ## that re-saved files will be equivalent to the original file.
+            for key, value in data.items():
+                if (key == 'name'):
+                    phrase_group_name = value
+                elif (key == 'key'):
+                    phrase_group_key = value
+                elif  (key == 'description'):
+                    phrase_group_description = value
+                elif (key == 'phrases'):
+                    phrases = self._build_phrases(value, decode)
+                else:
+                    kwargs[key] = value
 
-                ## Loop over the key-values in the json file. Handle each expected pair appropriately, and store
-                ## unexpected pairs in the kwargs variable. Unexpected data is fine, but it needs to be preserved so
-                ## that re-saved files will be equivalent to the original file.
-                for key, value in data.items():
-                    if (key == 'name'):
-                        phrase_group_name = value
-                    elif (key == 'key'):
-                        phrase_group_key = value
-                    elif  (key == 'description'):
-                        phrase_group_description = value
-                    elif (key == 'phrases'):
-                        phrases = self._build_phrases(value, decode)
-                    else:
-                        kwargs[key] = value
-
-                ## With the loose pieces processed, make sure the required pieces exist.
-                if (phrase_group_name == None or phrase_group_key == None or phrase_group_description == None or len(phrases) == 0):
-                    LOGGER.warning(f"Error loading phrase group '{phrase_group_name}', from '{path}'. Missing 'name', 'key', 'description', or non-zero length 'phrases' list. Skipping...")
-                    return None
-
-                ## Construct the PhraseGroup, and add the Phrases to it.
-                phrase_group = PhraseGroup(phrase_group_name, phrase_group_key, phrase_group_description, path, **kwargs)
-                phrase_group.add_all_phrases(phrases)
-
-                return phrase_group
-            except Exception as e:
-                LOGGER.warning(f"Error loading phrase group '{phrase_group_name}' from '{path}''. Skipping...", exc_info=e)
+            ## With the loose pieces processed, make sure the required pieces exist.
+            if (phrase_group_name == None or phrase_group_key == None or phrase_group_description == None or len(phrases) == 0):
+                LOGGER.warning(f"Error loading phrase group '{phrase_group_name}', from '{path}'. Missing 'name', 'key', 'description', or non-zero length 'phrases' list. Skipping...")
                 return None
 
+            ## Construct the PhraseGroup, and add the Phrases to it.
+            phrase_group = PhraseGroup(phrase_group_name, phrase_group_key, phrase_group_description, path, **kwargs)
+            phrase_group.add_all_phrases(phrases)
+
+            return phrase_group
+        except Exception as e:
+            LOGGER.warning(f"Error loading phrase group '{phrase_group_name}' from '{path}''. Skipping...", exc_info=e)
+            return None
+
+
+    def _load_changed_phrase_group(self, path: Path) -> tuple[str, PhraseGroup]:
+        '''Loads the PhraseGroup from a file that might've changed, and returns it along with the hash of the file'''
+
+        with open(path, 'rb') as fd:
+            contents = fd.read()
+        content_hash = hashlib.blake2b(contents, digest_size=16).hexdigest()
+
+        ## The file may have just been touched, or copied over with the same contents, so there's nothing to reparse
+        cached = self._phrase_group_cache.get(path)
+        if (cached is not None and cached[1] == content_hash):
+            return content_hash, cached[2]
+
+        return content_hash, self._build_phrase_group(path, json.loads(contents))
+
+
+    def load_phrase_groups(self, paths: List[Path]) -> List[PhraseGroup]:
+        '''
+        Loads the (decoded) PhraseGroups from the given phrase file json paths, reusing the PhraseGroups that were
+        previously loaded from any files that haven't changed since. Files are unchanged if their modification time and
+        size are the same, or failing that, if their contents hash the same. Changed files are loaded in a thread pool.
+        '''
+
+        phrase_groups: dict[Path, PhraseGroup] = {}
+        changed_paths: dict[Path, tuple[int, int]] = {}
+        for path in paths:
+            try:
+                stat = path.stat()
+            except OSError as e:
+                LOGGER.warning(f"Unable to access phrase file '{path}'. Skipping...", exc_info=e)
+                continue
+
+            signature = (stat.st_mtime_ns, stat.st_size)
+            cached = self._phrase_group_cache.get(path)
+            if (cached is not None and cached[0] == signature):
+                phrase_groups[path] = cached[2]
+            else:
+                changed_paths[path] = signature
+
+        if (changed_paths):
+            with ThreadPoolExecutor(max_workers=min(self.load_max_workers, len(changed_paths))) as executor:
+                futures = {path: executor.submit(self._load_changed_phrase_group, path) for path in changed_paths}
+
+            for path, future in futures.items():
+                try:
+                    content_hash, phrase_group = future.result()
+                except Exception as e:
+                    LOGGER.warning(f"Error loading phrase group from '{path}'. Skipping...", exc_info=e)
+                    continue
+
+                self._phrase_group_cache[path] = (changed_paths[path], content_hash, phrase_group)
+                phrase_groups[path] = phrase_group
+
+        ## Forget about any files that have since been removed
+        for path in self._phrase_group_cache.keys() - set(paths):
+            del self._phrase_group_cache[path]
+
+        LOGGER.debug(f"Loaded {len(changed_paths)} changed phrase files, reused {len(phrase_groups) - len(changed_paths)}")
+        return [phrase_groups[path] for path in paths if phrase_groups.get(path) is not None]
+
 
     def save_phrase_group(self, path: Path, phrase_group: PhraseGroup):
         '''Saves the given PhraseGroup as a JSON object at the given path.'''
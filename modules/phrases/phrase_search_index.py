@@ -0,0 +1,160 @@
+import heapq
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Iterable
+
+from common.configuration import Configuration
+from common.logging import Logging
+from common.string_similarity import StringSimilarity
+from modules.phrases.models.phrase import Phrase
+
+## Config & logging
+CONFIG_OPTIONS = Configuration.load_config(Path(__file__).parent)
+LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
+
+
+class PhraseSearchEntry:
+    '''A phrase, along with everything about it that gets reused between searches'''
+
+    __slots__ = ("phrase", "name_words", "description_words", "field_count", "trigram_count")
+
+    def __init__(self, phrase: Phrase, trigram_count: int):
+        self.phrase = phrase
+        self.name_words = set(phrase.name.split(' '))
+        self.description_words = set(phrase.description.split(' ')) if phrase.description is not None else None
+        self.field_count = 1 if self.description_words is None else 2
+        self.trigram_count = trigram_count
+
+
+class PhraseSearchIndex:
+    '''
+    Prebuilt index for finding the phrase that's most similar to a search. Rather than scoring every phrase, candidates
+    are pulled from an inverted index of the words in each phrase's name and description, and from an index of their
+    character trigrams (which catches misspellings and partial words). The candidates are ranked by a cheap estimate of
+    their score, and only the best few get scored precisely.
+    '''
+
+    def __init__(self, phrases: Iterable[Phrase], shortlist_size: int = None):
+        if (shortlist_size is None):
+            shortlist_size = int(CONFIG_OPTIONS.get('find_command_shortlist_size', 16))
+        self.shortlist_size = max(shortlist_size, 1)
+
+        self._entries: list[PhraseSearchEntry] = []
+        self._word_index: dict[str, list[int]] = {}
+        self._trigram_index: dict[str, list[int]] = {}
+
+        for index, phrase in enumerate(phrases):
+            ## Words are indexed once per field that they're in, just like they're scored
+            for field in (phrase.name, phrase.description or ""):
+                for word in set(self.normalize(field).split()):
+                    self._word_index.setdefault(word, []).append(index)
+
+            trigrams = self._build_trigrams(self.normalize(f"{phrase.name} {phrase.description or ''}"))
+            for trigram in trigrams:
+                self._trigram_index.setdefault(trigram, []).append(index)
+
+            self._entries.append(PhraseSearchEntry(phrase, len(trigrams)))
+
+    ## Properties
+
+    @property
+    def size(self) -> int:
+        return len(self._entries)
+
+    ## Methods
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        '''Lowercases the text, and strips out all non alphanumeric and non whitespace characters'''
+
+        return "".join(char for char in text.lower() if (char.isalnum() or char.isspace()))
+
+
+    @staticmethod
+    def _build_trigrams(text: str) -> set[str]:
+        ## Pad the words, so that their starts and ends (and words shorter than three characters) get trigrams too
+        trigrams = set()
+        for word in text.split():
+            padded_word = f" {word} "
+            trigrams.update(padded_word[index:index + 3] for index in range(len(padded_word) - 2))
+
+        return trigrams
+
+
+    @staticmethod
+    def _calc_substring_score(search_words: list[str], words: set[str]) -> float:
+        '''Scores the search based on how many of its words exist in another string's words'''
+
+        ## Todo: shrink instances of repeated letters down to a single letter in both message and description
+        ##       (ex. yeeeee => ye or reeeeeboot => rebot)
+
+        return sum(word in words for word in search_words) / len(search_words)
+
+
+    def _score(self, search: str, search_words: list[str], entry: PhraseSearchEntry) -> float:
+        phrase = entry.phrase
+        scores = [
+            self._calc_substring_score(search_words, entry.name_words) +
+            StringSimilarity.similarity(search, phrase.name) / 2
+        ]
+        if (entry.description_words is not None):
+            scores.append(
+                self._calc_substring_score(search_words, entry.description_words) +
+                StringSimilarity.similarity(search, phrase.description) / 2
+            )
+
+        return sum(scores) / len(scores)
+
+
+    def _get_shortlist(self, search: str) -> list[int]:
+        '''Gets the indexes of the phrases that share the most words and trigrams with the search'''
+
+        search_words = Counter(search.split())
+        word_hits = Counter()
+        for word, count in search_words.items():
+            for index in self._word_index.get(word, ()):
+                word_hits[index] += count
+
+        search_trigrams = self._build_trigrams(search)
+        trigram_hits = Counter()
+        for trigram in search_trigrams:
+            trigram_hits.update(self._trigram_index.get(trigram, ()))
+
+        word_count = search_words.total()
+
+        def rank(index: int) -> float:
+            ## Mirrors the precise score, with the trigram overlap (dice coefficient) standing in for the similarity
+            entry = self._entries[index]
+            trigram_overlap = 2 * trigram_hits[index] / (len(search_trigrams) + entry.trigram_count)
+
+            return word_hits[index] / word_count / entry.field_count + trigram_overlap / 2
+
+        return heapq.nlargest(self.shortlist_size, word_hits.keys() | trigram_hits.keys(), key=rank)
+
+
+    def search(self, search: str, popularity: Callable[[str], float] = None) -> tuple[Phrase, float]:
+        '''
+        Finds the phrase that's most similar to the search, and returns it with its score (or None, 0 if nothing). Ties
+        go to the most popular phrase, if there's a popularity function.
+        '''
+
+        search = self.normalize(search)
+        if (not search.strip()):
+            return (None, 0)
+
+        search_words = search.split(' ')
+        most_similar_phrase = (None, 0)
+        most_similar_popularity = 0
+        for index in self._get_shortlist(search):
+            phrase = self._entries[index].phrase
+            score = self._score(search, search_words, self._entries[index])
+            if (score < most_similar_phrase[1]):
+                continue
+
+            phrase_popularity = popularity(phrase.name) if popularity is not None else 0
+            if (score > most_similar_phrase[1] or phrase_popularity > most_similar_popularity):
+                most_similar_phrase = (phrase, score)
+                most_similar_popularity = phrase_popularity
+
+        return most_similar_phrase
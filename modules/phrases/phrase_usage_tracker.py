@@ -0,0 +1,180 @@
+import time
+import json
+import heapq
+import asyncio
+import logging
+from pathlib import Path
+
+from common import utilities
+from common.configuration import Configuration
+from common.logging import Logging
+
+## Config & logging
+CONFIG_OPTIONS = Configuration.load_config(Path(__file__).parent)
+LOGGER = Logging.initialize_logging(logging.getLogger(__name__))
+
+
+class PhraseUsageTracker:
+    '''
+    Keeps track of how often each phrase gets used, both globally and per guild. Counts decay exponentially over time,
+    so recent usage counts for more than old usage. Counts are only ever updated from the event loop, so there's no need
+    for any locking, and they're periodically saved to disk in the background, so they survive restarts.
+    '''
+
+    ## How much global usage counts towards a phrase's popularity in a guild, relative to the guild's own usage
+    GLOBAL_POPULARITY_WEIGHT = 0.25
+
+    ## Counts that have decayed below this aren't worth saving
+    MINIMUM_SAVED_COUNT = 0.01
+
+    def __init__(self):
+        self.half_life_seconds = max(float(CONFIG_OPTIONS.get('phrases_usage_half_life_hours', 168)) * 3600, 1)
+        self.save_interval_seconds = max(float(CONFIG_OPTIONS.get('phrases_usage_save_interval_seconds', 300)), 1)
+
+        usage_file_path = CONFIG_OPTIONS.get('phrases_usage_file_path')
+        if (usage_file_path):
+            self.usage_file_path = Path(usage_file_path)
+        else:
+            self.usage_file_path = Path.joinpath(utilities.get_root_path(), CONFIG_OPTIONS.get('phrases_usage_file', 'phrase_usage.json'))
+
+        ## Counts are stored as [count, timestamp of the last update], and decayed whenever they're read or updated
+        self._global_counts: dict[str, list[float]] = {}
+        self._guild_counts: dict[int, dict[str, list[float]]] = {}
+        self._dirty = False
+        self._save_task: asyncio.Task = None
+
+        self._load()
+
+    ## Methods
+
+    def _decay(self, count: float, timestamp: float, now: float) -> float:
+        return count * 0.5 ** (max(now - timestamp, 0) / self.half_life_seconds)
+
+
+    def _increment(self, counts: dict[str, list[float]], name: str, now: float):
+        entry = counts.get(name)
+        if (entry is None):
+            counts[name] = [1.0, now]
+        else:
+            entry[0] = self._decay(entry[0], entry[1], now) + 1
+            entry[1] = now
+
+
+    def _get_count(self, counts: dict[str, list[float]], name: str, now: float) -> float:
+        entry = counts.get(name)
+        if (entry is None):
+            return 0.0
+
+        return self._decay(entry[0], entry[1], now)
+
+
+    def record(self, name: str, guild_id: int = None):
+        '''Records a use of the phrase'''
+
+        now = time.time()
+        self._increment(self._global_counts, name, now)
+        if (guild_id is not None):
+            self._increment(self._guild_counts.setdefault(guild_id, {}), name, now)
+
+        self._dirty = True
+
+
+    def get_popularity(self, name: str, guild_id: int = None) -> float:
+        '''
+        Gets the phrase's popularity, which is its decayed usage count in the guild, plus a fraction of its decayed
+        global usage count (so guilds that haven't used a phrase much yet still get a sense of what's popular).
+        '''
+
+        now = time.time()
+        popularity = self._get_count(self._global_counts, name, now)
+        if (guild_id is not None):
+            popularity = self._get_count(self._guild_counts.get(guild_id, {}), name, now) + popularity * self.GLOBAL_POPULARITY_WEIGHT
+
+        return popularity
+
+
+    def get_most_popular(self, count: int, guild_id: int = None) -> list[str]:
+        '''Gets the names of the most popular phrases, most popular first'''
+
+        counts = self._global_counts if guild_id is None else self._guild_counts.get(guild_id, {})
+
+        return heapq.nlargest(count, counts, key=lambda name: self.get_popularity(name, guild_id))
+
+
+    def _to_json(self) -> dict:
+        now = time.time()
+
+        def build_counts_json(counts: dict[str, list[float]]) -> dict:
+            ## Store the counts decayed up to now, and drop any that have decayed away to nothing
+            decayed_counts = {name: self._get_count(counts, name, now) for name in counts}
+            return {name: [count, now] for name, count in decayed_counts.items() if count >= self.MINIMUM_SAVED_COUNT}
+
+        return {
+            "global": build_counts_json(self._global_counts),
+            "guilds": {str(guild_id): build_counts_json(counts) for guild_id, counts in self._guild_counts.items()}
+        }
+
+
+    def _load(self):
+        if (not self.usage_file_path.is_file()):
+            return
+
+        try:
+            data = utilities.load_json(self.usage_file_path)
+        except (json.decoder.JSONDecodeError, OSError) as e:
+            LOGGER.warning(f"Unable to load phrase usage from {self.usage_file_path}, starting over", exc_info=e)
+            return
+
+        self._global_counts = {name: list(entry) for name, entry in data.get("global", {}).items()}
+        self._guild_counts = {
+            int(guild_id): {name: list(entry) for name, entry in counts.items()}
+            for guild_id, counts in data.get("guilds", {}).items()
+        }
+        LOGGER.info(f"Loaded usage for {len(self._global_counts)} phrases from {self.usage_file_path}")
+
+
+    def save(self):
+        '''Saves the usage counts to disk, if they've changed since they were last saved'''
+
+        if (not self._dirty):
+            return
+
+        self._dirty = False
+        try:
+            utilities.save_json(self.usage_file_path, self._to_json())
+        except Exception as e:
+            self._dirty = True
+            LOGGER.exception(f"Unable to save phrase usage to {self.usage_file_path}", exc_info=e)
+
+
+    async def _save_periodically(self):
+        while (True):
+            await asyncio.sleep(self.save_interval_seconds)
+            if (not self._dirty):
+                continue
+
+            ## Snapshot the counts on the event loop, so the write itself can happen off of it
+            self._dirty = False
+            data = self._to_json()
+            try:
+                await asyncio.to_thread(utilities.save_json, self.usage_file_path, data)
+            except Exception as e:
+                self._dirty = True
+                LOGGER.exception(f"Unable to save phrase usage to {self.usage_file_path}", exc_info=e)
+
+
+    def start(self):
+        '''Starts periodically saving the usage counts. This needs to happen inside the bot's event loop.'''
+
+        if (self._save_task is None or self._save_task.done()):
+            self._save_task = asyncio.create_task(self._save_periodically())
+
+
+    def stop(self):
+        '''Stops periodically saving the usage counts, and saves any that haven't been saved yet'''
+
+        if (self._save_task is not None):
+            self._save_task.cancel()
+            self._save_task = None
+
+        self.save()
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import random
 from pathlib import Path
@@ -9,16 +10,19 @@ from common.command_management.command_reconstructor import CommandReconstructor
 from common.configuration import Configuration
 from common.database.database_manager import DatabaseManager
 from common.logging import Logging
-from common.string_similarity import StringSimilarity
 from common.module.discoverable_module import DiscoverableCog
 from common.module.module_initialization_container import ModuleInitializationContainer
 from modules.phrases.phrase_file_manager import PhraseFileManager
+from modules.phrases.phrase_search_index import PhraseSearchIndex
+from modules.phrases.phrase_autocomplete_index import PhraseAutocompleteIndex
+from modules.phrases.phrase_usage_tracker import PhraseUsageTracker
 from modules.phrases.models.phrase_group import PhraseGroup
 from modules.phrases.models.phrase import Phrase
 
 import discord
 from discord import Interaction
 from discord.app_commands import autocomplete, Choice, describe
+from discord.ext import commands
 from discord.ext.commands import Context, Bot
 
 ## Config & logging
@@ -52,9 +56,31 @@ class Phrases(DiscoverableCog):
 
         self.phrases: dict[str, Phrase] = {}
         self.phrase_groups: dict[str, PhraseGroup] = {}
+        self.phrase_search_index = PhraseSearchIndex([])
+        self.phrase_autocomplete_index = PhraseAutocompleteIndex()
+        self.phrase_usage_tracker = PhraseUsageTracker()
+        self.random_popularity_bias = max(float(CONFIG_OPTIONS.get('phrases_random_popularity_bias', 0.5)), 0)
         self.find_command_minimum_similarity = float(CONFIG_OPTIONS.get('find_command_minimum_similarity', 0.5))
         self.phrases_folder_path = self.phrase_file_manager.phrases_folder_path
 
+        ## Prerendering config
+        self.prerender_enabled = CONFIG_OPTIONS.get('phrases_prerender_enable', False)
+        self.prerender_concurrency = max(int(CONFIG_OPTIONS.get('phrases_prerender_concurrency', 2)), 1)
+        self.prerendered_phrase_file_paths: dict[str, Path] = {}
+        self._prerender_task: asyncio.Task = None
+
+        ## Speculative rendering config
+        self.speculative_render_enabled = CONFIG_OPTIONS.get('phrases_speculate_enable', False)
+        self.speculative_render_candidates = max(int(CONFIG_OPTIONS.get('phrases_speculate_candidates', 3)), 1)
+        self.speculative_render_delay_seconds = float(CONFIG_OPTIONS.get('phrases_speculate_delay_seconds', 0.5))
+        self.speculative_render_semaphore = asyncio.Semaphore(
+            max(int(CONFIG_OPTIONS.get('phrases_speculate_concurrency', 2)), 1)
+        )
+        self._speculative_render_tasks: dict[int, asyncio.Task] = {}
+
+        ## Created lazily, as it has to be created inside the bot's event loop
+        self._reload_lock: asyncio.Lock = None
+
         ## Load and add the phrases
         self.init_phrases()
         self.add_phrase_commands()
@@ -68,7 +94,7 @@ class Phrases(DiscoverableCog):
 
             await self.database_manager.store(ctx)
 
-            count = self.reload_phrases()
+            count = await self.reload_phrases()
 
             loaded_clips_string = "Loaded {} phrase{}.".format(count, "s" if count != 1 else "")
             await ctx.reply(loaded_clips_string)
@@ -80,27 +106,168 @@ class Phrases(DiscoverableCog):
     def cog_unload(self):
         """Removes all existing phrases when the cog is unloaded"""
 
+        if (self._prerender_task is not None):
+            self._prerender_task.cancel()
+
+        for task in self._speculative_render_tasks.values():
+            task.cancel()
+
+        self.phrase_usage_tracker.stop()
         self.remove_phrases()
         self.remove_phrase_commands()
 
 
-    def reload_phrases(self):
-        """Unloads all phrase commands from the bot, then reloads all of the phrases, and reapplies them to the bot"""
+    @commands.Cog.listener()
+    async def on_ready(self):
+        self.phrase_usage_tracker.start()
 
-        self.remove_phrases()
-        self.remove_phrase_commands()
+        ## Prerendering needs to happen in the bot's event loop, so it can't be kicked off during initialization. Also
+        ## on_ready can be dispatched multiple times (ex. after reconnecting), so make sure it only happens once.
+        if (self.prerender_enabled and self._prerender_task is None):
+            self.start_prerendering_phrases()
 
-        loaded_phrases = self.init_phrases()
-        self.add_phrase_commands()
+
+    async def reload_phrases(self) -> int:
+        """
+        Reloads all of the phrases off of the event loop (only reparsing the phrase files that have changed), and then
+        swaps them and the phrase commands in all at once, so the phrases are never briefly empty or half loaded.
+        """
+
+        if (self._reload_lock is None):
+            self._reload_lock = asyncio.Lock()
+
+        async with self._reload_lock:
+            phrases, phrase_groups, phrase_search_index = await asyncio.to_thread(self.load_phrases)
+
+            self.remove_phrase_commands()
+            loaded_phrases = self.apply_phrases(phrases, phrase_groups, phrase_search_index)
+            self.add_phrase_commands()
+
+        ## Prerender any new or changed phrases
+        if (self.prerender_enabled):
+            self.start_prerendering_phrases()
 
         return loaded_phrases
 
 
+    def start_prerendering_phrases(self):
+        """Starts prerendering the phrases in the background, replacing any prerendering that's already in progress"""
+
+        if (self._prerender_task is not None and not self._prerender_task.done()):
+            self._prerender_task.cancel()
+
+        self._prerender_task = asyncio.create_task(self.prerender_phrases())
+
+
+    async def prerender_phrases(self):
+        """
+        Renders the audio for every phrase ahead of time, and pins it in the audio cache so that playing a phrase is
+        just a file lookup. Phrases that have already been rendered (even in a previous run) are cache hits, so this is
+        cheap to resume. Audio for phrases that have since changed or been removed is unpinned once the pass completes.
+        """
+
+        if (self.speech_cog.tts_controller.audio_cache is None):
+            LOGGER.warning("Unable to prerender phrases, as the audio cache is disabled.")
+            return
+
+        semaphore = asyncio.Semaphore(self.prerender_concurrency)
+        prerendered_phrase_file_paths: dict[str, Path] = {}
+
+        async def prerender_phrase(phrase: Phrase):
+            async with semaphore:
+                try:
+                    file_path = await self.speech_cog.build_audio_file(phrase.message, ignore_char_limit=True, pin=True)
+                except Exception as e:
+                    LOGGER.warning(f"Unable to prerender phrase '{phrase.name}'. Skipping...", exc_info=e)
+                    return
+
+                ## The pin will keep the file around, so there's no need to hold onto this reference
+                self.speech_cog.tts_controller.delete(file_path)
+                prerendered_phrase_file_paths[phrase.name] = file_path
+
+
+        ## Render the most popular phrases first, since they're the most likely to be played while this is running
+        phrases = sorted(
+            self.phrases.values(),
+            key=lambda phrase: self.phrase_usage_tracker.get_popularity(phrase.name),
+            reverse=True
+        )
+
+        LOGGER.info(f"Prerendering {len(self.phrases)} phrase{'s' if len(self.phrases) != 1 else ''}")
+        try:
+            await asyncio.gather(*[prerender_phrase(phrase) for phrase in phrases])
+        except asyncio.CancelledError:
+            ## Hold onto whatever was pinned before being cancelled, so the next pass can unpin it if necessary
+            self.prerendered_phrase_file_paths |= prerendered_phrase_file_paths
+            raise
+
+        ## Unpin anything that's been invalidated since the previous pass
+        current_file_paths = set(prerendered_phrase_file_paths.values())
+        for file_path in self.prerendered_phrase_file_paths.values():
+            if (file_path not in current_file_paths):
+                self.speech_cog.tts_controller.unpin(file_path)
+
+        self.prerendered_phrase_file_paths = prerendered_phrase_file_paths
+        LOGGER.info(f"Prerendered {len(prerendered_phrase_file_paths)} of {len(self.phrases)} phrases")
+
+
+    def start_speculatively_rendering_phrases(self, interaction: Interaction, phrases: list[Phrase]):
+        """
+        Starts rendering the audio for the phrases that the user is likely to pick, so that it's already in the audio
+        cache once they do. Any speculation that's still in progress for the user is cancelled, as their input changed.
+        """
+
+        user_id = interaction.user.id
+        if ((task := self._speculative_render_tasks.pop(user_id, None)) is not None):
+            task.cancel()
+
+        if (not phrases or self.speech_cog.tts_controller.audio_cache is None):
+            return
+
+        task = asyncio.create_task(self.speculatively_render_phrases(interaction, phrases))
+        self._speculative_render_tasks[user_id] = task
+
+        def on_done(_):
+            if (self._speculative_render_tasks.get(user_id) is task):
+                del self._speculative_render_tasks[user_id]
+        task.add_done_callback(on_done)
+
+
+    async def speculatively_render_phrases(self, interaction: Interaction, phrases: list[Phrase]):
+        """
+        Renders the audio for the phrases (most likely first) into the audio cache. Rendering is delayed until the user
+        has paused typing, and limited in how many renders can happen at once. Speculative renders are scheduled as
+        background work, so they'll never get in the way of anybody's actual requests.
+        """
+
+        await asyncio.sleep(self.speculative_render_delay_seconds)
+
+        for phrase in phrases:
+            async with self.speculative_render_semaphore:
+                try:
+                    ## Phrases that have already been rendered are just cache hits, and renders that are already in
+                    ## progress will be shared by the cache
+                    file_path = await self.speech_cog.build_audio_file(
+                        phrase.message,
+                        ignore_char_limit=True,
+                        interaction=interaction
+                    )
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    LOGGER.debug(f"Unable to speculatively render phrase '{phrase.name}'. Skipping...", exc_info=e)
+                    continue
+
+                ## The audio cache will hold onto the file, so there's no need to hold onto this reference
+                self.speech_cog.tts_controller.delete(file_path)
+
+
     def remove_phrases(self):
         """Unloads the preset phrases from the bot's command list."""
 
         self.phrases = {}
         self.phrase_groups = {}
+        self.phrase_search_index = PhraseSearchIndex([])
 
 
     def add_phrase_commands(self):
@@ -149,28 +316,47 @@ class Phrases(DiscoverableCog):
     def init_phrases(self) -> int:
         """Initialize the phrases available to the bot"""
 
+        return self.apply_phrases(*self.load_phrases())
+
+
+    def load_phrases(self) -> tuple[dict[str, Phrase], dict[str, PhraseGroup], PhraseSearchIndex]:
+        """
+        Loads the phrases (and builds their search index) without touching the ones that are currently in use, so it's
+        safe to run in another thread. Phrase files that haven't changed since they were last loaded are reused.
+        """
+
         phrase_group_file_paths = self.phrase_file_manager.discover_phrase_groups(self.phrases_folder_path)
-        counter = 0
-        for phrase_file_path in phrase_group_file_paths:
-            starting_count = counter
-            phrase_group = self.phrase_file_manager.load_phrase_group(phrase_file_path)
 
-            phrase: Phrase
-            for phrase in phrase_group.phrases.values():
-                try:
-                    self.phrases[phrase.name] = phrase
-                except Exception as e:
-                    LOGGER.warning("Skipping...", exc_info=e)
-                else:
-                    counter += 1
+        phrases: dict[str, Phrase] = {}
+        phrase_groups: dict[str, PhraseGroup] = {}
+        for phrase_group in self.phrase_file_manager.load_phrase_groups(phrase_group_file_paths):
+            starting_count = len(phrases)
+            phrases.update(phrase_group.phrases)
 
             ## Ensure we don't add in empty phrase files into the groupings
             ## todo: this isn't necessary any more, is it?
-            if(counter > starting_count):
-                self.phrase_groups[phrase_group.key] = phrase_group
+            if (len(phrases) > starting_count):
+                phrase_groups[phrase_group.key] = phrase_group
+
+        return phrases, phrase_groups, PhraseSearchIndex(phrases.values())
+
+
+    def apply_phrases(
+            self,
+            phrases: dict[str, Phrase],
+            phrase_groups: dict[str, PhraseGroup],
+            phrase_search_index: PhraseSearchIndex
+    ) -> int:
+        """Swaps in the loaded phrases, and returns how many there are"""
 
-        LOGGER.info(f'Loaded {counter} phrase{"s" if counter != 1 else ""}.')
-        return counter
+        self.phrases = phrases
+        self.phrase_groups = phrase_groups
+        self.phrase_search_index = phrase_search_index
+        ## The autocomplete index persists between reloads, so only the phrases that changed need to be reindexed
+        self.phrase_autocomplete_index.update(phrases)
+
+        LOGGER.info(f'Loaded {len(phrases)} phrase{"s" if len(phrases) != 1 else ""}.')
+        return len(phrases)
 
 
     def build_phrase_command_string(self, phrase: Phrase, activation_str: str = None) -> str:
@@ -184,11 +370,18 @@ class Phrases(DiscoverableCog):
     async def random_command(self, interaction: Interaction, user: discord.Member = None):
         """Speaks a random phrase"""
 
-        phrase: Phrase = random.choice(list(self.phrases.values()))
+        ## Lean towards the phrases that get used the most, without ruling out anything that hasn't been used yet
+        phrases = list(self.phrases.values())
+        weights = [
+            1 + self.random_popularity_bias * self.phrase_usage_tracker.get_popularity(phrase.name, interaction.guild_id)
+            for phrase in phrases
+        ]
+        phrase: Phrase = random.choices(phrases, weights=weights)[0]
 
 
         async def callback(invoked_command: InvokedCommand):
             if (invoked_command.successful):
+                self.phrase_usage_tracker.record(phrase.name, interaction.guild_id)
                 await self.database_manager.store(interaction)
                 await interaction.response.send_message(
                     f"<@{interaction.user.id}> randomly chose **{self.build_phrase_command_string(phrase)}**"
@@ -213,11 +406,21 @@ class Phrases(DiscoverableCog):
             return Choice(name=f"{phrase.name} - {phrase.help or phrase.brief}", value=phrase.name)
 
 
-        if (current.strip() == ""):
-            phrases = random.choices(list(self.phrases.values()), k=5)
-            return [generate_choice(phrase) for phrase in phrases]
-        else:
-            return [generate_choice(phrase) for phrase in self.phrases.values() if phrase.name.startswith(current)]
+        ## Guilds that haven't used any phrases yet get the globally popular ones instead
+        phrases = self.phrase_autocomplete_index.search(
+            current,
+            lambda name: self.phrase_usage_tracker.get_popularity(name, interaction.guild_id),
+            lambda count: (
+                self.phrase_usage_tracker.get_most_popular(count, interaction.guild_id) or
+                self.phrase_usage_tracker.get_most_popular(count)
+            )
+        )
+
+        ## Get a head start on rendering the phrases that the user is narrowing in on
+        if (self.speculative_render_enabled and current.strip() != ""):
+            self.start_speculatively_rendering_phrases(interaction, phrases[:self.speculative_render_candidates])
+
+        return [generate_choice(phrase) for phrase in phrases]
 
 
     async def phrase_command(self, interaction: Interaction, name: str, user: discord.Member = None):
@@ -236,6 +439,7 @@ class Phrases(DiscoverableCog):
 
         async def callback(invoked_command: InvokedCommand):
             if (invoked_command.successful):
+                self.phrase_usage_tracker.record(phrase.name, interaction.guild_id)
                 await self.database_manager.store(interaction)
                 phrase_command_string = self.build_phrase_command_string(phrase)
                 await interaction.response.send_message(f"<@{interaction.user.id}> used **{phrase_command_string}**")
@@ -259,41 +463,10 @@ class Phrases(DiscoverableCog):
     async def find_command(self, interaction: Interaction, search: str, user: discord.Member = None):
         """Speaks the most similar phrase"""
 
-        def calc_substring_score(message: str, description: str) -> float:
-            """Scores a given string (message) based on how many of it's words exist in another string (description)"""
-
-            ## Todo: shrink instances of repeated letters down to a single letter in both message and description
-            ##       (ex. yeeeee => ye or reeeeeboot => rebot)
-
-            message_split = message.split(' ')
-            word_frequency = sum(word in description.split(' ') for word in message_split)
-
-            return word_frequency / len(message_split)
-
-
-        ## Strip all non alphanumeric and non whitespace characters out of the message
-        search = "".join(char for char in search.lower() if (char.isalnum() or char.isspace()))
-
-        most_similar_phrase = (None, 0)
-        phrase: Phrase
-        for phrase in self.phrases.values():
-            scores = []
-
-            ## Score the phrase
-            scores.append(
-                calc_substring_score(search, phrase.name) +
-                StringSimilarity.similarity(search, phrase.name) / 2
-            )
-            if (phrase.description is not None):
-                scores.append(
-                    calc_substring_score(search, phrase.description) +
-                    StringSimilarity.similarity(search, phrase.description) / 2
-                )
-
-            distance = sum(scores) / len(scores)
-            if (distance > most_similar_phrase[1]):
-                most_similar_phrase = (phrase, distance)
-
+        most_similar_phrase = self.phrase_search_index.search(
+            search,
+            lambda name: self.phrase_usage_tracker.get_popularity(name, interaction.guild_id)
+        )
         if (most_similar_phrase[1] < self.find_command_minimum_similarity):
             await self.database_manager.store(interaction, valid=False)
             await interaction.response.send_message(